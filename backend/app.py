@@ -1,42 +1,124 @@
 # --- backend/app.py ---
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-import xml.etree.ElementTree as ET
+import gzip
 import os
+import unicodedata
+from urllib.parse import quote
 from services.pdf_generator import generar_analisis_ventas_pdf
 from services.pdf_generator import generar_detalle_factura_pdf
+from services.pdf_generator import (
+    renderizar_analisis_ventas, renderizar_detalle_factura,
+    consultar_cache_analisis_ventas, consultar_cache_detalle_factura,
+    generar_lote_facturas_zip, crear_buffer_pdf, nombre_pdf_factura,
+)
+from services.trabajos import obtener_cola, ERROR
+from services.cache_pdf import obtener_cache_pdf
+from services.corridas import obtener_corridas, FacturaNoEncontrada
+from services.facturacion_paralela import MAX_TRABAJADORES_FACTURACION
 
 
 # Importamos TODAS las funciones que los endpoints van a necesitar
 from services.xml_manager import (
-    procesar_y_guardar_config_xml,
-    procesar_consumos_xml,
+    procesar_y_guardar_config_stream,
+    procesar_consumos_stream,
     obtener_datos_completos,
+    consultar_datos_paginados, LIMITE_PAGINA_CLIENTES,
+    resumen_uso,
     generar_facturacion_detallada, agregar_recurso,
+    detalles_factura_cliente,
+    resetear_datos,
 )
 
 app = Flask(__name__)
 CORS(app)
 
+TAMANO_BLOQUE_RESPUESTA = 64 * 1024
+UMBRAL_GZIP = 4 * 1024    # bytes de JSON desde los que la respuesta se comprime
+NIVEL_GZIP = 5            # compresión rápida; el JSON se reduce igual varias veces
+
+
+@app.after_request
+def comprimir_json(respuesta):
+    """
+    Comprime con gzip las respuestas JSON grandes (consultarDatos,
+    generarFactura...) cuando el cliente lo acepta. Las descargas que se
+    envían por bloques (PDF, ZIP) no se tocan.
+    """
+    if respuesta.mimetype != 'application/json' or respuesta.is_streamed or respuesta.direct_passthrough:
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in respuesta.headers or not request.accept_encodings['gzip']:
+        return respuesta
+    datos = respuesta.get_data()
+    if len(datos) >= UMBRAL_GZIP:
+        respuesta.set_data(gzip.compress(datos, compresslevel=NIVEL_GZIP))
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    return respuesta
+
+
+def _nombres_descarga(nombre_archivo):
+    """
+    Parámetros de Content-Disposition para `nombre_archivo` (RFC 6266),
+    igual que los arma send_file: si no es ASCII se agrega `filename*` en
+    UTF-8 y `filename` queda como respaldo sin acentos.
+    """
+    try:
+        nombre_archivo.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', nombre_archivo).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(nombre_archivo, safe='!#$&+-.^_`|~')}"}
+    return {'filename': nombre_archivo}
+
+
+def _transmitir_archivo(archivo, nombre_archivo, mimetype, clave_cache=None):
+    """
+    Envía un archivo abierto (buffer en memoria o PDF de la caché) por
+    bloques. Si `clave_cache` no es None, el PDF se guarda en la caché
+    después de enviar el último bloque.
+    """
+    archivo.seek(0, os.SEEK_END)
+    tamano = archivo.tell()
+    archivo.seek(0)
+
+    def bloques():
+        try:
+            while True:
+                bloque = archivo.read(TAMANO_BLOQUE_RESPUESTA)
+                if not bloque:
+                    break
+                yield bloque
+            if clave_cache is not None:
+                obtener_cache_pdf().guardar_archivo(clave_cache, archivo)
+        finally:
+            archivo.close()
+
+    respuesta = Response(bloques(), mimetype=mimetype)
+    respuesta.headers.set('Content-Disposition', 'attachment', **_nombres_descarga(nombre_archivo))
+    respuesta.headers['Content-Length'] = str(tamano)
+    return respuesta
+
 @app.route('/')
 def index():
     return "¡Servidor Backend de Tecnologías Chapinas funcionando!"
 
 @app.route('/api/cargarConfiguracion', methods=['POST'])
 def cargar_configuracion():
-    xml_data_string = request.data.decode('utf-8')
+    # ?modo=fusionar agrega/actualiza entidades en lugar de reemplazar todo
+    fusionar = request.args.get('modo') == 'fusionar'
     try:
-        summary = procesar_y_guardar_config_xml(xml_data_string)
+        # Se lee el cuerpo por partes, igual que en registrarConsumo
+        summary = procesar_y_guardar_config_stream(request.stream, fusionar)
         return jsonify({"mensaje": "Archivo de configuración cargado exitosamente.", "resumen_de_carga": summary}), 200
     except Exception as e:
         return jsonify({"error": f"Error al procesar configuración: {e}"}), 500
 
 @app.route('/api/registrarConsumo', methods=['POST'])
 def registrar_consumo():
-    xml_data_string = request.data.decode('utf-8')
     try:
-        resumen = procesar_consumos_xml(xml_data_string)
+        # Se lee el cuerpo por partes; nunca se carga el archivo completo en memoria
+        resumen = procesar_consumos_stream(request.stream)
         return jsonify({"mensaje": "Se procesó el listado de consumos.", "resumen_del_proceso": resumen}), 200
     except FileNotFoundError:
         return jsonify({"error": "El archivo data.xml no existe. Cargue una configuración primero."}), 404
@@ -60,16 +142,44 @@ def endpoint_crear_recurso():
             "mensaje": "Recurso almacenado en XML exitosamente",
             "recurso": recurso_creado
         }), 201 # 201 Created es el código correcto para una creación exitosa
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         print(f"Error al crear recurso: {e}")
         return jsonify({"error": "Ocurrió un error interno al crear el recurso."}), 500
 
 
+PARAMETROS_CONSULTA = ('cursor', 'limite', 'nit', 'estado', 'tipoRecurso', 'excluir')
+
+def _lista_parametro(nombre):
+    """Valores separados por coma de un parámetro de la URL."""
+    return [v for v in request.args.get(nombre, '').split(',') if v]
+
 @app.route('/api/consultarDatos', methods=['GET'])
 def consultar_datos():
+    """
+    Sin parámetros devuelve todo, como siempre. Con alguno de ellos devuelve
+    una página de clientes armada desde el índice del almacén:
+      ?limite=50&cursor=<siguiente_cursor>  paginación de clientes
+      ?nit=A,B  ?estado=Vigente  ?tipoRecurso=Hardware  filtros
+      ?excluir=listaConsumos,listaCategorias  campos que no se envían
+    """
+    args = request.args
     try:
-        datos_completos = obtener_datos_completos()
-        return jsonify(datos_completos)
+        if not any(p in args for p in PARAMETROS_CONSULTA):
+            datos_completos = obtener_datos_completos()
+            return jsonify(datos_completos)
+        pagina = consultar_datos_paginados(
+            cursor=args.get('cursor') or None,
+            limite=args.get('limite', LIMITE_PAGINA_CLIENTES, type=int),
+            nits=_lista_parametro('nit') or None,
+            estado=args.get('estado') or None,
+            tipo_recurso=args.get('tipoRecurso') or None,
+            excluir=frozenset(_lista_parametro('excluir')),
+        )
+        return jsonify(pagina)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except FileNotFoundError:
         return jsonify({"error": "No se han cargado datos. El archivo data.xml no existe."}), 404
     except Exception as e:
@@ -85,30 +195,82 @@ def endpoint_generar_factura():
 
     if not fecha_inicio or not fecha_fin:
         return jsonify({"error": "Debe proporcionar fecha_inicio y fecha_fin"}), 400
-    
-    try:
-        resultado = generar_facturacion_detallada(fecha_inicio, fecha_fin)
+    # Procesos para facturar en paralelo; sin el parámetro se usa el valor configurado
+    trabajadores = data.get('trabajadores')
+    if trabajadores is not None and (not isinstance(trabajadores, int) or isinstance(trabajadores, bool)
+                                     or not 0 <= trabajadores <= MAX_TRABAJADORES_FACTURACION):
+        return jsonify({"error": f"trabajadores debe ser un entero entre 0 y {MAX_TRABAJADORES_FACTURACION}"}), 400
 
-        return jsonify({
+    try:
+        resultado = generar_facturacion_detallada(fecha_inicio, fecha_fin, trabajadores)
+        # La corrida queda guardada; cada factura se puede pedir luego por su id
+        id_corrida = obtener_corridas().crear(fecha_inicio, fecha_fin, resultado['facturas'],
+                                              resultado['detalles_consumo'])
 
+        respuesta = {
              "mensaje": f"Se generaron {len(resultado['facturas'])} facturas...",
+            "id_corrida": id_corrida,
             "facturas": resultado['facturas'], # Extraemos solo las facturas
-            "detalles_consumo": resultado['detalles_consumo']
-        })
+            "consumos_sin_fecha_valida": resultado['consumos_sin_fecha_valida'],
+        }
+        # Quien solo usa la corrida puede pedir que no se envíen los detalles
+        if data.get('incluir_detalles', True):
+            respuesta["detalles_consumo"] = resultado['detalles_consumo']
+        return jsonify(respuesta)
     except Exception as e:
         print(f"Error al generar facturación: {e}")
         return jsonify({"error": "Ocurrió un error interno al generar la facturación."}), 500
 
 
+@app.route('/api/corridas/<id_corrida>', methods=['GET'])
+def endpoint_corrida(id_corrida):
+    resumen = obtener_corridas().resumen(id_corrida)
+    if resumen is None:
+        return jsonify({"error": "No existe una corrida con ese id."}), 404
+    return jsonify(resumen)
+
+
+@app.route('/api/corridas/<id_corrida>/facturas/<numero_factura>', methods=['GET'])
+def endpoint_factura_corrida(id_corrida, numero_factura):
+    factura = obtener_corridas().factura(id_corrida, numero_factura)
+    if factura is None:
+        return jsonify({"error": "No existe esa factura en la corrida indicada."}), 404
+    return jsonify(factura)
+
+
+@app.route('/api/uso', methods=['GET'])
+def endpoint_uso():
+    """
+    Totales de uso de un rango desde los agregados diarios, sin refacturar:
+    ?fecha_inicio=AAAA-MM-DD&fecha_fin=AAAA-MM-DD&agrupar=cliente|instancia|recurso|categoria|dia
+    y opcionalmente &nit=... para limitarlo a un cliente.
+    """
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
+    if not fecha_inicio or not fecha_fin:
+        return jsonify({"error": "Debe proporcionar fecha_inicio y fecha_fin"}), 400
+    try:
+        filas = resumen_uso(fecha_inicio, fecha_fin, request.args.get('agrupar', 'cliente'),
+                            request.args.get('nit') or None)
+        return jsonify({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "uso": filas})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({"error": "No se han cargado datos. El archivo data.xml no existe."}), 404
+    except Exception as e:
+        print(f"Error al consultar el uso: {e}")
+        return jsonify({"error": "Ocurrió un error interno al consultar el uso."}), 500
+
+
 @app.route('/api/reporteVentas', methods=['POST'])
 def endpoint_reporte_ventas():
     data = request.get_json()
     fecha_inicio = data.get('fecha_inicio')
     fecha_fin = data.get('fecha_fin')
     try:
-        pdf_path = generar_analisis_ventas_pdf(fecha_inicio, fecha_fin)
-        # Esta línea mágica envía el archivo al navegador para que se descargue
-        return send_file(pdf_path, as_attachment=True)
+        archivo, clave = generar_analisis_ventas_pdf(fecha_inicio, fecha_fin)
+        # Se envía el PDF como descarga, directo desde memoria o desde la caché
+        return _transmitir_archivo(archivo, 'reporte_ventas.pdf', 'application/pdf', clave)
     except Exception as e:
         print(f"Error al generar reporte PDF: {e}")
         return jsonify({"error": "Ocurrió un error al generar el reporte."}), 500
@@ -120,10 +282,8 @@ def endpoint_resetear_sistema():
     Endpoint para eliminar el archivo data.xml y reiniciar el estado del sistema.
     """
     try:
-        # La ruta a nuestro archivo de "base de datos"
-        db_file_path = os.path.join(os.path.dirname(__file__), 'data.xml')
-        if os.path.exists(db_file_path):
-            os.remove(db_file_path)
+        # Borra data.xml y vacía también el almacén en memoria
+        resetear_datos()
         return jsonify({"mensaje": "El sistema ha sido reseteado. Todos los datos han sido eliminados."})
     except Exception as e:
         print(f"Error al resetear el sistema: {e}")
@@ -132,18 +292,130 @@ def endpoint_resetear_sistema():
 
 @app.route('/api/detalleFactura', methods=['POST'])
 def endpoint_detalle_factura():
-    # Esta vez, el frontend nos enviará los datos ya calculados
+    # El frontend envía {id_corrida, numero_factura} de una corrida guardada;
+    # también se aceptan la factura con sus detalles o con el rango facturado
     datos_factura = request.get_json()
     if not datos_factura:
         return jsonify({"error": "No se recibieron datos de la factura"}), 400
     
     try:
-        pdf_path = generar_detalle_factura_pdf(datos_factura)
-        return send_file(pdf_path, as_attachment=True)
+        archivo, clave = generar_detalle_factura_pdf(datos_factura)
+        nombre_archivo = nombre_pdf_factura(datos_factura)
+        return _transmitir_archivo(archivo, nombre_archivo, 'application/pdf', clave)
+    except FacturaNoEncontrada as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         print(f"Error al generar detalle de factura: {e}")
         return jsonify({"error": "Ocurrió un error al generar el detalle de la factura."}), 500
-    
+
+
+@app.route('/api/facturasLote', methods=['POST'])
+def endpoint_facturas_lote():
+    """
+    Dibuja en paralelo el PDF de cada factura de una corrida y devuelve un ZIP.
+    Acepta {id_corrida} de una corrida guardada, el resultado de
+    generarFactura ({facturas, detalles_consumo}), las facturas con el rango
+    facturado en lugar de los detalles, o solo un rango {fecha_inicio,
+    fecha_fin} para facturarlo aquí mismo.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No se recibieron datos de facturación"}), 400
+    try:
+        if 'id_corrida' in data:
+            data = obtener_corridas().completa(data['id_corrida'])
+            if data is None:
+                return jsonify({"error": "No existe una corrida con ese id."}), 404
+        elif 'detalles_consumo' not in data:
+            if not data.get('fecha_inicio') or not data.get('fecha_fin'):
+                return jsonify({"error": "Debe proporcionar los detalles o fecha_inicio y fecha_fin"}), 400
+            if 'facturas' in data:
+                data = {"facturas": data['facturas'],
+                        "detalles_consumo": detalles_factura_cliente(data['fecha_inicio'], data['fecha_fin'])}
+            else:
+                data = generar_facturacion_detallada(data['fecha_inicio'], data['fecha_fin'])
+        archivo_zip = crear_buffer_pdf()
+        estadisticas = generar_lote_facturas_zip(data, archivo_zip, obtener_cola())
+        print(f"Lote de facturas: {estadisticas['facturas']} en {estadisticas['segundos']} s "
+              f"({estadisticas['facturas_por_segundo']} facturas/s)")
+        respuesta = _transmitir_archivo(archivo_zip, 'facturas.zip', 'application/zip')
+        respuesta.headers['X-Facturas'] = str(estadisticas['facturas'])
+        respuesta.headers['X-Facturas-Por-Segundo'] = str(estadisticas['facturas_por_segundo'])
+        return respuesta
+    except Exception as e:
+        print(f"Error al generar el lote de facturas: {e}")
+        return jsonify({"error": "Ocurrió un error al generar el lote de facturas."}), 500
+
+
+# --- TRABAJOS EN SEGUNDO PLANO PARA PDFs ---
+# En lugar de esperar el PDF, el cliente envía el trabajo, consulta su
+# estado y lo descarga cuando está terminado. Si el PDF ya está en la
+# caché, el trabajo nace terminado.
+def _encolar_pdf(tipo, clave, ruta, funcion, datos, nombre_archivo):
+    cola = obtener_cola()
+    if ruta is not None:
+        return cola.registrar_terminado(tipo, ruta, nombre_archivo)
+    cache = obtener_cache_pdf()
+    return cola.enviar(tipo, funcion, datos, nombre_archivo, ruta=cache.ruta_temporal(),
+                       al_terminar=lambda ruta_escrita: cache.guardar(clave, ruta_escrita))
+
+@app.route('/api/trabajos/reporteVentas', methods=['POST'])
+def endpoint_trabajo_reporte_ventas():
+    data = request.get_json()
+    if not data or not data.get('fecha_inicio') or not data.get('fecha_fin'):
+        return jsonify({"error": "Debe proporcionar fecha_inicio y fecha_fin"}), 400
+    try:
+        clave, ruta, datos = consultar_cache_analisis_ventas(data['fecha_inicio'], data['fecha_fin'])
+        id_trabajo = _encolar_pdf('reporteVentas', clave, ruta, renderizar_analisis_ventas, datos, 'reporte_ventas.pdf')
+        return jsonify(obtener_cola().estado(id_trabajo)), 202
+    except Exception as e:
+        print(f"Error al encolar reporte PDF: {e}")
+        return jsonify({"error": "Ocurrió un error al encolar el reporte."}), 500
+
+
+@app.route('/api/trabajos/detalleFactura', methods=['POST'])
+def endpoint_trabajo_detalle_factura():
+    datos_factura = request.get_json()
+    if not datos_factura:
+        return jsonify({"error": "No se recibieron datos de la factura"}), 400
+    try:
+        clave, ruta, datos = consultar_cache_detalle_factura(datos_factura)
+        nombre_archivo = nombre_pdf_factura(datos_factura)
+        id_trabajo = _encolar_pdf('detalleFactura', clave, ruta, renderizar_detalle_factura, datos, nombre_archivo)
+        return jsonify(obtener_cola().estado(id_trabajo)), 202
+    except FacturaNoEncontrada as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error al encolar detalle de factura: {e}")
+        return jsonify({"error": "Ocurrió un error al encolar el detalle de la factura."}), 500
+
+
+@app.route('/api/trabajos/<id_trabajo>', methods=['GET'])
+def endpoint_estado_trabajo(id_trabajo):
+    estado = obtener_cola().estado(id_trabajo)
+    if estado is None:
+        return jsonify({"error": "No existe un trabajo con ese id."}), 404
+    return jsonify(estado)
+
+
+@app.route('/api/trabajos/<id_trabajo>/descarga', methods=['GET'])
+def endpoint_descarga_trabajo(id_trabajo):
+    estado = obtener_cola().estado(id_trabajo)
+    if estado is None:
+        return jsonify({"error": "No existe un trabajo con ese id."}), 404
+    resultado = obtener_cola().resultado(id_trabajo)
+    if resultado is None:
+        codigo = 500 if estado['estado'] == ERROR else 409
+        return jsonify({"error": "El trabajo no tiene un PDF disponible.", "trabajo": estado}), codigo
+    ruta, nombre_archivo = resultado
+    try:
+        # Se abre una sola vez: la caché u otro worker pueden borrarlo en cualquier momento
+        archivo = open(ruta, 'rb')
+    except FileNotFoundError:
+        # La caché ya descartó el PDF; hay que volver a pedirlo
+        return jsonify({"error": "El PDF del trabajo ya no está disponible.", "trabajo": estado}), 410
+    return send_file(archivo, mimetype='application/pdf', as_attachment=True, download_name=nombre_archivo)
+
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
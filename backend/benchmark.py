@@ -0,0 +1,220 @@
+# --- backend/benchmark.py ---
+#
+# Mide las operaciones principales del backend sobre datos sintéticos
+# (ver generar_datos.py) y entrega el resultado como JSON, para comparar
+# corridas entre versiones. Por cada operación informa la latencia p50 y
+# p99, la media, las unidades procesadas por segundo (clientes, consumos
+# o PDFs, según la operación) y el pico de memoria residente del proceso
+# al terminarla.
+#
+#   python benchmark.py --clientes 10000 --instancias 50000 --consumos 10000000 --salida resultado.json
+#
+# Todo se hace en un directorio temporal: el data.xml, la bitácora, la
+# caché de PDFs y la secuencia de facturas del servidor no se tocan. La
+# carga de consumos se mide una sola vez (repetirla duplicaría los datos);
+# las demás operaciones se repiten --repeticiones veces. La memoria de
+# facturación se vacía antes de cada repetición, así se mide el cálculo y
+# no la respuesta memorizada; los PDFs tampoco se guardan en la caché.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+import generar_datos
+from services import almacen as modulo_almacen
+from services import cache_pdf, corridas, secuencia_facturas, trabajos
+from services import facturacion_columnar
+from services.almacen import obtener_almacen
+from services.xml_manager import (
+    procesar_y_guardar_config_stream, procesar_consumos_stream,
+    obtener_datos_completos, generar_facturacion_detallada,
+)
+from services.pdf_generator import generar_analisis_ventas_pdf, generar_detalle_factura_pdf
+
+
+def _aislar_en(directorio):
+    """Apunta los archivos del servidor a `directorio`; debe llamarse antes de usar el almacén."""
+    modulo_almacen.DB_FILE = os.path.join(directorio, 'data.xml')
+    modulo_almacen.DIR_BITACORA = os.path.join(directorio, 'consumos')
+    cache_pdf.DIR_CACHE_PDF = os.path.join(directorio, 'cache_pdf')
+    corridas.DIR_CORRIDAS = os.path.join(directorio, 'corridas')
+    secuencia_facturas.RUTA_SECUENCIA = os.path.join(directorio, 'secuencia_facturas')
+    trabajos.DIR_TRABAJOS = os.path.join(directorio, 'trabajos')
+
+
+def pico_rss_mb():
+    """Pico de memoria residente del proceso hasta ahora, o None si no se puede medir."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo informa en KB y macOS en bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _percentil(valores_ordenados, percentil):
+    """Percentil por rango más cercano."""
+    posicion = max(0, -(-len(valores_ordenados) * percentil // 100) - 1)
+    return valores_ordenados[posicion]
+
+
+def medir(funcion, repeticiones, unidades, preparar=None):
+    """
+    Ejecuta funcion(i) `repeticiones` veces; `preparar` se llama antes de
+    cada una sin contar su tiempo. `unidades` es lo que procesa cada
+    repetición (para el rendimiento por segundo).
+    """
+    tiempos = []
+    for i in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append(time.perf_counter() - inicio)
+    ordenados = sorted(tiempos)
+    total = sum(tiempos)
+    return {
+        "repeticiones": repeticiones,
+        "unidades_por_repeticion": unidades,
+        "p50_ms": round(_percentil(ordenados, 50) * 1000, 3),
+        "p99_ms": round(_percentil(ordenados, 99) * 1000, 3),
+        "media_ms": round(total / repeticiones * 1000, 3),
+        "unidades_por_segundo": round(unidades * repeticiones / total, 2) if total > 0 else None,
+        "rss_pico_mb": pico_rss_mb(),
+    }
+
+
+def _informar(mensaje):
+    print(mensaje, file=sys.stderr, flush=True)
+
+
+def ejecutar(ruta_configuracion, ruta_consumos, clientes, consumos, fecha_inicio, fecha_fin,
+             repeticiones=5, trabajadores=None):
+    """Corre todas las mediciones y devuelve {operación: resultado}."""
+    resultados = {}
+
+    def cargar_configuracion(_):
+        with open(ruta_configuracion, 'rb') as archivo:
+            procesar_y_guardar_config_stream(archivo)
+
+    _informar("Cargando configuración...")
+    resultados["procesar_y_guardar_config"] = medir(cargar_configuracion, repeticiones, clientes)
+
+    def cargar_consumos(_):
+        with open(ruta_consumos, 'rb') as archivo:
+            procesar_consumos_stream(archivo)
+
+    _informar("Cargando consumos...")
+    resultados["procesar_consumos"] = medir(cargar_consumos, 1, consumos)
+    almacen = obtener_almacen()
+    # Lo que quedó en la bitácora se lleva a data.xml antes de seguir midiendo; si el
+    # compactador ya había sellado el segmento, se espera a que termine de escribir
+    almacen.compactar_todo()
+    if almacen.bitacora.pendientes or almacen._atributos_xml().get('segmentoCompactado') != str(almacen.bitacora.compactado):
+        raise RuntimeError("La bitácora no quedó compactada antes de medir.")
+
+    _informar("Consultando datos completos...")
+    resultados["obtener_datos_completos"] = medir(lambda _: obtener_datos_completos(), repeticiones, clientes)
+
+    facturacion = {}
+
+    def facturar(_):
+        facturacion.update(generar_facturacion_detallada(fecha_inicio, fecha_fin, trabajadores))
+
+    _informar("Facturando...")
+    resultados["generar_facturacion_detallada"] = medir(
+        facturar, repeticiones, consumos, preparar=almacen.memo_facturacion.vaciar)
+
+    def analisis_ventas(_):
+        archivo, _clave = generar_analisis_ventas_pdf(fecha_inicio, fecha_fin)
+        archivo.close()
+
+    _informar("Dibujando reportes de ventas...")
+    resultados["generar_analisis_ventas_pdf"] = medir(
+        analisis_ventas, repeticiones, 1, preparar=almacen.memo_facturacion.vaciar)
+
+    facturas = facturacion.get("facturas", [])
+    if facturas:
+        detalles_por_nit = {}
+        for detalle in facturacion["detalles_consumo"]:
+            detalles_por_nit.setdefault(detalle["nit_cliente"], []).append(detalle)
+
+        def detalle_factura(i):
+            factura = facturas[i % len(facturas)]
+            archivo, _clave = generar_detalle_factura_pdf(
+                {"factura_info": factura, "detalles_consumo": detalles_por_nit[factura["nit_cliente"]]})
+            archivo.close()
+
+        _informar("Dibujando facturas...")
+        resultados["generar_detalle_factura_pdf"] = medir(detalle_factura, repeticiones, 1)
+    return resultados
+
+
+def main():
+    parser = generar_datos._argumentos(argparse.ArgumentParser(
+        description="Mide el backend con datos sintéticos y escribe el resultado como JSON."))
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--trabajadores', type=int, default=None,
+                        help="procesos para la facturación (por defecto, el valor del servidor)")
+    parser.add_argument('--datos', help="directorio con archivos ya generados (con los mismos parámetros)")
+    parser.add_argument('--salida', help="archivo donde escribir el JSON (por defecto, la salida estándar)")
+    args = parser.parse_args()
+    if args.repeticiones < 1:
+        parser.error("--repeticiones debe ser al menos 1")
+
+    directorio = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        _aislar_en(directorio)
+        if args.datos:
+            ruta_configuracion = os.path.join(args.datos, generar_datos.NOMBRE_CONFIGURACION)
+            ruta_consumos = os.path.join(args.datos, generar_datos.NOMBRE_CONSUMOS)
+        else:
+            _informar("Generando datos...")
+            ruta_configuracion, ruta_consumos = generar_datos.generar(
+                os.path.join(directorio, 'entrada'), args.clientes, args.instancias,
+                args.consumos, args.dias, args.semilla)
+
+        # Todo el período de los consumos generados
+        fecha_inicio = generar_datos.FECHA_BASE
+        fecha_fin = fecha_inicio + timedelta(days=args.dias - 1)
+        operaciones = ejecutar(ruta_configuracion, ruta_consumos, args.clientes, args.consumos,
+                               fecha_inicio.isoformat(), fecha_fin.isoformat(),
+                               args.repeticiones, args.trabajadores)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    resultado = {
+        "parametros": {
+            "clientes": args.clientes, "instancias": args.instancias, "consumos": args.consumos,
+            "dias": args.dias, "semilla": args.semilla, "repeticiones": args.repeticiones,
+            "trabajadores": args.trabajadores,
+        },
+        "entorno": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "procesadores": os.cpu_count(),
+            "numpy": facturacion_columnar.NUMPY_DISPONIBLE,
+        },
+        "operaciones": operaciones,
+        "rss_pico_mb": pico_rss_mb(),
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# --- backend/generar_datos.py ---
+#
+# Genera archivos de entrada sintéticos con el mismo formato que los de
+# docs/entrada_prueba (msn_configuracion.xml y msn_consumos.xml), al
+# tamaño que se pida. Los archivos se escriben por partes, así que la
+# memoria no depende de la cantidad de consumos. Con la misma semilla se
+# obtienen siempre los mismos archivos.
+#
+#   python generar_datos.py --clientes 10000 --instancias 50000 --consumos 10000000 --salida datos_prueba
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+from xml.sax.saxutils import escape, quoteattr
+
+NOMBRE_CONFIGURACION = 'msn_configuracion.xml'
+NOMBRE_CONSUMOS = 'msn_consumos.xml'
+
+_TIPOS_RECURSO = ('HARDWARE', 'SOFTWARE')
+_CARGAS_TRABAJO = ('Alta', 'Media', 'Baja')
+_ESTADOS_INSTANCIA = ('VIGENTE', 'CANCELADA')
+_LINEAS_POR_ESCRITURA = 10000
+FECHA_BASE = date(2023, 1, 1)   # los consumos empiezan este día
+
+
+def _nit(numero):
+    return f"{numero:07d}-{numero % 10}"
+
+
+def _texto_fecha(dia):
+    return dia.strftime('%d/%m/%Y')
+
+
+def _elemento(tag, valor):
+    return f"<{tag}>{escape(str(valor))}</{tag}>"
+
+
+def instancias_por_cliente(clientes, instancias):
+    """Reparte las instancias entre los clientes lo más parejo posible."""
+    base, resto = divmod(instancias, clientes)
+    return [base + (1 if n < resto else 0) for n in range(clientes)]
+
+
+def escribir_configuracion(ruta, clientes, instancias, recursos=10, categorias=4,
+                           configuraciones_por_categoria=3, fecha_base=FECHA_BASE, semilla=0):
+    """
+    Escribe el archivo de configuración. Devuelve [(nit, cantidad de
+    instancias)] en el orden del archivo; las instancias de cada cliente
+    tienen ids 1..cantidad.
+    """
+    azar = random.Random(semilla)
+    total_configuraciones = categorias * configuraciones_por_categoria
+    reparto = instancias_por_cliente(clientes, instancias)
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write('<?xml version="1.0" encoding="UTF-8"?>\n<archivoConfiguraciones>\n<listaRecursos>\n')
+        for id_recurso in range(1, recursos + 1):
+            archivo.write(
+                f'<recurso id="{id_recurso}">{_elemento("nombre", f"Recurso {id_recurso}")}'
+                f'{_elemento("abreviatura", f"R{id_recurso}")}{_elemento("metrica", "Gb")}'
+                f'{_elemento("tipo", _TIPOS_RECURSO[id_recurso % 2])}'
+                f'{_elemento("valorXhora", azar.randint(5, 100))}</recurso>\n')
+        archivo.write('</listaRecursos>\n<listaCategorias>\n')
+        id_configuracion = 0
+        for id_categoria in range(1, categorias + 1):
+            archivo.write(
+                f'<categoria id="{id_categoria}">{_elemento("nombre", f"Categoria {id_categoria}")}'
+                f'{_elemento("descripcion", f"Categoría de prueba {id_categoria}")}'
+                f'{_elemento("cargaTrabajo", _CARGAS_TRABAJO[id_categoria % 3])}<listaConfiguraciones>\n')
+            for _ in range(configuraciones_por_categoria):
+                id_configuracion += 1
+                usados = azar.sample(range(1, recursos + 1), min(recursos, azar.randint(1, 4)))
+                lista = ''.join(f'<recurso id="{r}">{azar.randint(1, 64)}</recurso>' for r in sorted(usados))
+                archivo.write(
+                    f'<configuracion id="{id_configuracion}">{_elemento("nombre", f"C{id_categoria}C{id_configuracion}")}'
+                    f'{_elemento("descripcion", "Configuración de prueba")}'
+                    f'<recursosConfiguracion>{lista}</recursosConfiguracion></configuracion>\n')
+            archivo.write('</listaConfiguraciones></categoria>\n')
+        archivo.write('</listaCategorias>\n<listaClientes>\n')
+
+        clientes_generados = []
+        lineas = []
+        for numero, cantidad in enumerate(reparto, start=1):
+            nit = _nit(numero)
+            partes = [f'<cliente nit={quoteattr(nit)}>{_elemento("nombre", f"Cliente {numero}")}'
+                      f'{_elemento("usuario", f"usuario{numero}")}{_elemento("clave", "clave")}'
+                      f'{_elemento("direccion", f"Zona {numero % 25 + 1}")}'
+                      f'{_elemento("correoElectronico", f"cliente{numero}@ejemplo.com")}<listaInstancias>']
+            for id_instancia in range(1, cantidad + 1):
+                inicio = fecha_base - timedelta(days=azar.randint(0, 3650))
+                # Igual que en los archivos de ejemplo, a veces la fecha viene dentro de una descripción
+                texto_inicio = _texto_fecha(inicio)
+                if azar.random() < 0.2:
+                    texto_inicio = f"fecha de inicio {texto_inicio}"
+                partes.append(
+                    f'<instancia id="{id_instancia}">'
+                    f'{_elemento("idConfiguracion", azar.randint(1, total_configuraciones))}'
+                    f'{_elemento("nombre", f"Instancia {id_instancia}")}{_elemento("fechaInicio", texto_inicio)}'
+                    f'{_elemento("estado", _ESTADOS_INSTANCIA[azar.random() < 0.1])}'
+                    f'{_elemento("fechaFinal", _texto_fecha(fecha_base + timedelta(days=365)))}</instancia>')
+            partes.append('</listaInstancias></cliente>\n')
+            lineas.append(''.join(partes))
+            clientes_generados.append((nit, cantidad))
+            if len(lineas) >= _LINEAS_POR_ESCRITURA:
+                archivo.write(''.join(lineas))
+                lineas = []
+        archivo.write(''.join(lineas))
+        archivo.write('</listaClientes>\n</archivoConfiguraciones>\n')
+    return clientes_generados
+
+
+def escribir_consumos(ruta, clientes_generados, consumos, dias=365, fecha_base=FECHA_BASE, semilla=0):
+    """
+    Escribe `consumos` consumos de instancias al azar, con fechas dentro de
+    los `dias` que siguen a `fecha_base`.
+    """
+    azar = random.Random(semilla + 1)
+    instancias = [(nit, id_instancia) for nit, cantidad in clientes_generados
+                  for id_instancia in range(1, cantidad + 1)]
+    if not instancias and consumos:
+        raise ValueError("No hay instancias a las que asignar consumos.")
+    # Los textos de fecha se repiten mucho, igual que en la realidad
+    textos_dia = [_texto_fecha(fecha_base + timedelta(days=d)) for d in range(dias)]
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write('<?xml version="1.0" encoding="UTF-8"?>\n<listadoConsumos>\n')
+        lineas = []
+        for _ in range(consumos):
+            nit, id_instancia = instancias[azar.randrange(len(instancias))]
+            minutos = azar.randrange(24 * 60)
+            lineas.append(
+                f'<consumo nitCliente="{nit}" idInstancia="{id_instancia}">'
+                f'<tiempo>{azar.randint(1, 2400) / 100}</tiempo>'
+                f'<fechaHora>{textos_dia[azar.randrange(dias)]} {minutos // 60:02d}:{minutos % 60:02d}</fechaHora>'
+                f'</consumo>\n')
+            if len(lineas) >= _LINEAS_POR_ESCRITURA:
+                archivo.write(''.join(lineas))
+                lineas = []
+        archivo.write(''.join(lineas))
+        archivo.write('</listadoConsumos>\n')
+
+
+def generar(directorio, clientes, instancias, consumos, dias=365, semilla=0):
+    """Escribe ambos archivos en `directorio` y devuelve sus rutas (configuración, consumos)."""
+    if clientes < 1 or instancias < 0 or consumos < 0 or dias < 1:
+        raise ValueError("Se necesita al menos un cliente y un día; las cantidades no pueden ser negativas.")
+    os.makedirs(directorio, exist_ok=True)
+    ruta_configuracion = os.path.join(directorio, NOMBRE_CONFIGURACION)
+    ruta_consumos = os.path.join(directorio, NOMBRE_CONSUMOS)
+    clientes_generados = escribir_configuracion(ruta_configuracion, clientes, instancias, semilla=semilla)
+    escribir_consumos(ruta_consumos, clientes_generados, consumos, dias=dias, semilla=semilla)
+    return ruta_configuracion, ruta_consumos
+
+
+def _argumentos(parser):
+    parser.add_argument('--clientes', type=int, default=1000)
+    parser.add_argument('--instancias', type=int, default=5000)
+    parser.add_argument('--consumos', type=int, default=100000)
+    parser.add_argument('--dias', type=int, default=365, help="días que abarcan las fechas de los consumos")
+    parser.add_argument('--semilla', type=int, default=0)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = _argumentos(argparse.ArgumentParser(description="Genera archivos de entrada sintéticos."))
+    parser.add_argument('--salida', default='datos_prueba', help="directorio donde se escriben los archivos")
+    args = parser.parse_args()
+    for ruta in generar(args.salida, args.clientes, args.instancias, args.consumos, args.dias, args.semilla):
+        print(f"{ruta}: {os.path.getsize(ruta)} bytes")
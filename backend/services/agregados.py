@@ -0,0 +1,45 @@
+# --- backend/services/agregados.py ---
+#
+# Totales de uso precalculados por día. Por cada día (ordinal de la fecha)
+# se guarda la suma de horas de cada instancia, y se actualiza con cada
+# consumo que llega. Un total por rango suma a lo más una fila por
+# instancia y día, sin recorrer los consumos. Los costos se derivan de
+# esas horas con la tabla de tarifas vigente al consultar.
+
+from bisect import bisect_left, bisect_right, insort
+
+
+class AgregadosDiarios:
+    def __init__(self):
+        self._dias = []        # ordinales con al menos un consumo, ordenados
+        self._por_dia = {}     # ordinal -> {(nit, id_instancia): horas}
+        self.consumos_sin_tiempo = 0   # consumos cuyo tiempo no es numérico
+
+    def agregar(self, nit, id_instancia, ordinal, horas):
+        if ordinal is None:
+            # Igual que en la facturación, un consumo sin fecha no entra en ningún rango
+            return
+        if horas is None:
+            self.consumos_sin_tiempo += 1
+            return
+        fila = self._por_dia.get(ordinal)
+        if fila is None:
+            fila = self._por_dia[ordinal] = {}
+            insort(self._dias, ordinal)
+        clave = (nit, id_instancia)
+        fila[clave] = fila.get(clave, 0.0) + horas
+
+    def dias_en_rango(self, inicio_ordinal, fin_ordinal):
+        """Entrega (ordinal, {(nit, id_instancia): horas}) de cada día del rango, en orden."""
+        desde = bisect_left(self._dias, inicio_ordinal)
+        hasta = bisect_right(self._dias, fin_ordinal)
+        for ordinal in self._dias[desde:hasta]:
+            yield ordinal, self._por_dia[ordinal]
+
+    def horas_en_rango(self, inicio_ordinal, fin_ordinal):
+        """{(nit, id_instancia): horas} sumando las filas diarias del rango."""
+        totales = {}
+        for _, fila in self.dias_en_rango(inicio_ordinal, fin_ordinal):
+            for clave, horas in fila.items():
+                totales[clave] = totales.get(clave, 0.0) + horas
+        return totales
@@ -0,0 +1,776 @@
+# --- backend/services/almacen.py ---
+#
+# Almacén en memoria del backend. data.xml se lee una sola vez y se
+# mantiene como objetos indexados (recursos, categorías, configuraciones
+# y clientes). Los consumos nuevos solo se agregan a la bitácora de
+# consumos; un hilo compactador los incorpora a data.xml cada cierto
+# tiempo. Las lecturas nunca vuelven a usar el parser XML.
+#
+# Con varios procesos (por ejemplo, varios workers de gunicorn) cada uno
+# tiene su almacén en memoria y todos comparten data.xml y la bitácora:
+#   - Quien escribe en disco toma el bloqueo de disco (un archivo de
+#     bloqueo junto a data.xml) y antes se pone al día con lo que
+#     escribieron los demás, así ninguna carga pisa a otra.
+#   - data.xml se reemplaza siempre con un renombre atómico; nadie ve un
+#     archivo a medio escribir.
+#   - Las lecturas no toman el bloqueo de disco: trabajan sobre la memoria
+#     del proceso, que en cada petición lee las líneas nuevas de la
+#     bitácora. Con `bloqueo` solo toman una instantánea (listas copiadas,
+#     cantidades de consumos, versiones) y calculan sin él, así una
+#     facturación larga no detiene a las cargas.
+#   - Quien necesita ambos bloqueos los toma con `tomar_bloqueos`: nunca
+#     espera `bloqueo` teniendo el de disco, así una espera en un proceso
+#     no detiene a los demás.
+#   - El archivo de estado (junto a data.xml) dice hasta qué segmento
+#     compactó la última escritura y con qué configuración. Si solo hubo
+#     una compactación los demás procesos la adoptan sin recargar; si
+#     cambió la configuración recargan data.xml.
+#   - Una carga de configuración fusionada tampoco reescribe data.xml: se
+#     agrega a la bitácora como un registro más y cada proceso la aplica
+#     en el orden en que llegó, entre los consumos.
+#
+# Cada escritura de data.xml deja también una instantánea binaria (ver
+# instantanea.py); al recargar se usa esa instantánea en vez del XML si
+# corresponde a la misma escritura.
+
+import xml.etree.ElementTree as ET
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+from .modelos import Recurso, Categoria, Cliente, Consumo
+from .bitacora_consumos import BitacoraConsumos
+from .tarifas import construir_tabla_tarifas
+from .indice_fechas import IndiceFechas, consumos_por_instancia
+from .agregados import AgregadosDiarios
+from .facturacion_columnar import ColumnasConsumo
+from .fechas import normalizar_fecha
+from .memo_facturacion import MemoFacturacion
+from .bloqueo_archivo import BloqueoArchivo
+from .instantanea import Instantanea, escribir_instantanea
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'data.xml')
+DIR_BITACORA = os.path.join(os.path.dirname(__file__), '..', 'consumos')
+
+INTERVALO_COMPACTACION = 30      # segundos entre compactaciones
+UMBRAL_COMPACTACION = 100000     # consumos pendientes que adelantan la compactación
+INTENTOS_RECARGA = 5             # recargas seguidas antes de rendirse si la bitácora sigue cambiando
+
+
+class AlmacenDatos:
+    def __init__(self, ruta_xml, dir_bitacora):
+        self.ruta_xml = ruta_xml
+        self.bitacora = BitacoraConsumos(dir_bitacora)
+        self.bloqueo = threading.RLock()
+        # Ordena a los escritores de data.xml. Orden de los bloqueos:
+        # _bloqueo_escritura, luego bloqueo_disco, luego bloqueo
+        self._bloqueo_escritura = threading.RLock()
+        # Excluye a los demás procesos (y hilos) al escribir en disco
+        self.bloqueo_disco = BloqueoArchivo(f"{ruta_xml}.lock")
+        self.ruta_estado = f"{ruta_xml}.estado"
+        self.ruta_instantanea = f"{ruta_xml}.instantanea"
+        self._firma_disco = None
+        self._cargas = 0   # cuántas veces se recargó desde disco (ver guardar)
+        # Configuración cargada; cambia con cada escritura que no es solo compactación
+        self._id_config = None
+        self.version = 0
+        # Se incrementa solo cuando cambian recursos o configuraciones
+        self.version_config = 0
+        self._tarifas = None
+        self._tarifas_version = None
+        self._columnas_version = None
+        # Instantánea de la que se cargaron los datos; se cierra antes de reemplazar su archivo
+        self._instantanea = None
+        self.evento_compactar = threading.Event()
+        # Resultados de facturación recientes; ver memo_facturacion.py
+        self.memo_facturacion = MemoFacturacion()
+        self._vaciar()
+
+    def _vaciar(self):
+        self.recursos = {}         # id -> Recurso
+        self.categorias = {}       # id -> Categoria
+        self.configuraciones = {}  # id -> Configuracion
+        self.clientes = {}         # nit -> Cliente
+        self._posicion_cliente = {}  # nit -> posición en el orden de `clientes` (para paginar)
+        self._orden_clientes = []    # nits en orden de llegada
+        self.instancias = {}       # (nit, id_instancia) -> Instancia
+        # Se construye al primer uso y luego se mantiene con cada consumo nuevo
+        self._indice_fechas = None
+        self._columnas = None
+        self._agregados = None
+        self._sin_fecha = None     # consumos cuya fecha no se pudo interpretar
+        self.version_config += 1
+        self.memo_facturacion.vaciar()
+
+    # --- Sincronización con disco ---
+    def _firma_actual(self):
+        try:
+            return _firma(os.stat(self.ruta_xml))
+        except FileNotFoundError:
+            return None
+
+    def version_datos(self):
+        """
+        Identifica los datos en memoria por lo que hay en disco: la escritura
+        de data.xml que se cargó (su id de configuración) y hasta dónde se
+        leyó la bitácora. Todos los procesos al día con el disco dan la
+        misma versión, y se conserva al reiniciar.
+        """
+        with self.bloqueo:
+            # Un data.xml anterior al id de configuración se identifica por su firma
+            origen = self._id_config or repr(self._firma_disco)
+            return f"{origen}:{self.bitacora.posicion()}"
+
+    def existe(self):
+        return self._firma_disco is not None
+
+    def _leer_estado(self):
+        try:
+            with open(self.ruta_estado, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _escribir_estado(self, segmento, id_config):
+        temporal = f"{self.ruta_estado}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({"segmento_compactado": segmento, "config": id_config}, archivo)
+        os.replace(temporal, self.ruta_estado)
+
+    def sincronizar(self):
+        """
+        Se pone al día con el disco. Vuelve a leer data.xml solo si cambió
+        la configuración (por ejemplo, si otro proceso cargó una nueva o si
+        fue eliminado al resetear el sistema); si otro proceso solo compactó
+        se adopta sin recargar. Luego aplica los consumos que se agregaron
+        a la bitácora desde la última vez.
+        """
+        with self.bloqueo:
+            firma = self._firma_actual()
+            if firma != self._firma_disco:
+                if not self._adoptar_compactacion(firma):
+                    self._recargar()
+                    return
+            if self._firma_disco is None:
+                return
+            registros, completa = self.bitacora.leer_nuevos()
+            if not completa:
+                # Otro proceso compactó y borró segmentos que no alcanzamos a leer
+                self._recargar()
+                return
+            self._aplicar_registros(registros)
+
+    def _recargar(self):
+        """
+        Vuelve a cargar todo desde disco. Si la bitácora no se pudo leer
+        completa (otro proceso compactó y borró segmentos mientras tanto)
+        se empieza de nuevo, así nunca queda cargada a medias.
+        """
+        for _ in range(INTENTOS_RECARGA):
+            if self._cargar_desde_disco():
+                return
+        raise RuntimeError("No se pudo recargar data.xml: la bitácora cambió en cada intento.")
+
+    def _cargar_desde_disco(self):
+        """
+        Un intento de _recargar; devuelve False si hay que repetirlo.
+        data.xml se abre una sola vez: firma, atributos y contenido son de
+        la misma escritura aunque otro proceso lo reemplace mientras tanto.
+        """
+        self._vaciar()
+        self._id_config = None
+        self._firma_disco = None
+        self.bitacora.reiniciar()
+        self._cargas += 1
+        self.version += 1
+        try:
+            archivo = open(self.ruta_xml, 'rb')
+        except FileNotFoundError:
+            return True
+        with archivo:
+            firma = _firma(os.fstat(archivo.fileno()))
+            atributos = self._atributos_xml(archivo)
+            instantanea = Instantanea.abrir(self.ruta_instantanea)
+            if (instantanea is not None and atributos.get('idConfiguracion') is not None
+                    and atributos.get('idConfiguracion') == instantanea.id_config
+                    and atributos.get('segmentoCompactado') == str(instantanea.segmento_compactado)):
+                # La instantánea es de la misma escritura que data.xml: no hace falta parsearlo
+                self.reemplazar_contenido(*instantanea.cargar())
+                self._soltar_instantanea()
+                self._instantanea = instantanea
+            else:
+                if instantanea is not None:
+                    instantanea.cerrar()
+                archivo.seek(0)
+                self.cargar_desde_elemento(ET.parse(archivo).getroot())
+        self._id_config = atributos.get('idConfiguracion')
+        registros, completa = self.bitacora.leer_desde(int(atributos.get('segmentoCompactado', 0)))
+        if not completa:
+            return False
+        self._aplicar_registros(registros)
+        self._firma_disco = firma
+        return True
+
+    def _soltar_instantanea(self):
+        """Cierra el mmap de la instantánea cargada; lo que todavía se usa queda en memoria."""
+        instantanea, self._instantanea = self._instantanea, None
+        if instantanea is not None:
+            instantanea.cerrar()
+
+    def _atributos_xml(self, archivo=None):
+        """
+        Atributos de la raíz de data.xml, leyendo solo el comienzo del
+        archivo; de `archivo` si ya está abierto.
+        """
+        if archivo is None:
+            with open(self.ruta_xml, 'rb') as archivo:
+                return self._atributos_xml(archivo)
+        for _, elemento in ET.iterparse(archivo, events=('start',)):
+            return dict(elemento.attrib)
+        return {}
+
+    def _adoptar_compactacion(self, firma):
+        """
+        Si data.xml cambió solo porque otro proceso compactó, lo que hay
+        en memoria sigue valiendo: se leen los consumos que falten y se
+        marca lo compactado. Devuelve False si hace falta recargar.
+        """
+        if firma is None or self._firma_disco is None:
+            return False
+        estado = self._leer_estado()
+        if estado is None or estado.get('config') != self._id_config:
+            return False
+        if estado['segmento_compactado'] < self.bitacora.compactado:
+            return False
+        registros, completa = self.bitacora.leer_nuevos()
+        if not completa:
+            return False
+        self._aplicar_registros(registros)
+        self.bitacora.marcar_compactado(estado['segmento_compactado'])
+        self._firma_disco = firma
+        return True
+
+    @contextmanager
+    def tomar_bloqueos(self):
+        """
+        Toma `bloqueo_disco` y `bloqueo` sin esperar nunca uno teniendo el
+        otro: si el de disco está ocupado se suelta `bloqueo`, se espera el
+        de disco y se vuelve a intentar.
+        """
+        while True:
+            with self.bloqueo:
+                if self.bloqueo_disco.tomar(esperar=False):
+                    try:
+                        yield self
+                    finally:
+                        self.bloqueo_disco.__exit__(None, None, None)
+                    return
+            with self.bloqueo_disco:
+                pass
+
+    @contextmanager
+    def modificacion(self):
+        """
+        Para cambios de configuración: excluye a los demás escritores (de
+        este y otros procesos) y deja el almacén al día antes de modificarlo.
+        Dentro se modifica el almacén y se llama a `guardar`.
+        """
+        with self._bloqueo_escritura, self.bloqueo_disco:
+            self.sincronizar()
+            yield self
+
+    # --- Carga e indexación ---
+    def cargar_desde_elemento(self, root):
+        """Reemplaza el contenido del almacén con el de un árbol XML."""
+        self.reemplazar_contenido(*_entidades_de_elemento(root))
+
+    def reemplazar_contenido(self, recursos, categorias, clientes):
+        """Reemplaza todo el contenido del almacén con los objetos dados."""
+        with self.bloqueo:
+            self._vaciar()
+            self.version += 1
+            for recurso in recursos:
+                self.agregar_recurso(recurso)
+            for categoria in categorias:
+                self.agregar_categoria(categoria)
+            for cliente in clientes:
+                self.agregar_cliente(cliente)
+
+    def agregar_recurso(self, recurso):
+        self.recursos[recurso.id] = recurso
+        self.version += 1
+        self.version_config += 1
+
+    def agregar_categoria(self, categoria):
+        self.categorias[categoria.id] = categoria
+        for conf in categoria.configuraciones:
+            # Igual que la búsqueda original, gana la primera configuración con ese id
+            self.configuraciones.setdefault(conf.id, conf)
+        self.version_config += 1
+
+    def agregar_cliente(self, cliente):
+        anterior = self.clientes.get(cliente.nit)
+        if anterior is not None:
+            for instancia in anterior.instancias:
+                self.instancias.pop((anterior.nit, instancia.id), None)
+            # Los consumos del cliente anterior siguen en el índice; se reconstruye al usarse
+            self._indice_fechas = None
+            self._agregados = None
+            self._sin_fecha = None
+        else:
+            # Un NIT que ya existía conserva su lugar, igual que en el dict
+            self._posicion_cliente[cliente.nit] = len(self._orden_clientes)
+            self._orden_clientes.append(cliente.nit)
+        self.clientes[cliente.nit] = cliente
+        for instancia in cliente.instancias:
+            self._indexar_instancia(cliente, instancia)
+        self._columnas = None
+
+    def _indexar_instancia(self, cliente, instancia):
+        # Igual que la búsqueda original, gana la primera instancia con ese id
+        self.instancias.setdefault((cliente.nit, instancia.id), instancia)
+        if self._indice_fechas is not None or self._agregados is not None or self._sin_fecha is not None:
+            for consumo in instancia.consumos:
+                if self._sin_fecha is not None and consumo.ordinal is None:
+                    self._sin_fecha += 1
+                if self._indice_fechas is not None:
+                    self._indice_fechas.agregar(instancia, consumo, consumo.ordinal)
+                if self._agregados is not None:
+                    self._agregados.agregar(cliente.nit, instancia.id, consumo.ordinal, consumo.horas)
+
+    def fusionar_contenido(self, recursos, categorias, clientes):
+        """
+        Inserta o actualiza recursos y categorías por id, configuraciones
+        por id y clientes por NIT (con sus instancias por id), sin tocar lo
+        que no viene en la carga. De una entidad existente solo cambian los
+        campos que trae la carga (ver modelos.actualizar_desde) y las
+        instancias conservan sus consumos. Devuelve cuántas entidades se crearon y se actualizaron.
+
+        Debe llamarse dentro de `modificacion`. Solo se escribe el cambio:
+        la carga se agrega a la bitácora y el compactador la llevará a
+        data.xml. Si data.xml todavía no existe se guarda completo.
+        """
+        recursos, categorias, clientes = list(recursos), list(categorias), list(clientes)
+        if not self.existe():
+            resumen = self._fusionar(recursos, categorias, clientes)
+            self.guardar()
+            return resumen
+        # Se escribe antes de aplicarla, igual que los consumos; aplicarla modifica los objetos
+        self.bitacora.agregar([{"fusion": _elemento_de_entidades(recursos, categorias, clientes)}])
+        return self._fusionar(recursos, categorias, clientes)
+
+    def _fusionar(self, recursos, categorias, clientes):
+        resumen = {"nuevos": {"recursos": 0, "configuraciones": 0, "clientes": 0, "instancias": 0},
+                   "actualizados": {"recursos": 0, "configuraciones": 0, "clientes": 0, "instancias": 0}}
+        with self.bloqueo:
+            for recurso in recursos:
+                existente = self.recursos.get(recurso.id)
+                if existente is None:
+                    self.recursos[recurso.id] = recurso
+                    resumen["nuevos"]["recursos"] += 1
+                else:
+                    existente.actualizar_desde(recurso)
+                    resumen["actualizados"]["recursos"] += 1
+
+            for categoria in categorias:
+                existente = self.categorias.get(categoria.id)
+                if existente is None:
+                    existente = Categoria(categoria.id)
+                    self.categorias[categoria.id] = existente
+                existente.actualizar_desde(categoria)
+                for conf in categoria.configuraciones:
+                    # El id se busca en todas las categorías: la configuración se actualiza donde está
+                    conf_existente = self.configuraciones.get(conf.id)
+                    if conf_existente is not None:
+                        conf_existente.actualizar_desde(conf)
+                        resumen["actualizados"]["configuraciones"] += 1
+                    else:
+                        existente.agregar_configuracion(conf)
+                        self.configuraciones[conf.id] = conf
+                        resumen["nuevos"]["configuraciones"] += 1
+
+            for cliente in clientes:
+                existente = self.clientes.get(cliente.nit)
+                if existente is None:
+                    self.agregar_cliente(cliente)
+                    resumen["nuevos"]["clientes"] += 1
+                    resumen["nuevos"]["instancias"] += len(cliente.instancias)
+                    continue
+                existente.actualizar_desde(cliente)
+                resumen["actualizados"]["clientes"] += 1
+                for instancia in cliente.instancias:
+                    inst_existente = self.instancias.get((cliente.nit, instancia.id))
+                    if inst_existente is not None:
+                        inst_existente.actualizar_desde(instancia)
+                        resumen["actualizados"]["instancias"] += 1
+                    else:
+                        existente.agregar_instancia(instancia)
+                        self._indexar_instancia(existente, instancia)
+                        resumen["nuevos"]["instancias"] += 1
+
+            # Cambian tarifas y posiciones de instancias; el índice por fecha sigue válido
+            self._columnas = None
+            self.version_config += 1
+            self.version += 1
+        return resumen
+
+    def clientes_despues_de(self, nit=None):
+        """
+        Recorre los clientes en orden a partir del que sigue a `nit` (desde
+        el primero si es None), sin pasar por los anteriores. `nit` debe
+        existir. Debe usarse con `bloqueo` tomado.
+        """
+        inicio = 0 if nit is None else self._posicion_cliente[nit] + 1
+        for posicion in range(inicio, len(self._orden_clientes)):
+            yield self.clientes[self._orden_clientes[posicion]]
+
+    def buscar_instancia(self, nit, id_instancia):
+        """Búsqueda O(1) de una instancia por (nit, id)."""
+        return self.instancias.get((nit, id_instancia))
+
+    def tabla_tarifas(self):
+        """
+        Tarifas por configuración; se reconstruyen solo si cambió algún
+        recurso o configuración desde la última vez.
+        """
+        with self.bloqueo:
+            if self._tarifas_version != self.version_config:
+                self._tarifas = construir_tabla_tarifas(self.recursos, self.configuraciones)
+                self._tarifas_version = self.version_config
+            return self._tarifas
+
+    # --- Consumos ---
+    def _aplicar_consumo(self, nit, id_instancia, tiempo, fecha_hora):
+        instancia = self.instancias.get((nit, id_instancia))
+        if instancia is not None:
+            consumo = Consumo(tiempo, fecha_hora)
+            instancia.consumos.append(consumo)
+            if self._indice_fechas is not None:
+                self._indice_fechas.agregar(instancia, consumo, consumo.ordinal)
+            if self._columnas is not None:
+                self._columnas.agregar(instancia, consumo, consumo.ordinal)
+            if self._agregados is not None:
+                self._agregados.agregar(nit, id_instancia, consumo.ordinal, consumo.horas)
+            if self._sin_fecha is not None and consumo.ordinal is None:
+                self._sin_fecha += 1
+
+    def consumos_sin_fecha(self):
+        """
+        Cantidad de consumos cuya fecha no se pudo interpretar; nunca entran
+        en un rango de facturación. Se cuenta al primer uso y luego se
+        mantiene con cada consumo nuevo.
+        """
+        with self.bloqueo:
+            if self._sin_fecha is None:
+                sin_fecha = 0
+                for cliente in self.clientes.values():
+                    for instancia in cliente.instancias:
+                        diferidos = instancia.consumos_diferidos()
+                        if diferidos is not None:
+                            sin_fecha += diferidos.columnas()[1].count(-1)
+                        else:
+                            sin_fecha += sum(consumo.ordinal is None for consumo in instancia.consumos)
+                self._sin_fecha = sin_fecha
+            return self._sin_fecha
+
+    def _indice(self):
+        """Índice de consumos por fecha; se construye al primer uso. Debe usarse con `bloqueo` tomado."""
+        if self._indice_fechas is None:
+            indice = IndiceFechas()
+            for cliente in self.clientes.values():
+                for instancia in cliente.instancias:
+                    for consumo in instancia.consumos:
+                        indice.agregar(instancia, consumo, consumo.ordinal)
+            self._indice_fechas = indice
+        return self._indice_fechas
+
+    def limites_consumo(self, instancias=None):
+        """
+        {instancia: cantidad de consumos} en este instante, de `instancias`
+        o de todas. Los consumos solo se agregan al final, así que esos
+        primeros consumos ya no cambian. Debe usarse con `bloqueo` tomado.
+        """
+        if instancias is None:
+            instancias = (instancia for cliente in self.clientes.values() for instancia in cliente.instancias)
+        return {instancia: instancia.cantidad_consumos() for instancia in instancias}
+
+    def lectura_rango(self, inicio_ordinal, fin_ordinal, columnar):
+        """
+        LecturaRango para facturar el rango sin el bloqueo. Con `columnar`
+        trae las columnas del motor vectorizado; si no, los consumos del
+        rango según el índice por fecha.
+        """
+        with self.bloqueo:
+            return LecturaRango(
+                inicio_ordinal, fin_ordinal, self.version, self.version_config, self.version_datos(),
+                list(self.clientes.values()), self.tabla_tarifas(),
+                columnas=self.columnas_consumo().congelar() if columnar else None,
+                vista=None if columnar else self._indice().vista(inicio_ordinal, fin_ordinal))
+
+    def agregados_uso(self):
+        """
+        Horas por instancia y día. Se construyen al primer uso y luego
+        cada consumo nuevo suma en su fila, igual que el índice por fecha.
+        """
+        with self.bloqueo:
+            if self._agregados is None:
+                agregados = AgregadosDiarios()
+                for cliente in self.clientes.values():
+                    for instancia in cliente.instancias:
+                        diferidos = instancia.consumos_diferidos()
+                        if diferidos is None:
+                            for consumo in instancia.consumos:
+                                agregados.agregar(cliente.nit, instancia.id, consumo.ordinal, consumo.horas)
+                            continue
+                        # Sin construir los consumos: las columnas usan NaN y -1 en vez de None
+                        for horas, ordinal in zip(*diferidos.columnas()):
+                            agregados.agregar(cliente.nit, instancia.id, ordinal if ordinal >= 0 else None,
+                                              horas if horas == horas else None)
+                self._agregados = agregados
+            return self._agregados
+
+    def columnas_consumo(self):
+        """
+        Consumos en columnas para el motor vectorizado. Se construyen al
+        primer uso, crecen con cada consumo nuevo y se descartan si cambian
+        recursos o configuraciones. Para usarlas sin el bloqueo hay que
+        congelarlas (ver ColumnasConsumo.congelar).
+        """
+        with self.bloqueo:
+            if self._columnas is None or self._columnas_version != self.version_config:
+                columnas = ColumnasConsumo(self.clientes.values(), self.tabla_tarifas())
+                for cliente in self.clientes.values():
+                    for instancia in cliente.instancias:
+                        diferidos = instancia.consumos_diferidos()
+                        if diferidos is not None:
+                            # Directo de la instantánea, sin construir los consumos
+                            columnas.agregar_columnas(instancia, *diferidos.columnas())
+                            continue
+                        for consumo in instancia.consumos:
+                            columnas.agregar(instancia, consumo, consumo.ordinal)
+                self._columnas = columnas
+                self._columnas_version = self.version_config
+            return self._columnas
+
+    def _aplicar_registros(self, registros):
+        if not registros:
+            return
+        fechas = []
+        for registro in registros:
+            if isinstance(registro, dict):
+                # Una carga de configuración fusionada (ver fusionar_contenido)
+                self._fusionar(*_entidades_de_elemento(ET.fromstring(registro["fusion"])))
+                continue
+            nit, id_instancia, tiempo, fecha_hora = registro
+            self._aplicar_consumo(nit, id_instancia, tiempo, fecha_hora)
+            fechas.append(fecha_hora)
+        # Solo dejan de valer los rangos que incluyen alguna fecha del lote
+        if self.memo_facturacion:
+            self.memo_facturacion.invalidar_fechas(normalizar_fecha(fecha)[0] for fecha in fechas)
+        self.version += 1
+
+    def registrar_consumos(self, registros):
+        """
+        Agrega a la bitácora una lista de [nit, id_instancia, tiempo,
+        fecha_hora] ya validados y los aplica en memoria. El costo solo
+        depende del tamaño del lote, no del historial. Antes de agregar se
+        leen los consumos de otros procesos, así la memoria sigue el orden
+        del archivo.
+        """
+        with self.tomar_bloqueos():
+            self.sincronizar()
+            self.bitacora.agregar(registros)
+            self._aplicar_registros(registros)
+            if self.bitacora.pendientes >= UMBRAL_COMPACTACION:
+                self.evento_compactar.set()
+
+    # --- Persistencia ---
+    def a_elemento(self, limites_consumo=None):
+        return _raiz_de_entidades(list(self.recursos.values()), list(self.categorias.values()),
+                                  list(self.clientes.values()), limites_consumo)
+
+    def guardar(self, solo_consumos=False):
+        """
+        Compacta: sella el segmento activo de la bitácora y escribe el
+        estado actual en data.xml, marcando hasta qué segmento incluye.
+        Se escribe primero a un archivo temporal y luego se renombra, para
+        que nunca quede un data.xml a medio escribir. Solo la toma de la
+        instantánea y el reemplazo de los archivos bloquean a las cargas de
+        consumos.
+
+        Un cambio de configuración debe guardarse dentro de `modificacion`.
+        Con `solo_consumos` (el compactador) la configuración no cambió y
+        el bloqueo de disco se suelta mientras se escribe; si mientras
+        tanto otro proceso escribió algo más nuevo, esta escritura se
+        descarta. No debe llamarse con `bloqueo` tomado.
+        """
+        with self._bloqueo_escritura:
+            with self.tomar_bloqueos():
+                if solo_consumos:
+                    self.sincronizar()
+                segmento = self.bitacora.sellar()
+                # Lo que se escribe: los objetos y cuántos consumos tiene cada instancia en este
+                # instante. Si mientras se escribe otro hilo recarga, estos objetos no cambian.
+                recursos = list(self.recursos.values())
+                categorias = list(self.categorias.values())
+                clientes = list(self.clientes.values())
+                limites_consumo = self.limites_consumo()
+                cargas = self._cargas
+                # Un data.xml anterior a este esquema no trae id; se le asigna uno nuevo
+                id_config = self._id_config if solo_consumos and self._id_config else uuid.uuid4().hex
+            root = _raiz_de_entidades(recursos, categorias, clientes, limites_consumo)
+            root.set('segmentoCompactado', str(segmento))
+            root.set('idConfiguracion', id_config)
+            tree = ET.ElementTree(root)
+            ET.indent(tree, space='    ')
+            # Nombre propio: otro proceso puede estar escribiendo su compactación a la vez
+            ruta_temporal = f"{self.ruta_xml}.{uuid.uuid4().hex}.tmp"
+            tree.write(ruta_temporal, encoding='utf-8', xml_declaration=True)
+            instantanea_temporal = f"{ruta_temporal}.instantanea"
+            try:
+                escribir_instantanea(instantanea_temporal, recursos, categorias, clientes,
+                                     limites_consumo, id_config, segmento)
+            except OSError as e:
+                # Sin instantánea la próxima carga lee data.xml; no impide guardar
+                print(f"No se pudo escribir la instantánea: {e}")
+                instantanea_temporal = None
+            escrito = False
+            # Reemplazar los archivos y adoptarlos en memoria es un solo paso: nadie ve el
+            # data.xml nuevo con la memoria de antes
+            with self.tomar_bloqueos():
+                estado = self._leer_estado()
+                recargado = self._cargas != cargas
+                if recargado and not solo_consumos:
+                    raise RuntimeError("El almacén se recargó mientras se guardaba un cambio de configuración.")
+                if recargado or (solo_consumos and estado is not None and (
+                        estado['segmento_compactado'] >= segmento or estado['config'] != id_config)):
+                    # Otro proceso escribió algo más nuevo, y este proceso ya lo cargó o lo cargará
+                    os.remove(ruta_temporal)
+                    if instantanea_temporal:
+                        os.remove(instantanea_temporal)
+                else:
+                    # El estado se escribe antes: quien vea el data.xml nuevo ya ve su estado
+                    self._escribir_estado(segmento, id_config)
+                    os.replace(ruta_temporal, self.ruta_xml)
+                    if instantanea_temporal:
+                        self._soltar_instantanea()
+                        os.replace(instantanea_temporal, self.ruta_instantanea)
+                    self._firma_disco = self._firma_actual()
+                    self._id_config = id_config
+                    self.bitacora.marcar_compactado(segmento)
+                    escrito = True
+            if escrito and estado is not None:
+                # Se conserva una compactación de margen para los procesos que van atrasados
+                self.bitacora.descartar_hasta(estado['segmento_compactado'])
+
+    def eliminar(self):
+        """Borra data.xml y la bitácora, y deja el almacén vacío."""
+        with self._bloqueo_escritura, self.tomar_bloqueos():
+            self._soltar_instantanea()
+            for ruta in (self.ruta_xml, self.ruta_estado, self.ruta_instantanea):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            self.bitacora.eliminar_todo()
+            self._vaciar()
+            self._id_config = None
+            self.version += 1
+            self._firma_disco = None
+
+    def compactar_si_hay_pendientes(self):
+        if self.bitacora.pendientes and self.existe():
+            self.guardar(solo_consumos=True)
+
+    def compactar_todo(self):
+        """
+        Espera a que termine la compactación en curso, si la hay, y compacta
+        lo que quede; al volver, data.xml incluye todos los consumos leídos.
+        """
+        with self._bloqueo_escritura:
+            self.compactar_si_hay_pendientes()
+
+
+class LecturaRango:
+    """
+    Lo que necesita la facturación de un rango, tomado del almacén de una
+    vez con el bloqueo (ver AlmacenDatos.lectura_rango). Después se usa sin
+    el bloqueo: los consumos que lleguen no la cambian. Las versiones son
+    las del almacén al tomarla, para saber si el resultado todavía vale.
+    """
+
+    __slots__ = ('inicio_ordinal', 'fin_ordinal', 'version', 'version_config', 'version_datos', 'clientes',
+                 'tarifas', 'columnas', '_vista')
+
+    def __init__(self, inicio_ordinal, fin_ordinal, version, version_config, version_datos, clientes, tarifas,
+                 columnas=None, vista=None):
+        self.inicio_ordinal = inicio_ordinal
+        self.fin_ordinal = fin_ordinal
+        self.version = version
+        self.version_config = version_config
+        self.version_datos = version_datos
+        self.clientes = clientes
+        self.tarifas = tarifas
+        self.columnas = columnas
+        self._vista = vista
+
+    def consumos_por_instancia(self):
+        """{instancia: [consumos]} del rango, en orden de llegada."""
+        return consumos_por_instancia(self._vista)
+
+
+def _firma(st):
+    """Identifica una escritura de data.xml por el resultado de os.stat o os.fstat."""
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _entidades_de_elemento(root):
+    """(recursos, categorías, clientes) de un árbol con el formato de data.xml."""
+    return ([Recurso.desde_xml(nodo) for nodo in root.findall('listaRecursos/recurso')],
+            [Categoria.desde_xml(nodo) for nodo in root.findall('listaCategorias/categoria')],
+            [Cliente.desde_xml(nodo) for nodo in root.findall('listaClientes/cliente')])
+
+
+def _elemento_de_entidades(recursos, categorias, clientes):
+    """Texto XML, con el formato de data.xml, que contiene solo las entidades dadas."""
+    return ET.tostring(_raiz_de_entidades(recursos, categorias, clientes), encoding='unicode')
+
+
+def _raiz_de_entidades(recursos, categorias, clientes, limites_consumo=None):
+    """Árbol con el formato de data.xml; `limites_consumo` como en Cliente.a_xml."""
+    root = ET.Element('archivoConfiguraciones')
+    lista_recursos = ET.SubElement(root, 'listaRecursos')
+    for recurso in recursos:
+        recurso.a_xml(lista_recursos)
+    lista_categorias = ET.SubElement(root, 'listaCategorias')
+    for categoria in categorias:
+        categoria.a_xml(lista_categorias)
+    lista_clientes = ET.SubElement(root, 'listaClientes')
+    for cliente in clientes:
+        cliente.a_xml(lista_clientes, limites_consumo)
+    return root
+
+
+def _ciclo_compactador(almacen):
+    while True:
+        almacen.evento_compactar.wait(INTERVALO_COMPACTACION)
+        almacen.evento_compactar.clear()
+        try:
+            almacen.compactar_si_hay_pendientes()
+        except Exception as e:
+            print(f"Error al compactar la bitácora de consumos: {e}")
+
+
+_almacen = None
+_bloqueo_global = threading.Lock()
+
+
+def obtener_almacen():
+    """Devuelve el almacén del proceso, sincronizado con data.xml."""
+    global _almacen
+    with _bloqueo_global:
+        if _almacen is None:
+            _almacen = AlmacenDatos(DB_FILE, DIR_BITACORA)
+            threading.Thread(target=_ciclo_compactador, args=(_almacen,), daemon=True).start()
+    _almacen.sincronizar()
+    return _almacen
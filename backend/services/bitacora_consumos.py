@@ -0,0 +1,184 @@
+# --- backend/services/bitacora_consumos.py ---
+#
+# Bitácora de solo-agregado para los consumos. Cada carga de consumos se
+# agrega al segmento activo (un registro JSON por línea) en vez de
+# reescribir data.xml. El compactador del almacén sella el segmento,
+# lo incorpora a data.xml y luego borra los segmentos ya compactados.
+# Un registro es [nit, id_instancia, tiempo, fecha_hora], o un objeto
+# {"fusion": xml} con una carga de configuración fusionada.
+#
+# Varios procesos del servidor comparten la bitácora. Escribir y sellar
+# se hace con el bloqueo de disco del almacén tomado; leer no necesita
+# bloqueo: cada proceso recuerda cuánto leyó de cada segmento y en cada
+# sincronización lee solo las líneas completas que se agregaron después,
+# sean suyas o de otro proceso. Todos ven los consumos en el orden del
+# archivo. Las secuencias de segmento son contiguas (sellar crea el
+# segmento siguiente), así un segmento que falta se detecta.
+#
+# Agregar o sellar después de una lectura incompleta es un error: el
+# segmento activo que se conoce puede estar atrasado. Lo único que se
+# recorta al agregar es una última línea sin terminar (una escritura
+# interrumpida), después de confirmarlo leyéndola.
+
+import json
+import os
+import re
+
+PATRON_SEGMENTO = re.compile(r'^segmento_(\d+)\.jsonl$')
+
+
+class BitacoraConsumos:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.compactado = 0   # último segmento incorporado a data.xml
+        self._leidos = {}     # secuencia -> [bytes leídos, registros leídos]
+        self._al_dia = True   # False si la última lectura no llegó al final
+
+    def _ruta(self, secuencia):
+        return os.path.join(self.directorio, f"segmento_{secuencia:08d}.jsonl")
+
+    @property
+    def secuencia_activa(self):
+        """Segmento donde se agrega: el último conocido que no está compactado."""
+        return max(self._leidos, default=self.compactado + 1)
+
+    @property
+    def pendientes(self):
+        """Registros del segmento activo, que todavía nadie selló para compactar."""
+        return self._leidos.get(self.secuencia_activa, (0, 0))[1]
+
+    def posicion(self):
+        """
+        Texto que identifica qué consumos se leyeron: el último segmento
+        compactado y los bytes leídos de cada segmento posterior. Los
+        segmentos solo crecen, así que la misma posición son los mismos
+        consumos en cualquier proceso.
+        """
+        leidos = ','.join(f"{sec}:{leido[0]}" for sec, leido in sorted(self._leidos.items()) if leido[0])
+        return f"{self.compactado}|{leidos}"
+
+    def segmentos(self):
+        """Lista ordenada de (secuencia, ruta) de los segmentos en disco."""
+        if not os.path.isdir(self.directorio):
+            return []
+        encontrados = []
+        for nombre in os.listdir(self.directorio):
+            coincidencia = PATRON_SEGMENTO.match(nombre)
+            if coincidencia:
+                encontrados.append((int(coincidencia.group(1)), os.path.join(self.directorio, nombre)))
+        return sorted(encontrados)
+
+    def reiniciar(self, ultimo_compactado=0):
+        self.compactado = ultimo_compactado
+        self._leidos = {}
+        self._al_dia = True
+
+    def leer_desde(self, ultimo_compactado):
+        """
+        Registros de todos los segmentos que todavía no están en data.xml.
+        Devuelve (registros, completa), igual que leer_nuevos.
+        """
+        self.reiniciar(ultimo_compactado)
+        return self.leer_nuevos()
+
+    def leer_nuevos(self):
+        """
+        Registros agregados (por este u otro proceso) desde la última
+        lectura. Devuelve (registros, completa); `completa` es False si
+        falta un segmento que no se terminó de leer, porque otro proceso
+        ya lo compactó y lo borró: entonces hay que recargar todo.
+        """
+        registros = []
+        esperada = self.compactado + 1
+        # Hasta llegar al final, lo conocido puede estar atrasado (ver _verificar_al_dia)
+        self._al_dia = False
+        for secuencia, ruta in self.segmentos():
+            if secuencia <= self.compactado:
+                continue
+            if secuencia != esperada:
+                return registros, False
+            esperada += 1
+            leido = self._leidos.setdefault(secuencia, [0, 0])
+            try:
+                if os.path.getsize(ruta) <= leido[0]:
+                    continue
+                with open(ruta, 'rb') as archivo:
+                    archivo.seek(leido[0])
+                    datos = archivo.read()
+            except FileNotFoundError:
+                return registros, False
+            # Una línea incompleta es una escritura en curso (o interrumpida); se lee después
+            fin = datos.rfind(b'\n') + 1
+            nuevos = [json.loads(linea) for linea in datos[:fin].splitlines()]
+            leido[0] += fin
+            leido[1] += len(nuevos)
+            registros.extend(nuevos)
+        self._al_dia = True
+        return registros, True
+
+    def _verificar_al_dia(self):
+        if not self._al_dia:
+            raise RuntimeError("La bitácora no se terminó de leer; hay que recargar antes de escribir.")
+
+    def agregar(self, registros):
+        """
+        Agrega los registros al segmento activo y los baja a disco. Debe
+        llamarse con el bloqueo de disco tomado y después de `leer_nuevos`.
+        """
+        if not registros:
+            return
+        self._verificar_al_dia()
+        secuencia = self.secuencia_activa
+        ruta = self._ruta(secuencia)
+        leido = self._leidos.setdefault(secuencia, [0, 0])
+        os.makedirs(self.directorio, exist_ok=True)
+        datos = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in registros).encode('utf-8')
+        with open(ruta, 'a+b') as archivo:
+            if archivo.tell() > leido[0]:
+                # Con el bloqueo tomado nadie más escribe: si lo que sigue a lo leído no tiene
+                # un fin de línea es el resto de una escritura interrumpida y se descarta.
+                # Si hay líneas completas sin leer, recortar borraría registros de otro proceso.
+                archivo.seek(leido[0])
+                if b'\n' in archivo.read():
+                    raise RuntimeError(f"El segmento {secuencia} tiene registros que no se leyeron.")
+                archivo.truncate(leido[0])
+            archivo.write(datos)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        leido[0] += len(datos)
+        leido[1] += len(registros)
+
+    def sellar(self):
+        """
+        Cierra el segmento activo creando el siguiente, y devuelve su
+        secuencia; desde ahí todos los procesos agregan al nuevo. Debe
+        llamarse con el bloqueo de disco tomado y después de `leer_nuevos`.
+        """
+        self._verificar_al_dia()
+        secuencia = self.secuencia_activa
+        os.makedirs(self.directorio, exist_ok=True)
+        open(self._ruta(secuencia), 'ab').close()
+        open(self._ruta(secuencia + 1), 'ab').close()
+        self._leidos.setdefault(secuencia, [0, 0])
+        self._leidos[secuencia + 1] = [0, 0]
+        return secuencia
+
+    def marcar_compactado(self, secuencia):
+        """Los segmentos hasta `secuencia` ya están en data.xml."""
+        self.compactado = max(self.compactado, secuencia)
+        for sec in [s for s in self._leidos if s <= self.compactado]:
+            del self._leidos[sec]
+
+    def descartar_hasta(self, secuencia):
+        """Borra los segmentos ya incorporados a data.xml."""
+        for sec, ruta in self.segmentos():
+            if sec <= secuencia:
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+
+    def eliminar_todo(self):
+        for _, ruta in self.segmentos():
+            os.remove(ruta)
+        self.reiniciar()
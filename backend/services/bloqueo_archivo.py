@@ -0,0 +1,96 @@
+# --- backend/services/bloqueo_archivo.py ---
+#
+# Bloqueo exclusivo entre procesos sobre un archivo de bloqueo. Sirve
+# cuando varios procesos del servidor comparten archivos en disco.
+# `bloqueo_exclusivo` no excluye a los hilos de un mismo proceso; para eso
+# hay que combinarlo con un threading.Lock, o usar BloqueoArchivo.
+
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def bloqueo_exclusivo(ruta, esperar=True):
+    """
+    Mantiene el bloqueo de `ruta` (se crea si no existe) mientras dura el
+    with. Con `esperar=False` lanza BlockingIOError si otro lo tiene.
+    """
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta, 'a+b') as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            # msvcrt bloquea por rangos de bytes; alcanza con el primero
+            archivo.seek(0)
+            try:
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK if esperar else msvcrt.LK_NBLCK, 1)
+            except OSError as e:
+                if esperar:
+                    raise
+                raise BlockingIOError(str(e)) from e
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+            else:
+                archivo.seek(0)
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class BloqueoArchivo:
+    """
+    Bloqueo entre procesos que además excluye a los hilos del proceso y
+    es reentrante: el mismo hilo puede tomarlo varias veces y el archivo
+    solo se bloquea en la primera.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._hilos = threading.RLock()
+        self._profundidad = 0
+        self._contexto = None
+
+    def __enter__(self):
+        self.tomar()
+        return self
+
+    def tomar(self, esperar=True):
+        """
+        Toma el bloqueo (se suelta con __exit__). Con `esperar=False`, si
+        otro hilo o proceso lo tiene devuelve False en vez de esperar.
+        """
+        if not self._hilos.acquire(blocking=esperar):
+            return False
+        if self._profundidad == 0:
+            contexto = bloqueo_exclusivo(self.ruta, esperar)
+            try:
+                contexto.__enter__()
+            except BlockingIOError:
+                self._hilos.release()
+                if esperar:
+                    raise
+                return False
+            except BaseException:
+                self._hilos.release()
+                raise
+            self._contexto = contexto
+        self._profundidad += 1
+        return True
+
+    def __exit__(self, *exc):
+        self._profundidad -= 1
+        if self._profundidad == 0:
+            contexto, self._contexto = self._contexto, None
+            contexto.__exit__(None, None, None)
+        self._hilos.release()
+        return False
@@ -0,0 +1,129 @@
+# --- backend/services/cache_pdf.py ---
+#
+# Caché en disco de los PDFs generados. Cada PDF se guarda con el nombre
+# del hash de su clave (tipo de reporte, parámetros y versión de los
+# datos), así dos solicitudes distintas nunca escriben el mismo archivo y
+# una solicitud repetida se sirve sin volver a calcular nada. El tamaño
+# total está acotado y se descartan primero los menos usados (LRU).
+#
+# El directorio es compartido por todos los procesos del servidor y es la
+# única fuente de verdad: un PDF está en caché si su archivo existe, su
+# fecha de modificación es la de su último uso y el tamaño total se mide
+# en el directorio al desalojar.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .bloqueo_archivo import bloqueo_exclusivo
+
+DIR_CACHE_PDF = os.path.join(os.path.dirname(__file__), '..', 'cache_pdf')
+LIMITE_CACHE_PDF = 256 * 1024 * 1024   # bytes máximos en disco
+ANTIGUEDAD_TEMPORALES = 60 * 60        # segundos tras los que un temporal se da por abandonado
+
+
+class CachePDF:
+    def __init__(self, directorio, limite_bytes):
+        self.directorio = directorio
+        self.limite_bytes = limite_bytes
+        self._ruta_bloqueo = os.path.join(directorio, '.bloqueo')
+        self._bloqueo = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        # Temporales que quedaron a medio escribir. Los recientes pueden ser
+        # de otro proceso que todavía está escribiendo; esos no se tocan.
+        limite = time.time() - ANTIGUEDAD_TEMPORALES
+        for entrada in os.scandir(directorio):
+            try:
+                if entrada.name.endswith('.tmp') and entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def clave(tipo, parametros, version=None):
+        """Hash estable de (tipo, parámetros, versión de los datos)."""
+        texto = json.dumps([tipo, parametros, version], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.pdf")
+
+    def obtener(self, clave):
+        """Ruta del PDF si está en caché (y lo marca como recién usado); si no, None."""
+        ruta = self._ruta(clave)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def ruta_temporal(self):
+        """Ruta única dentro de la caché para escribir un PDF antes de guardarlo."""
+        return os.path.join(self.directorio, f"{uuid.uuid4().hex}.tmp")
+
+    def guardar(self, clave, ruta_temporal):
+        """Mueve un PDF ya escrito a la caché y devuelve su ruta definitiva."""
+        ruta = self._ruta(clave)
+        os.replace(ruta_temporal, ruta)
+        self._desalojar(conservar=ruta)
+        return ruta
+
+    def guardar_archivo(self, clave, archivo):
+        """Copia a la caché un PDF abierto (por ejemplo, un buffer en memoria)."""
+        ruta_temporal = self.ruta_temporal()
+        try:
+            archivo.seek(0)
+            with open(ruta_temporal, 'wb') as destino:
+                shutil.copyfileobj(archivo, destino)
+            return self.guardar(clave, ruta_temporal)
+        finally:
+            if os.path.exists(ruta_temporal):
+                os.remove(ruta_temporal)
+
+    def _desalojar(self, conservar):
+        """
+        Borra los PDFs usados hace más tiempo hasta que el directorio quede
+        bajo el límite. El tamaño se mide en el directorio, así cuenta lo
+        que guardaron todos los procesos.
+        """
+        with self._bloqueo, bloqueo_exclusivo(self._ruta_bloqueo):
+            archivos = []
+            total = 0
+            for entrada in os.scandir(self.directorio):
+                if not entrada.name.endswith('.pdf'):
+                    continue
+                try:
+                    st = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                archivos.append((st.st_mtime, entrada.path, st.st_size))
+                total += st.st_size
+            for _, ruta, tamano in sorted(archivos):
+                if total <= self.limite_bytes:
+                    break
+                if ruta == conservar:
+                    continue
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    # En Windows no se puede borrar un PDF que se está enviando
+                    continue
+                total -= tamano
+
+
+_cache = None
+_bloqueo_cache = threading.Lock()
+
+
+def obtener_cache_pdf():
+    global _cache
+    with _bloqueo_cache:
+        if _cache is None:
+            _cache = CachePDF(DIR_CACHE_PDF, LIMITE_CACHE_PDF)
+        return _cache
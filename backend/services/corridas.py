@@ -0,0 +1,171 @@
+# --- backend/services/corridas.py ---
+#
+# Corridas de facturación guardadas en el backend. Cada vez que se factura
+# un rango se guarda la corrida con un id; el frontend solo conserva ese id
+# y pide cada factura por (id_corrida, numero_factura). Los detalles se
+# escriben agrupados por factura en un archivo aparte y el índice guarda
+# dónde empieza cada grupo, así leer una factura cuesta lo que mide esa
+# factura y no la corrida completa.
+#
+#   corridas/<id>/indice.json     rango, facturas y posición de cada grupo
+#   corridas/<id>/detalles.jsonl  una línea JSON por factura con sus detalles
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DIR_CORRIDAS = os.path.join(os.path.dirname(__file__), '..', 'corridas')
+MAX_CORRIDAS = 100          # corridas que se conservan en disco
+MAX_INDICES_EN_MEMORIA = 16
+
+_PATRON_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class FacturaNoEncontrada(LookupError):
+    """La corrida o la factura pedida no existe (o ya fue purgada)."""
+
+
+class AlmacenCorridas:
+    def __init__(self, directorio, max_corridas=MAX_CORRIDAS):
+        self.directorio = directorio
+        self.max_corridas = max_corridas
+        self._indices = OrderedDict()   # id -> índice leído, de menos a más usado
+        self._bloqueo = threading.Lock()
+
+    def _ruta(self, id_corrida, *nombre):
+        return os.path.join(self.directorio, id_corrida, *nombre)
+
+    def crear(self, fecha_inicio, fecha_fin, facturas, detalles_consumo):
+        """Guarda una corrida y devuelve su id."""
+        id_corrida = uuid.uuid4().hex
+        detalles_por_nit = {}
+        for detalle in detalles_consumo:
+            detalles_por_nit.setdefault(detalle['nit_cliente'], []).append(detalle)
+
+        # Se escribe en un directorio temporal y se renombra completo al final
+        os.makedirs(self.directorio, exist_ok=True)
+        temporal = os.path.join(self.directorio, f".{id_corrida}.tmp")
+        os.makedirs(temporal)
+        posiciones = {}   # numero_factura -> [posición en facturas, byte inicial, longitud]
+        with open(os.path.join(temporal, 'detalles.jsonl'), 'wb') as archivo:
+            for i, factura in enumerate(facturas):
+                linea = json.dumps(detalles_por_nit.get(factura['nit_cliente'], []),
+                                   ensure_ascii=False).encode('utf-8') + b'\n'
+                posiciones[str(factura['numero_factura'])] = [i, archivo.tell(), len(linea)]
+                archivo.write(linea)
+        indice = {
+            "id_corrida": id_corrida,
+            "fecha_inicio": fecha_inicio,
+            "fecha_fin": fecha_fin,
+            "creada": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "facturas": facturas,
+            "posiciones": posiciones,
+        }
+        with open(os.path.join(temporal, 'indice.json'), 'w', encoding='utf-8') as archivo:
+            json.dump(indice, archivo, ensure_ascii=False)
+        os.replace(temporal, self._ruta(id_corrida))
+
+        with self._bloqueo:
+            self._recordar(id_corrida, indice)
+        try:
+            self._purgar_antiguas()
+        except OSError as e:
+            # La corrida ya quedó guardada; las antiguas se purgan la próxima vez
+            print(f"No se pudieron purgar las corridas antiguas: {e}")
+        return id_corrida
+
+    def _recordar(self, id_corrida, indice):
+        self._indices[id_corrida] = indice
+        self._indices.move_to_end(id_corrida)
+        while len(self._indices) > MAX_INDICES_EN_MEMORIA:
+            self._indices.popitem(last=False)
+
+    def _indice(self, id_corrida):
+        if not _PATRON_ID.fullmatch(id_corrida or ''):
+            return None
+        with self._bloqueo:
+            indice = self._indices.get(id_corrida)
+            if indice is not None:
+                self._indices.move_to_end(id_corrida)
+                return indice
+        try:
+            with open(self._ruta(id_corrida, 'indice.json'), encoding='utf-8') as archivo:
+                indice = json.load(archivo)
+        except FileNotFoundError:
+            return None
+        with self._bloqueo:
+            self._recordar(id_corrida, indice)
+        return indice
+
+    def resumen(self, id_corrida):
+        """Rango y facturas de la corrida, sin detalles; None si no existe."""
+        indice = self._indice(id_corrida)
+        if indice is None:
+            return None
+        return {k: indice[k] for k in ("id_corrida", "fecha_inicio", "fecha_fin", "creada", "facturas")}
+
+    def factura(self, id_corrida, numero_factura):
+        """{factura_info, detalles_consumo} de una factura; None si no existe."""
+        indice = self._indice(id_corrida)
+        if indice is None:
+            return None
+        posicion = indice['posiciones'].get(str(numero_factura))
+        if posicion is None:
+            return None
+        i, inicio, longitud = posicion
+        try:
+            with open(self._ruta(id_corrida, 'detalles.jsonl'), 'rb') as archivo:
+                archivo.seek(inicio)
+                detalles = json.loads(archivo.read(longitud))
+        except FileNotFoundError:
+            return None
+        return {"factura_info": indice['facturas'][i], "detalles_consumo": detalles}
+
+    def completa(self, id_corrida):
+        """{facturas, detalles_consumo} de toda la corrida; None si no existe."""
+        indice = self._indice(id_corrida)
+        if indice is None:
+            return None
+        detalles_consumo = []
+        try:
+            with open(self._ruta(id_corrida, 'detalles.jsonl'), 'rb') as archivo:
+                for linea in archivo:
+                    detalles_consumo.extend(json.loads(linea))
+        except FileNotFoundError:
+            return None
+        return {"facturas": indice['facturas'], "detalles_consumo": detalles_consumo}
+
+    def _purgar_antiguas(self):
+        corridas = []   # (fecha de modificación, id)
+        for nombre in os.listdir(self.directorio):
+            if not _PATRON_ID.fullmatch(nombre):
+                continue
+            try:
+                corridas.append((os.path.getmtime(self._ruta(nombre)), nombre))
+            except OSError:
+                # Otro proceso la está purgando en este momento
+                continue
+        if len(corridas) <= self.max_corridas:
+            return
+        corridas.sort()
+        for _, id_corrida in corridas[:len(corridas) - self.max_corridas]:
+            with self._bloqueo:
+                self._indices.pop(id_corrida, None)
+            shutil.rmtree(self._ruta(id_corrida), ignore_errors=True)
+
+
+_corridas = None
+_bloqueo_corridas = threading.Lock()
+
+
+def obtener_corridas():
+    global _corridas
+    with _bloqueo_corridas:
+        if _corridas is None:
+            _corridas = AlmacenCorridas(DIR_CORRIDAS)
+        return _corridas
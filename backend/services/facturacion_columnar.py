@@ -0,0 +1,247 @@
+# --- backend/services/facturacion_columnar.py ---
+#
+# Motor de facturación columnar. Los consumos se guardan como columnas
+# (cliente, instancia, configuración, fecha ordinal y horas) y el costo de
+# un rango se calcula con operaciones sobre arreglos contra las matrices de
+# cantidades y precios (configuración x recurso). Cada costo se calcula
+# como (horas * cantidad) * valor, en el mismo orden que en Python, así el
+# resultado es idéntico. Si NumPy no está instalado,
+# `NUMPY_DISPONIBLE` es False y xml_manager usa la ruta en Python puro.
+#
+# Las columnas crecen por bloques: cuando el bloque abierto se llena se
+# sella y ya no cambia. Así `congelar` entrega, con el bloqueo del
+# almacén, una copia que comparte los bloques sellados y copia solo el
+# abierto, y el cálculo se hace sin el bloqueo.
+
+import copy
+import math
+from array import array
+
+try:
+    import numpy as np
+    NUMPY_DISPONIBLE = True
+except ImportError:
+    np = None
+    NUMPY_DISPONIBLE = False
+
+FILAS_POR_BLOQUE = 1 << 16   # consumos del bloque abierto antes de sellarlo
+
+
+class ColumnasConsumo:
+    """
+    Consumos en columnas, en orden de llegada, junto con la matriz de
+    tarifas. Las instancias se numeran en el mismo orden en que se
+    recorren clientes e instancias, así ordenar por índice de instancia
+    reproduce el orden de la facturación original.
+    """
+
+    def __init__(self, clientes, tarifas):
+        self.clientes = []            # posición -> Cliente
+        self.instancias = []          # posición -> Instancia
+        self._pos_instancia = {}      # Instancia -> posición
+        self._cliente_de = []         # posición de instancia -> posición de cliente
+        self._config_de = []          # posición de instancia -> posición de configuración (-1 si no existe)
+
+        # --- Matriz de tarifas: fila por configuración, columna por posición en su desglose ---
+        self.tarifas = list(tarifas.values())
+        pos_config = {t.id_configuracion: i for i, t in enumerate(self.tarifas)}
+        self.recursos = []            # posición -> Recurso
+        pos_recurso = {}
+        self.ancho = max((len(t.desglose) for t in self.tarifas), default=0)
+        self.cantidad = []            # por configuración, lista de cantidades (rellena con 0)
+        self.valor_hora = []          # por configuración, lista de valores por hora (rellena con 0)
+        self.recurso_de = []          # por configuración, lista de posiciones de recurso (rellena con -1)
+        for tarifa in self.tarifas:
+            cantidades, valores, recursos = [], [], []
+            for recurso, cantidad, valor_hora in tarifa.desglose:
+                if recurso.id not in pos_recurso:
+                    pos_recurso[recurso.id] = len(self.recursos)
+                    self.recursos.append(recurso)
+                cantidades.append(cantidad)
+                valores.append(valor_hora)
+                recursos.append(pos_recurso[recurso.id])
+            relleno = self.ancho - len(recursos)
+            self.cantidad.append(cantidades + [0] * relleno)
+            self.valor_hora.append(valores + [0.0] * relleno)
+            self.recurso_de.append(recursos + [-1] * relleno)
+        self.categorias = list(dict.fromkeys(t.categoria_nombre for t in self.tarifas))
+        pos_categoria = {nombre: i for i, nombre in enumerate(self.categorias)}
+        self.categoria_de = [pos_categoria[t.categoria_nombre] for t in self.tarifas]
+
+        for cliente in clientes:
+            pos_cliente = len(self.clientes)
+            self.clientes.append(cliente)
+            for instancia in cliente.instancias:
+                self._pos_instancia[instancia] = len(self.instancias)
+                self.instancias.append(instancia)
+                self._cliente_de.append(pos_cliente)
+                self._config_de.append(pos_config.get(instancia.id_configuracion, -1))
+
+        # --- Columnas, una entrada por consumo ---
+        self._bloques = []   # (cliente, instancia, config, ordinal, horas) de cada bloque sellado
+        self._abrir_bloque()
+
+    def _abrir_bloque(self):
+        self.col_cliente = array('i')
+        self.col_instancia = array('i')
+        self.col_config = array('i')
+        self.col_ordinal = array('i')
+        self.col_horas = array('d')
+
+    def _columnas_abiertas(self):
+        return self.col_cliente, self.col_instancia, self.col_config, self.col_ordinal, self.col_horas
+
+    def _sellar_si_esta_lleno(self):
+        if len(self.col_horas) >= FILAS_POR_BLOQUE:
+            self._bloques.append(self._columnas_abiertas())
+            self._abrir_bloque()
+
+    def bloques(self):
+        """Las columnas de cada bloque, en orden de llegada, incluido el abierto."""
+        return self._bloques + [self._columnas_abiertas()]
+
+    def congelar(self):
+        """
+        Copia que ya no cambia aunque lleguen consumos, para facturar sin el
+        bloqueo del almacén. Comparte instancias, tarifas y bloques
+        sellados; solo copia el bloque abierto. Debe llamarse con el
+        bloqueo tomado.
+        """
+        copia = copy.copy(self)
+        copia._bloques = self._bloques + [tuple(columna[:] for columna in self._columnas_abiertas())]
+        copia._abrir_bloque()
+        return copia
+
+    def agregar(self, instancia, consumo, ordinal):
+        pos = self._pos_instancia.get(instancia)
+        if pos is None:
+            return
+        horas = consumo.horas if consumo.horas is not None else math.nan
+        self.col_cliente.append(self._cliente_de[pos])
+        self.col_instancia.append(pos)
+        self.col_config.append(self._config_de[pos])
+        self.col_ordinal.append(ordinal if ordinal is not None else -1)
+        self.col_horas.append(horas)
+        self._sellar_si_esta_lleno()
+
+    def agregar_columnas(self, instancia, horas, ordinales):
+        """
+        Agrega de una vez los consumos de `instancia` ya en columnas:
+        array('d') de horas (NaN si no es numérico) y array('i') de
+        ordinales (-1 si no hay fecha), sin construir cada Consumo.
+        """
+        pos = self._pos_instancia.get(instancia)
+        if pos is None or not horas:
+            return
+        cantidad = len(horas)
+        self.col_cliente.extend(array('i', [self._cliente_de[pos]]) * cantidad)
+        self.col_instancia.extend(array('i', [pos]) * cantidad)
+        self.col_config.extend(array('i', [self._config_de[pos]]) * cantidad)
+        self.col_ordinal.extend(ordinales)
+        self.col_horas.extend(horas)
+        self._sellar_si_esta_lleno()
+
+
+class _Seleccion:
+    """Filas de un rango ya ordenadas, con su costo por recurso calculado."""
+
+    def __init__(self, columnas, inicio_ordinal, fin_ordinal):
+        # Filas del rango de cada bloque; juntas quedan en orden de llegada
+        partes = []
+        for cliente, instancia, config, ordinal, horas in columnas.bloques():
+            if not horas:
+                continue
+            ordinal = np.frombuffer(ordinal, dtype=np.int32)
+            config = np.frombuffer(config, dtype=np.int32)
+            filas = np.flatnonzero((ordinal >= inicio_ordinal) & (ordinal <= fin_ordinal) & (config >= 0))
+            partes.append((np.frombuffer(cliente, dtype=np.int32)[filas],
+                           np.frombuffer(instancia, dtype=np.int32)[filas], config[filas],
+                           np.frombuffer(horas, dtype=np.float64)[filas]))
+        if partes:
+            cliente, instancia, config, horas = (np.concatenate(columna) for columna in zip(*partes))
+        else:
+            cliente = instancia = config = np.zeros(0, dtype=np.int32)
+            horas = np.zeros(0, dtype=np.float64)
+        # Orden de la facturación original: cliente, instancia y luego orden de llegada
+        orden = np.argsort(instancia, kind='stable')
+
+        self.horas = horas[orden]
+        if np.isnan(self.horas).any():
+            raise ValueError("Hay consumos con un tiempo que no es numérico dentro del rango.")
+        self.cliente = cliente[orden]
+        self.instancia = instancia[orden]
+        self.config = config[orden]
+
+        forma = (len(columnas.tarifas), columnas.ancho)
+        cantidad = np.array(columnas.cantidad, dtype=np.float64).reshape(forma)
+        valor_hora = np.array(columnas.valor_hora, dtype=np.float64).reshape(forma)
+        recurso_de = np.array(columnas.recurso_de, dtype=np.int32).reshape(forma)
+        # Un consumo x una posición del desglose; las posiciones de relleno quedan fuera
+        costos = (self.horas[:, None] * cantidad[self.config]) * valor_hora[self.config]
+        self.fila_detalle, posicion = np.nonzero(recurso_de[self.config] >= 0)
+        self.costo_detalle = costos[self.fila_detalle, posicion]
+        self.recurso_detalle = recurso_de[self.config[self.fila_detalle], posicion]
+
+
+def facturar_rango(columnas, inicio_ordinal, fin_ordinal):
+    """
+    Devuelve (montos, detalles_consumo) con el mismo contenido y orden que
+    la facturación en Python: `montos` es una lista de (Cliente, monto)
+    en el orden de los clientes.
+    """
+    seleccion = _Seleccion(columnas, inicio_ordinal, fin_ordinal)
+    # bincount suma los costos en el orden de las filas, igual que el acumulado original
+    montos = np.bincount(seleccion.cliente[seleccion.fila_detalle], weights=seleccion.costo_detalle,
+                         minlength=len(columnas.clientes)).tolist()
+
+    instancias = [
+        (instancia.cliente.nit, instancia.id, instancia.nombre,
+         columnas.tarifas[pos_config].categoria_nombre if pos_config >= 0 else None)
+        for instancia, pos_config in zip(columnas.instancias, columnas._config_de)
+    ]
+    recursos = [(r.id, r.nombre) for r in columnas.recursos]
+    instancia_detalle = seleccion.instancia[seleccion.fila_detalle].tolist()
+    detalles_consumo = []
+    for pos_instancia, pos_recurso, costo in zip(instancia_detalle, seleccion.recurso_detalle.tolist(),
+                                                 seleccion.costo_detalle.tolist()):
+        nit, id_instancia, nombre_instancia, categoria = instancias[pos_instancia]
+        id_recurso, nombre_recurso = recursos[pos_recurso]
+        detalles_consumo.append({
+            "nit_cliente": nit,
+            "instancia_id": id_instancia,
+            "instancia_nombre": nombre_instancia,
+            "recurso_id": id_recurso,
+            "recurso_nombre": nombre_recurso,
+            "categoria_nombre": categoria,
+            "costo_total_consumo": costo,
+        })
+    return list(zip(columnas.clientes, montos)), detalles_consumo
+
+
+def agregar_rango(columnas, inicio_ordinal, fin_ordinal):
+    """
+    Totales del rango agrupados por cliente (NIT), instancia (nit, id),
+    recurso (nombre) y categoría (nombre), sin construir los detalles.
+    """
+    seleccion = _Seleccion(columnas, inicio_ordinal, fin_ordinal)
+    costo = seleccion.costo_detalle
+    instancia_detalle = seleccion.instancia[seleccion.fila_detalle]
+    config_detalle = seleccion.config[seleccion.fila_detalle]
+    categoria_detalle = np.array(columnas.categoria_de, dtype=np.int32)[config_detalle]
+
+    def agrupar(indices, claves):
+        sumas = np.bincount(indices, weights=costo, minlength=len(claves)).tolist()
+        presentes = np.bincount(indices, minlength=len(claves)).tolist()
+        return {clave: suma for clave, suma, cuenta in zip(claves, sumas, presentes) if cuenta}
+
+    # El reporte agrupa por nombre; se agrupa directo por nombre para sumar en el mismo orden
+    nombres_recurso = list(dict.fromkeys(r.nombre for r in columnas.recursos))
+    pos_nombre = {nombre: i for i, nombre in enumerate(nombres_recurso)}
+    nombre_de_recurso = np.array([pos_nombre[r.nombre] for r in columnas.recursos], dtype=np.int32)
+
+    return {
+        "por_cliente": agrupar(seleccion.cliente[seleccion.fila_detalle], [c.nit for c in columnas.clientes]),
+        "por_instancia": agrupar(instancia_detalle, [(i.cliente.nit, i.id) for i in columnas.instancias]),
+        "por_recurso": agrupar(nombre_de_recurso[seleccion.recurso_detalle], nombres_recurso),
+        "por_categoria": agrupar(categoria_detalle, columnas.categorias),
+    }
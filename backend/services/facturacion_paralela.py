@@ -0,0 +1,137 @@
+# --- backend/services/facturacion_paralela.py ---
+#
+# Facturación repartida entre procesos. Los clientes se dividen en
+# fragmentos contiguos (en el orden de siempre) con una cantidad parecida
+# de consumos; cada proceso factura su fragmento con las mismas
+# operaciones que la ruta en Python, y los resultados se unen en el orden
+# de los fragmentos. Por eso montos y detalles son idénticos a la
+# facturación en serie; los números de factura se asignan después, igual
+# que siempre.
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+TRABAJADORES_FACTURACION = 0    # procesos por defecto; 0 o 1 factura en serie
+MAX_TRABAJADORES_FACTURACION = 32   # tope para el parámetro de la petición
+FRAGMENTOS_POR_TRABAJADOR = 4   # más fragmentos que procesos, para repartir mejor la carga
+
+_pool = None            # (cantidad de trabajadores, ProcessPoolExecutor)
+_bloqueo_pool = threading.Lock()
+
+
+def _obtener_pool(trabajadores):
+    global _pool
+    with _bloqueo_pool:
+        if _pool is None or _pool[0] != trabajadores:
+            # Se conserva un solo pool; si cambia la cantidad se reemplaza
+            if _pool is not None:
+                _pool[1].shutdown(wait=False)
+            # 'spawn', igual que la cola de trabajos, porque el servidor ya tiene hilos
+            _pool = (trabajadores, ProcessPoolExecutor(max_workers=trabajadores,
+                                                       mp_context=multiprocessing.get_context('spawn')))
+        return _pool[1]
+
+
+def _descartar_pool():
+    global _pool
+    with _bloqueo_pool:
+        _pool = None
+
+
+def facturar_fragmento(fragmento):
+    """
+    Se ejecuta en el proceso trabajador. `fragmento` es (tarifas, clientes):
+    tarifas {id_configuracion: (categoria, [(id_recurso, nombre_recurso,
+    cantidad, valor_hora)])} y clientes [(nit, [(id_instancia,
+    nombre_instancia, id_configuracion, [horas])])]. Devuelve
+    ([(nit, monto)], detalles_consumo) en el orden recibido.
+    """
+    tarifas, clientes = fragmento
+    montos = []
+    detalles_consumo = []
+    for nit, instancias in clientes:
+        monto_total_cliente = 0.0
+        for id_instancia, nombre_instancia, id_configuracion, horas in instancias:
+            categoria_nombre, desglose = tarifas[id_configuracion]
+            for tiempo_consumido in horas:
+                if tiempo_consumido is None:
+                    raise ValueError("Hay un consumo con tiempo no numérico.")
+                for id_recurso, nombre_recurso, cantidad, valor_hora in desglose:
+                    costo_total_consumo = tiempo_consumido * cantidad * valor_hora
+                    monto_total_cliente += costo_total_consumo
+                    detalles_consumo.append({
+                        "nit_cliente": nit,
+                        "instancia_id": id_instancia,
+                        "instancia_nombre": nombre_instancia,
+                        "recurso_id": id_recurso,
+                        "recurso_nombre": nombre_recurso,
+                        "categoria_nombre": categoria_nombre,
+                        "costo_total_consumo": costo_total_consumo,
+                    })
+        montos.append((nit, monto_total_cliente))
+    return montos, detalles_consumo
+
+
+def _armar_fragmentos(lectura, cantidad):
+    """Datos simples (serializables) de cada fragmento de clientes con consumos en el rango."""
+    tarifas = lectura.tarifas
+    consumos_por_instancia = lectura.consumos_por_instancia()
+    usadas = {}
+    clientes = []   # (nit, instancias, cantidad de consumos)
+    for cliente in lectura.clientes:
+        instancias = []
+        total = 0
+        for instancia in cliente.instancias:
+            consumos = consumos_por_instancia.get(instancia)
+            if not consumos: continue
+            tarifa = tarifas.get(instancia.id_configuracion)
+            if tarifa is None: continue
+            if instancia.id_configuracion not in usadas:
+                usadas[instancia.id_configuracion] = (
+                    tarifa.categoria_nombre,
+                    [(recurso.id, recurso.nombre, cantidad, valor_hora)
+                     for recurso, cantidad, valor_hora in tarifa.desglose])
+            instancias.append((instancia.id, instancia.nombre, instancia.id_configuracion,
+                               [consumo.horas for consumo in consumos]))
+            total += len(consumos)
+        if instancias:
+            clientes.append((cliente.nit, instancias, total))
+
+    # Cortes contiguos con una cantidad parecida de consumos
+    total_consumos = sum(c[2] for c in clientes)
+    objetivo = max(1, -(-total_consumos // cantidad))
+    fragmentos, actual, acumulado = [], [], 0
+    for nit, instancias, total in clientes:
+        actual.append((nit, instancias))
+        acumulado += total
+        if acumulado >= objetivo:
+            fragmentos.append((usadas, actual))
+            actual, acumulado = [], 0
+    if actual:
+        fragmentos.append((usadas, actual))
+    return fragmentos
+
+
+def facturar_rango_paralelo(lectura, trabajadores):
+    """
+    Igual que las otras rutas de facturación: devuelve (montos,
+    detalles_consumo) con `montos` como lista de (Cliente, monto) en el
+    orden de los clientes. `lectura` es una LecturaRango del almacén
+    (ver almacen.py); no hace falta el bloqueo.
+    """
+    fragmentos = _armar_fragmentos(lectura, trabajadores * FRAGMENTOS_POR_TRABAJADOR)
+    monto_por_nit = {}
+    detalles_consumo = []
+    try:
+        # map entrega los resultados en el orden de los fragmentos
+        for montos, detalles in _obtener_pool(trabajadores).map(facturar_fragmento, fragmentos):
+            monto_por_nit.update(montos)
+            detalles_consumo.extend(detalles)
+    except BrokenProcessPool:
+        # Un proceso murió; la próxima llamada crea un pool nuevo
+        _descartar_pool()
+        raise
+    montos = [(cliente, monto_por_nit.get(cliente.nit, 0.0)) for cliente in lectura.clientes]
+    return montos, detalles_consumo
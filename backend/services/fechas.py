@@ -0,0 +1,43 @@
+# --- backend/services/fechas.py ---
+#
+# Utilidades de fechas compartidas por el almacén y la facturación.
+#
+# Los campos fechaHora y fechaInicio son texto libre: la fecha (dd/mm/aaaa)
+# puede venir rodeada de otras palabras y la hora (hh:mm) es opcional.
+# Cada texto se interpreta una sola vez, al crear el consumo, y el
+# resultado se memoriza porque los mismos textos se repiten mucho.
+
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+# Igual que antes se toma la primera fecha del texto; la hora, si la sigue
+PATRON_FECHA = re.compile(r'(\d{2})/(\d{2})/(\d{4})(?:\s+(\d{1,2}):(\d{2}))?')
+
+SIN_FECHA = (None, None)
+
+
+@lru_cache(maxsize=1 << 16)
+def normalizar_fecha(texto):
+    """
+    (ordinal del día, minutos desde la medianoche) de un texto de fecha.
+    Los minutos son None si el texto no trae una hora válida; ambos son
+    None si no hay fecha o no existe (por ejemplo 31/02/2020).
+    """
+    coincidencia = PATRON_FECHA.search(texto) if texto else None
+    if coincidencia is None:
+        return SIN_FECHA
+    dia, mes, anio, hora, minuto = coincidencia.groups()
+    try:
+        ordinal = date(int(anio), int(mes), int(dia)).toordinal()
+    except ValueError:
+        return SIN_FECHA
+    minutos = None
+    if hora is not None and int(hora) < 24 and int(minuto) < 60:
+        minutos = int(hora) * 60 + int(minuto)
+    return ordinal, minutos
+
+
+def extraer_fecha(texto_fecha):
+    ordinal = normalizar_fecha(texto_fecha)[0]
+    return datetime.fromordinal(ordinal) if ordinal is not None else None
@@ -0,0 +1,51 @@
+# --- backend/services/indice_fechas.py ---
+#
+# Índice de consumos particionado por día. Cada día (ordinal de la fecha)
+# tiene su lista de consumos y los días se mantienen ordenados, así una
+# consulta por rango solo recorre los consumos que caen dentro de él.
+
+from bisect import bisect_left, bisect_right, insort
+
+
+class IndiceFechas:
+    def __init__(self):
+        self._dias = []       # ordinales con al menos un consumo, ordenados
+        self._por_dia = {}    # ordinal -> lista de (secuencia, instancia, consumo)
+        self._secuencia = 0   # conserva el orden de llegada de los consumos
+
+    def agregar(self, instancia, consumo, ordinal):
+        self._secuencia += 1
+        if ordinal is None:
+            # Igual que en la facturación original, un consumo sin fecha nunca entra en un rango
+            return
+        bucket = self._por_dia.get(ordinal)
+        if bucket is None:
+            bucket = self._por_dia[ordinal] = []
+            insort(self._dias, ordinal)
+        bucket.append((self._secuencia, instancia, consumo))
+
+    def vista(self, inicio_ordinal, fin_ordinal):
+        """
+        Los días del rango como (lista del día, largo actual). Las listas
+        solo crecen, así que esos prefijos ya no cambian: la vista se toma
+        con el bloqueo del almacén y se recorre (con `consumos_por_instancia`)
+        sin él.
+        """
+        desde = bisect_left(self._dias, inicio_ordinal)
+        hasta = bisect_right(self._dias, fin_ordinal)
+        return [(self._por_dia[ordinal], len(self._por_dia[ordinal])) for ordinal in self._dias[desde:hasta]]
+
+
+def consumos_por_instancia(vista):
+    """
+    Devuelve {instancia: [consumos]} con los consumos de una vista de
+    IndiceFechas.vista, en el orden en que llegaron.
+    """
+    encontrados = {}
+    for lista, largo in vista:
+        for secuencia, instancia, consumo in lista[:largo]:
+            encontrados.setdefault(instancia, []).append((secuencia, consumo))
+    return {
+        instancia: [consumo for _, consumo in sorted(lista, key=lambda par: par[0])]
+        for instancia, lista in encontrados.items()
+    }
@@ -0,0 +1,307 @@
+# --- backend/services/instantanea.py ---
+#
+# Instantánea binaria del almacén, escrita junto a data.xml cada vez que
+# este se guarda. Al arrancar (o recargar) se usa en lugar de parsear el
+# XML si corresponde a la misma escritura; data.xml sigue siendo el
+# formato de importación y exportación.
+#
+# Formato (enteros en little-endian):
+#   MAGIA (8 bytes) | versión (uint32) | largo del encabezado (uint32)
+#   encabezado JSON: id de configuración, segmento compactado y, por
+#                    sección, [posición, largo] dentro del archivo
+#   secciones:       arreglos empacados (uint32 salvo los de _FORMATOS)
+#
+# Todos los textos (nombres, ids, tiempos, fechas...) van una sola vez en
+# la tabla de cadenas y las secciones guardan su índice (0 es None). Los
+# consumos se guardan en columnas agrupadas por instancia: el texto del
+# tiempo y de la fecha, y además ya interpretados las horas (NaN si el
+# tiempo no es numérico), el ordinal del día y los minutos (-1 si no hay).
+# El archivo se abre con mmap: recursos, categorías y clientes se
+# construyen al cargar; los consumos de cada instancia recién cuando se
+# usan por primera vez, sin volver a interpretar los textos, y el motor
+# columnar toma las horas y los días directo de las columnas.
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from .modelos import Recurso, Configuracion, Categoria, Cliente, Instancia, Consumo
+
+MAGIA = b'TCHINST\x00'
+VERSION = 2
+_CABECERA = struct.Struct('<8sII')
+
+# Formato de las secciones que no son uint32 ('cadenas_datos' son bytes)
+_FORMATOS = {'cadenas_posiciones': 'Q', 'consumo_horas': 'd', 'consumo_ordinal': 'i', 'consumo_minutos': 'h'}
+
+# Campos de cada registro, en el orden en que se guardan
+_CAMPOS_RECURSO = ('id', 'nombre', 'abreviatura', 'metrica', 'tipo', 'valor_x_hora')
+_CAMPOS_CATEGORIA = ('id', 'nombre', 'descripcion', 'carga_trabajo')
+_CAMPOS_CONFIGURACION = ('id', 'nombre', 'descripcion')
+_CAMPOS_CLIENTE = ('nit', 'nombre', 'usuario', 'clave', 'direccion', 'correo_electronico')
+_CAMPOS_INSTANCIA = ('id', 'id_configuracion', 'nombre', 'fecha_inicio', 'estado', 'fecha_final')
+
+# La instantánea guarda los arreglos tal cual están en memoria
+_COMPATIBLE = sys.byteorder == 'little' and all(
+    array(formato).itemsize == tamano for formato, tamano in (('I', 4), ('i', 4), ('h', 2), ('d', 8)))
+
+
+class _TablaCadenas:
+    def __init__(self):
+        self._indices = {}
+        self._cadenas = [None]
+
+    def indice(self, texto):
+        if texto is None:
+            return 0
+        indice = self._indices.get(texto)
+        if indice is None:
+            indice = self._indices[texto] = len(self._cadenas)
+            self._cadenas.append(texto)
+        return indice
+
+    def empacar(self):
+        """(posiciones, datos): la cadena i ocupa datos[posiciones[i]:posiciones[i + 1]]."""
+        posiciones = array('Q', [0, 0])
+        partes = []
+        total = 0
+        for texto in self._cadenas[1:]:
+            codificado = texto.encode('utf-8')
+            partes.append(codificado)
+            total += len(codificado)
+            posiciones.append(total)
+        return posiciones, b''.join(partes)
+
+
+def escribir_instantanea(ruta, recursos, categorias, clientes, limites_consumo, id_config, segmento):
+    """
+    Escribe la instantánea en `ruta` (que todavía no es la definitiva; el
+    almacén la renombra junto con data.xml). `limites_consumo` acota los
+    consumos de cada instancia igual que en data.xml.
+    """
+    cadenas = _TablaCadenas()
+    secciones = {nombre: array(_FORMATOS.get(nombre, 'I')) for nombre in (
+        'recursos', 'categorias', 'configuraciones', 'recursos_configuracion', 'clientes', 'instancias',
+        'consumo_tiempo', 'consumo_fecha', 'consumo_horas', 'consumo_ordinal', 'consumo_minutos')}
+
+    for recurso in recursos:
+        secciones['recursos'].extend(cadenas.indice(getattr(recurso, c)) for c in _CAMPOS_RECURSO)
+    for categoria in categorias:
+        secciones['categorias'].extend(cadenas.indice(getattr(categoria, c)) for c in _CAMPOS_CATEGORIA)
+        secciones['categorias'].append(len(categoria.configuraciones))
+        for conf in categoria.configuraciones:
+            secciones['configuraciones'].extend(cadenas.indice(getattr(conf, c)) for c in _CAMPOS_CONFIGURACION)
+            secciones['configuraciones'].append(len(conf.recursos))
+            for id_recurso, cantidad in conf.recursos:
+                secciones['recursos_configuracion'].extend((cadenas.indice(id_recurso), cadenas.indice(cantidad)))
+    tiempos, fechas = secciones['consumo_tiempo'], secciones['consumo_fecha']
+    horas, ordinales, minutos = secciones['consumo_horas'], secciones['consumo_ordinal'], secciones['consumo_minutos']
+    for cliente in clientes:
+        secciones['clientes'].extend(cadenas.indice(getattr(cliente, c)) for c in _CAMPOS_CLIENTE)
+        secciones['clientes'].append(len(cliente.instancias))
+        for instancia in cliente.instancias:
+            consumos = instancia.consumos[:limites_consumo.get(instancia, 0)]
+            secciones['instancias'].extend(cadenas.indice(getattr(instancia, c)) for c in _CAMPOS_INSTANCIA)
+            secciones['instancias'].append(len(consumos))
+            for consumo in consumos:
+                tiempos.append(cadenas.indice(consumo.tiempo))
+                fechas.append(cadenas.indice(consumo.fecha_hora))
+                horas.append(consumo.horas if consumo.horas is not None else math.nan)
+                ordinales.append(consumo.ordinal if consumo.ordinal is not None else -1)
+                minutos.append(consumo.minutos if consumo.minutos is not None else -1)
+
+    posiciones, datos_cadenas = cadenas.empacar()
+    cuerpos = [('cadenas_posiciones', posiciones.tobytes()), ('cadenas_datos', datos_cadenas)]
+    cuerpos += [(nombre, arreglo.tobytes()) for nombre, arreglo in secciones.items()]
+
+    def encabezado(inicio):
+        indice, posicion = {}, inicio
+        for nombre, cuerpo in cuerpos:
+            indice[nombre] = [posicion, len(cuerpo)]
+            # Cada sección empieza alineada a 8 bytes para poder leerla sin copiar
+            posicion += len(cuerpo) + (-len(cuerpo) % 8)
+        return json.dumps({"id_config": id_config, "segmento_compactado": segmento,
+                           "secciones": indice}).encode('utf-8')
+
+    # Las posiciones dependen del largo del encabezado; se calcula hasta que no cambie
+    largo = 0
+    while True:
+        inicio = _CABECERA.size + largo
+        inicio += -inicio % 8
+        texto = encabezado(inicio)
+        if len(texto) == largo:
+            break
+        largo = len(texto)
+
+    with open(ruta, 'wb') as archivo:
+        archivo.write(_CABECERA.pack(MAGIA, VERSION, len(texto)))
+        archivo.write(texto)
+        archivo.write(b'\x00' * (inicio - _CABECERA.size - len(texto)))
+        for _, cuerpo in cuerpos:
+            archivo.write(cuerpo)
+            archivo.write(b'\x00' * (-len(cuerpo) % 8))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+
+class _ConsumosDiferidos:
+    """
+    Los consumos [inicio, fin) de la instantánea: llamarlo los construye;
+    `columnas` entrega sus horas y días sin construirlos.
+    """
+
+    __slots__ = ('_instantanea', '_inicio', '_fin')
+
+    def __init__(self, instantanea, inicio, fin):
+        self._instantanea = instantanea
+        self._inicio = inicio
+        self._fin = fin
+
+    def __call__(self):
+        return self._instantanea._consumos(self._inicio, self._fin)
+
+    def columnas(self):
+        """(horas, ordinales) como array('d') y array('i'), con NaN y -1 donde no hay valor."""
+        return self._instantanea._columnas(self._inicio, self._fin)
+
+
+def _seccion(datos, nombre):
+    return datos if nombre == 'cadenas_datos' else datos.cast(_FORMATOS.get(nombre, 'I'))
+
+
+class Instantanea:
+    """Instantánea abierta con mmap; ver `abrir`."""
+
+    def __init__(self, memoria, encabezado):
+        self._memoria = memoria
+        self.id_config = encabezado['id_config']
+        self.segmento_compactado = encabezado['segmento_compactado']
+        # Las lecturas no se cruzan con `cerrar`, que cambia las secciones
+        self._bloqueo = threading.Lock()
+        self._cargada = False
+        self._vista = memoryview(memoria)
+        self._secciones = {}
+        for nombre, (posicion, largo) in encabezado['secciones'].items():
+            self._secciones[nombre] = _seccion(self._vista[posicion:posicion + largo], nombre)
+        self._cadenas = [None] * (len(self._secciones['cadenas_posiciones']) - 1)
+
+    @classmethod
+    def abrir(cls, ruta):
+        """La instantánea de `ruta`, o None si no existe o no se puede usar."""
+        if not _COMPATIBLE:
+            return None
+        try:
+            with open(ruta, 'rb') as archivo:
+                memoria = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            magia, version, largo = _CABECERA.unpack_from(memoria)
+            if magia != MAGIA or version != VERSION:
+                raise ValueError("Instantánea de otro formato")
+            encabezado = json.loads(memoria[_CABECERA.size:_CABECERA.size + largo])
+            return cls(memoria, encabezado)
+        except (struct.error, ValueError, KeyError, TypeError):
+            memoria.close()
+            return None
+
+    def cerrar(self):
+        """
+        Cierra el mmap para poder reemplazar o borrar el archivo (en Windows
+        no se puede mientras está mapeado). Si ya se cargó, antes se copia
+        a memoria lo que falta leer: las instancias diferidas siguen
+        funcionando.
+        """
+        with self._bloqueo:
+            if self._memoria.closed:
+                return
+            anteriores = self._secciones
+            if self._cargada:
+                self._secciones = {nombre: _seccion(memoryview(bytes(seccion)), nombre)
+                                   for nombre, seccion in anteriores.items()}
+            for seccion in anteriores.values():
+                seccion.release()
+            self._vista.release()
+            self._memoria.close()
+
+    def _cadena(self, indice):
+        """Debe llamarse con `_bloqueo` tomado."""
+        if indice == 0:
+            return None
+        # Cada texto se decodifica una vez y se comparte entre todos los que lo usan
+        texto = self._cadenas[indice]
+        if texto is None:
+            posiciones = self._secciones['cadenas_posiciones']
+            texto = self._cadenas[indice] = str(
+                self._secciones['cadenas_datos'][posiciones[indice]:posiciones[indice + 1]], 'utf-8')
+        return texto
+
+    def _registros(self, seccion, campos, extra=1):
+        """Recorre la sección como registros de len(campos) textos más `extra` contadores."""
+        datos = self._secciones[seccion]
+        ancho = len(campos) + extra
+        for inicio in range(0, len(datos), ancho):
+            textos = {campo: self._cadena(datos[inicio + i]) for i, campo in enumerate(campos)}
+            yield textos, datos[inicio + len(campos):inicio + ancho].tolist()
+
+    def _consumos(self, inicio, fin):
+        with self._bloqueo:
+            secciones = self._secciones
+            tiempos, fechas, horas, ordinales, minutos = (
+                secciones[nombre][inicio:fin].tolist() for nombre in (
+                    'consumo_tiempo', 'consumo_fecha', 'consumo_horas', 'consumo_ordinal', 'consumo_minutos'))
+            cadena = self._cadena
+            nuevo = Consumo.desde_valores
+            return [nuevo(cadena(t), cadena(f), h if h == h else None, o if o >= 0 else None, m if m >= 0 else None)
+                    for t, f, h, o, m in zip(tiempos, fechas, horas, ordinales, minutos)]
+
+    def _columnas(self, inicio, fin):
+        horas, ordinales = array('d'), array('i')
+        with self._bloqueo:
+            horas.frombytes(self._secciones['consumo_horas'][inicio:fin].cast('B'))
+            ordinales.frombytes(self._secciones['consumo_ordinal'][inicio:fin].cast('B'))
+        return horas, ordinales
+
+    def cargar(self):
+        """(recursos, categorías, clientes) con los consumos diferidos."""
+        with self._bloqueo:
+            self._cargada = True
+            return self._cargar()
+
+    def _cargar(self):
+        recursos = [Recurso(**textos) for textos, _ in self._registros('recursos', _CAMPOS_RECURSO, 0)]
+
+        configuraciones = self._registros('configuraciones', _CAMPOS_CONFIGURACION)
+        pares = self._secciones['recursos_configuracion']
+        posicion_par = 0
+        categorias = []
+        for textos, (cantidad_confs,) in self._registros('categorias', _CAMPOS_CATEGORIA):
+            confs = []
+            for _ in range(cantidad_confs):
+                textos_conf, (cantidad_recursos,) = next(configuraciones)
+                fin = posicion_par + 2 * cantidad_recursos
+                recursos_conf = [(self._cadena(pares[i]), self._cadena(pares[i + 1]))
+                                 for i in range(posicion_par, fin, 2)]
+                posicion_par = fin
+                confs.append(Configuracion(recursos=recursos_conf, **textos_conf))
+            categorias.append(Categoria(configuraciones=confs, **textos))
+
+        instancias = self._registros('instancias', _CAMPOS_INSTANCIA)
+        posicion_consumo = 0
+        clientes = []
+        for textos, (cantidad_instancias,) in self._registros('clientes', _CAMPOS_CLIENTE):
+            lista = []
+            for _ in range(cantidad_instancias):
+                textos_inst, (cantidad_consumos,) = next(instancias)
+                instancia = Instancia(**textos_inst)
+                fin = posicion_consumo + cantidad_consumos
+                instancia.diferir_consumos(_ConsumosDiferidos(self, posicion_consumo, fin), cantidad_consumos)
+                posicion_consumo = fin
+                lista.append(instancia)
+            clientes.append(Cliente(instancias=lista, **textos))
+        return recursos, categorias, clientes
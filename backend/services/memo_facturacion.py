@@ -0,0 +1,92 @@
+# --- backend/services/memo_facturacion.py ---
+#
+# Memoria de resultados de facturación por rango de fechas. Guarda los
+# montos por cliente y los detalles de consumo de los rangos pedidos
+# recientemente, para que el reporte de ventas y el detalle de factura no
+# vuelvan a facturar lo que el usuario acaba de facturar. Un consumo nuevo
+# solo invalida los rangos que contienen su fecha; un cambio de recursos o
+# configuraciones (version_config) invalida todo.
+
+from bisect import bisect_left
+from collections import OrderedDict
+
+MAX_RANGOS_MEMO = 32                # rangos recordados como máximo
+MAX_DETALLES_MEMO = 1_000_000       # filas de detalle entre todos los rangos
+
+
+class ResultadoFacturacion:
+    """Resultado de facturar un rango: montos por cliente y detalles."""
+
+    def __init__(self, montos, detalles_consumo):
+        self.montos = montos                      # lista de (Cliente, monto) en orden de clientes
+        self.detalles_consumo = detalles_consumo
+        self._resumen = None
+
+    def resumen_ventas(self):
+        """Ingresos agrupados por nombre de recurso y de categoría."""
+        if self._resumen is None:
+            ingresos_por_recurso = {}
+            ingresos_por_categoria = {}
+            for detalle in self.detalles_consumo:
+                recurso_nombre = detalle['recurso_nombre']
+                costo = detalle['costo_total_consumo']
+                if recurso_nombre not in ingresos_por_recurso: ingresos_por_recurso[recurso_nombre] = 0
+                ingresos_por_recurso[recurso_nombre] += costo
+                categoria_nombre = detalle['categoria_nombre']
+                if categoria_nombre not in ingresos_por_categoria: ingresos_por_categoria[categoria_nombre] = 0
+                ingresos_por_categoria[categoria_nombre] += costo
+            self._resumen = {"por_recurso": ingresos_por_recurso, "por_categoria": ingresos_por_categoria}
+        return self._resumen
+
+
+class MemoFacturacion:
+    def __init__(self, max_rangos=MAX_RANGOS_MEMO, max_detalles=MAX_DETALLES_MEMO):
+        self.max_rangos = max_rangos
+        self.max_detalles = max_detalles
+        self._entradas = OrderedDict()   # (inicio, fin) -> (version_config, ResultadoFacturacion)
+        self._detalles = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obtener(self, inicio_ordinal, fin_ordinal, version_config):
+        clave = (inicio_ordinal, fin_ordinal)
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada[0] != version_config:
+            self._descartar(clave)
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada[1]
+
+    def guardar(self, inicio_ordinal, fin_ordinal, version_config, resultado):
+        clave = (inicio_ordinal, fin_ordinal)
+        self._descartar(clave)
+        if len(resultado.detalles_consumo) > self.max_detalles:
+            return
+        self._entradas[clave] = (version_config, resultado)
+        self._detalles += len(resultado.detalles_consumo)
+        while len(self._entradas) > self.max_rangos or self._detalles > self.max_detalles:
+            self._descartar(next(iter(self._entradas)))
+
+    def invalidar_fechas(self, ordinales):
+        """Descarta los rangos que contienen alguno de los ordinales de día dados."""
+        if not self._entradas:
+            return
+        dias = sorted({o for o in ordinales if o is not None})
+        if not dias:
+            return
+        for inicio, fin in list(self._entradas):
+            i = bisect_left(dias, inicio)
+            if i < len(dias) and dias[i] <= fin:
+                self._descartar((inicio, fin))
+
+    def vaciar(self):
+        self._entradas.clear()
+        self._detalles = 0
+
+    def _descartar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._detalles -= len(entrada[1].detalles_consumo)
@@ -0,0 +1,377 @@
+# --- backend/services/modelos.py ---
+#
+# Clases del dominio que el almacén en memoria mantiene indexadas.
+# Cada clase sabe leerse desde su nodo XML y volver a escribirse en él,
+# de modo que data.xml sigue siendo el formato de persistencia. `a_dict`
+# arma el mismo JSON que devolvía consultarDatos, pero directo desde los
+# objetos y omitiendo los campos de `excluir` (sin llegar a construirlos).
+# Todas usan __slots__: el almacén mantiene millones de consumos en memoria.
+
+import threading
+import xml.etree.ElementTree as ET
+
+from .fechas import normalizar_fecha
+
+# Serializa la carga diferida de consumos (ver Instancia.diferir_consumos)
+_bloqueo_consumos = threading.Lock()
+
+
+def _texto(nodo, tag):
+    """Devuelve el texto (sin espacios) del hijo `tag`, o None si no existe."""
+    hijo = nodo.find(tag)
+    if hijo is None or hijo.text is None:
+        return None
+    return hijo.text.strip()
+
+
+def _agregar_texto(padre, tag, valor):
+    if valor is not None:
+        ET.SubElement(padre, tag).text = str(valor)
+
+
+def _copiar_presentes(destino, origen, atributos):
+    """
+    Copia de `origen` los atributos que no son None. Al fusionar, un campo
+    que no vino en el archivo (o vino vacío) queda None y conserva el valor
+    que ya tenía `destino`.
+    """
+    for atributo in atributos:
+        valor = getattr(origen, atributo)
+        if valor is not None:
+            setattr(destino, atributo, valor)
+
+
+def _dict_campos(campos, excluir):
+    """Dict con los (tag, valor) que no son None ni están en `excluir`."""
+    return {tag: str(valor) for tag, valor in campos if valor is not None and tag not in excluir}
+
+
+class Recurso:
+    """Recurso de hardware o software con su costo por hora."""
+
+    __slots__ = ('id', 'nombre', 'abreviatura', 'metrica', 'tipo', 'valor_x_hora')
+
+    def __init__(self, id, nombre=None, abreviatura=None, metrica=None, tipo=None, valor_x_hora=None):
+        self.id = id
+        self.nombre = nombre
+        self.abreviatura = abreviatura
+        self.metrica = metrica
+        self.tipo = tipo
+        self.valor_x_hora = valor_x_hora
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        return cls(
+            nodo.get('id'),
+            nombre=_texto(nodo, 'nombre'),
+            abreviatura=_texto(nodo, 'abreviatura'),
+            metrica=_texto(nodo, 'metrica'),
+            tipo=_texto(nodo, 'tipo'),
+            valor_x_hora=_texto(nodo, 'valorXhora'),
+        )
+
+    def a_xml(self, padre):
+        nodo = ET.SubElement(padre, 'recurso', id=str(self.id))
+        _agregar_texto(nodo, 'nombre', self.nombre)
+        _agregar_texto(nodo, 'abreviatura', self.abreviatura)
+        _agregar_texto(nodo, 'metrica', self.metrica)
+        _agregar_texto(nodo, 'tipo', self.tipo)
+        _agregar_texto(nodo, 'valorXhora', self.valor_x_hora)
+        return nodo
+
+    def a_dict(self, excluir=frozenset()):
+        return _dict_campos([('id', self.id), ('nombre', self.nombre), ('abreviatura', self.abreviatura),
+                             ('metrica', self.metrica), ('tipo', self.tipo),
+                             ('valorXhora', self.valor_x_hora)], excluir)
+
+    def actualizar_desde(self, otro):
+        """Copia los datos que trae `otro`; los que no trae se conservan."""
+        _copiar_presentes(self, otro, ('nombre', 'abreviatura', 'metrica', 'tipo', 'valor_x_hora'))
+
+
+class Configuracion:
+    """Configuración de una categoría: lista de (id_recurso, cantidad)."""
+
+    __slots__ = ('id', 'nombre', 'descripcion', 'recursos', 'categoria')
+
+    def __init__(self, id, nombre=None, descripcion=None, recursos=None):
+        self.id = id
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.recursos = recursos if recursos is not None else []
+        self.categoria = None
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        recursos = []
+        for rec in nodo.findall('recursosConfiguracion/recurso'):
+            cantidad = rec.text.strip() if rec.text else None
+            recursos.append((rec.get('id'), cantidad))
+        return cls(nodo.get('id'), nombre=_texto(nodo, 'nombre'),
+                   descripcion=_texto(nodo, 'descripcion'), recursos=recursos)
+
+    def a_xml(self, padre):
+        nodo = ET.SubElement(padre, 'configuracion', id=str(self.id))
+        _agregar_texto(nodo, 'nombre', self.nombre)
+        _agregar_texto(nodo, 'descripcion', self.descripcion)
+        lista = ET.SubElement(nodo, 'recursosConfiguracion')
+        for id_recurso, cantidad in self.recursos:
+            ET.SubElement(lista, 'recurso', id=str(id_recurso)).text = cantidad
+        return nodo
+
+    def a_dict(self, excluir=frozenset()):
+        datos = _dict_campos([('id', self.id), ('nombre', self.nombre), ('descripcion', self.descripcion)], excluir)
+        if 'recursosConfiguracion' not in excluir:
+            datos['recursosConfiguracion'] = {"recurso": [
+                _dict_campos([('id', id_recurso), ('valor', cantidad)], ()) for id_recurso, cantidad in self.recursos
+            ]}
+        return datos
+
+    def actualizar_desde(self, otro):
+        """Copia los datos que trae `otro`; sin recursos se conservan los que tenía."""
+        _copiar_presentes(self, otro, ('nombre', 'descripcion'))
+        if otro.recursos:
+            self.recursos = otro.recursos
+
+
+class Categoria:
+    """Categoría de carga de trabajo con sus configuraciones."""
+
+    __slots__ = ('id', 'nombre', 'descripcion', 'carga_trabajo', 'configuraciones')
+
+    def __init__(self, id, nombre=None, descripcion=None, carga_trabajo=None, configuraciones=None):
+        self.id = id
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.carga_trabajo = carga_trabajo
+        self.configuraciones = []
+        for conf in configuraciones or []:
+            self.agregar_configuracion(conf)
+
+    def agregar_configuracion(self, configuracion):
+        configuracion.categoria = self
+        self.configuraciones.append(configuracion)
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        configuraciones = [Configuracion.desde_xml(c) for c in nodo.findall('listaConfiguraciones/configuracion')]
+        return cls(nodo.get('id'), nombre=_texto(nodo, 'nombre'), descripcion=_texto(nodo, 'descripcion'),
+                   carga_trabajo=_texto(nodo, 'cargaTrabajo'), configuraciones=configuraciones)
+
+    def a_xml(self, padre):
+        nodo = ET.SubElement(padre, 'categoria', id=str(self.id))
+        _agregar_texto(nodo, 'nombre', self.nombre)
+        _agregar_texto(nodo, 'descripcion', self.descripcion)
+        _agregar_texto(nodo, 'cargaTrabajo', self.carga_trabajo)
+        lista = ET.SubElement(nodo, 'listaConfiguraciones')
+        for conf in self.configuraciones:
+            conf.a_xml(lista)
+        return nodo
+
+    def a_dict(self, excluir=frozenset()):
+        datos = _dict_campos([('id', self.id), ('nombre', self.nombre), ('descripcion', self.descripcion),
+                              ('cargaTrabajo', self.carga_trabajo)], excluir)
+        if 'listaConfiguraciones' not in excluir:
+            datos['listaConfiguraciones'] = {"configuracion": [c.a_dict(excluir) for c in self.configuraciones]}
+        return datos
+
+    def actualizar_desde(self, otro):
+        """
+        Copia los datos propios que trae `otro`; las configuraciones se
+        fusionan aparte.
+        """
+        _copiar_presentes(self, otro, ('nombre', 'descripcion', 'carga_trabajo'))
+
+
+def _horas(tiempo):
+    try:
+        return float(tiempo)
+    except (TypeError, ValueError):
+        return None
+
+
+class Consumo:
+    """
+    Consumo registrado por una instancia. `tiempo` y `fecha_hora` quedan
+    tal como llegaron (así se vuelven a escribir); `horas`, `ordinal` (día)
+    y `minutos` (hora del día) se interpretan una sola vez al crearlo y son
+    lo que usan la facturación y los índices. Son None si el tiempo no es
+    numérico o no hay una fecha válida.
+    """
+
+    __slots__ = ('tiempo', 'fecha_hora', 'horas', 'ordinal', 'minutos')
+
+    def __init__(self, tiempo, fecha_hora):
+        self.tiempo = tiempo
+        self.fecha_hora = fecha_hora
+        self.horas = _horas(tiempo)
+        self.ordinal, self.minutos = normalizar_fecha(fecha_hora)
+
+    @classmethod
+    def desde_valores(cls, tiempo, fecha_hora, horas, ordinal, minutos):
+        """Consumo con los valores ya interpretados (los de la instantánea), sin volver a hacerlo."""
+        consumo = cls.__new__(cls)
+        consumo.tiempo = tiempo
+        consumo.fecha_hora = fecha_hora
+        consumo.horas = horas
+        consumo.ordinal = ordinal
+        consumo.minutos = minutos
+        return consumo
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        return cls(_texto(nodo, 'tiempo'), _texto(nodo, 'fechaHora'))
+
+    def a_xml(self, padre):
+        nodo = ET.SubElement(padre, 'consumoRegistrado')
+        _agregar_texto(nodo, 'tiempo', self.tiempo)
+        _agregar_texto(nodo, 'fechaHora', self.fecha_hora)
+        return nodo
+
+    def a_dict(self, excluir=frozenset()):
+        return _dict_campos([('tiempo', self.tiempo), ('fechaHora', self.fecha_hora)], excluir)
+
+
+class Instancia:
+    """Instancia de un cliente, asociada a una configuración."""
+
+    __slots__ = ('id', 'id_configuracion', 'nombre', 'fecha_inicio', 'estado', 'fecha_final',
+                 '_consumos', '_cargar_consumos', '_cantidad_consumos', 'cliente')
+
+    def __init__(self, id, id_configuracion=None, nombre=None, fecha_inicio=None, estado=None,
+                 fecha_final=None, consumos=None):
+        self.id = id
+        self.id_configuracion = id_configuracion
+        self.nombre = nombre
+        self.fecha_inicio = fecha_inicio
+        self.estado = estado
+        self.fecha_final = fecha_final
+        self._consumos = consumos if consumos is not None else []
+        self._cargar_consumos = None
+        self._cantidad_consumos = 0
+        self.cliente = None
+
+    @property
+    def consumos(self):
+        if self._cargar_consumos is not None:
+            with _bloqueo_consumos:
+                if self._cargar_consumos is not None:
+                    self._consumos = self._cargar_consumos()
+                    self._cargar_consumos = None
+        return self._consumos
+
+    def diferir_consumos(self, cargar, cantidad):
+        """
+        Los consumos se construyen con `cargar()` recién al usarse por
+        primera vez. `cargar.columnas()` debe entregar sus (horas,
+        ordinales) sin construirlos; ver `consumos_diferidos`.
+        """
+        self._cargar_consumos = cargar
+        self._cantidad_consumos = cantidad
+
+    def consumos_diferidos(self):
+        """El `cargar` de diferir_consumos si los consumos todavía no se construyeron, o None."""
+        return self._cargar_consumos
+
+    def cantidad_consumos(self):
+        """Cuántos consumos tiene, sin construirlos si todavía están diferidos."""
+        if self._cargar_consumos is not None:
+            return self._cantidad_consumos
+        return len(self._consumos)
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        consumos = [Consumo.desde_xml(c) for c in nodo.findall('listaConsumos/consumoRegistrado')]
+        return cls(nodo.get('id'), id_configuracion=_texto(nodo, 'idConfiguracion'),
+                   nombre=_texto(nodo, 'nombre'), fecha_inicio=_texto(nodo, 'fechaInicio'),
+                   estado=_texto(nodo, 'estado'), fecha_final=_texto(nodo, 'fechaFinal'),
+                   consumos=consumos)
+
+    def a_xml(self, padre, limite_consumos=None):
+        nodo = ET.SubElement(padre, 'instancia', id=str(self.id))
+        _agregar_texto(nodo, 'idConfiguracion', self.id_configuracion)
+        _agregar_texto(nodo, 'nombre', self.nombre)
+        _agregar_texto(nodo, 'fechaInicio', self.fecha_inicio)
+        _agregar_texto(nodo, 'estado', self.estado)
+        _agregar_texto(nodo, 'fechaFinal', self.fecha_final)
+        consumos = self.consumos if limite_consumos is None else self.consumos[:limite_consumos]
+        if consumos:
+            lista = ET.SubElement(nodo, 'listaConsumos')
+            for consumo in consumos:
+                consumo.a_xml(lista)
+        return nodo
+
+    def a_dict(self, excluir=frozenset(), limite_consumos=None):
+        datos = _dict_campos([('id', self.id), ('idConfiguracion', self.id_configuracion), ('nombre', self.nombre),
+                              ('fechaInicio', self.fecha_inicio), ('estado', self.estado),
+                              ('fechaFinal', self.fecha_final)], excluir)
+        if 'listaConsumos' not in excluir:
+            consumos = self.consumos if limite_consumos is None else self.consumos[:limite_consumos]
+            datos['listaConsumos'] = {"consumoRegistrado": [c.a_dict(excluir) for c in consumos]}
+        return datos
+
+    def actualizar_desde(self, otro):
+        """Copia los datos que trae `otro` conservando los consumos registrados."""
+        _copiar_presentes(self, otro, ('id_configuracion', 'nombre', 'fecha_inicio', 'estado', 'fecha_final'))
+
+
+class Cliente:
+    """Cliente identificado por su NIT, con sus instancias."""
+
+    __slots__ = ('nit', 'nombre', 'usuario', 'clave', 'direccion', 'correo_electronico', 'instancias')
+
+    def __init__(self, nit, nombre=None, usuario=None, clave=None, direccion=None,
+                 correo_electronico=None, instancias=None):
+        self.nit = nit
+        self.nombre = nombre
+        self.usuario = usuario
+        self.clave = clave
+        self.direccion = direccion
+        self.correo_electronico = correo_electronico
+        self.instancias = []
+        for instancia in instancias or []:
+            self.agregar_instancia(instancia)
+
+    def agregar_instancia(self, instancia):
+        instancia.cliente = self
+        self.instancias.append(instancia)
+
+    @classmethod
+    def desde_xml(cls, nodo):
+        instancias = [Instancia.desde_xml(i) for i in nodo.findall('listaInstancias/instancia')]
+        return cls(nodo.get('nit'), nombre=_texto(nodo, 'nombre'), usuario=_texto(nodo, 'usuario'),
+                   clave=_texto(nodo, 'clave'), direccion=_texto(nodo, 'direccion'),
+                   correo_electronico=_texto(nodo, 'correoElectronico'), instancias=instancias)
+
+    def a_xml(self, padre, limites_consumo=None):
+        """`limites_consumo` (instancia -> n) acota los consumos que se escriben."""
+        nodo = ET.SubElement(padre, 'cliente', nit=str(self.nit))
+        _agregar_texto(nodo, 'nombre', self.nombre)
+        _agregar_texto(nodo, 'usuario', self.usuario)
+        _agregar_texto(nodo, 'clave', self.clave)
+        _agregar_texto(nodo, 'direccion', self.direccion)
+        _agregar_texto(nodo, 'correoElectronico', self.correo_electronico)
+        lista = ET.SubElement(nodo, 'listaInstancias')
+        for instancia in self.instancias:
+            limite = limites_consumo.get(instancia, 0) if limites_consumo is not None else None
+            instancia.a_xml(lista, limite)
+        return nodo
+
+    def a_dict(self, excluir=frozenset(), instancias=None, limites_consumo=None):
+        """
+        `instancias` permite entregar solo algunas (por ejemplo, filtradas por
+        estado); `limites_consumo` acota los consumos igual que en a_xml.
+        """
+        datos = _dict_campos([('nit', self.nit), ('nombre', self.nombre), ('usuario', self.usuario),
+                              ('clave', self.clave), ('direccion', self.direccion),
+                              ('correoElectronico', self.correo_electronico)], excluir)
+        if 'listaInstancias' not in excluir:
+            instancias = self.instancias if instancias is None else instancias
+            datos['listaInstancias'] = {"instancia": [
+                i.a_dict(excluir, limites_consumo.get(i, 0) if limites_consumo is not None else None)
+                for i in instancias]}
+        return datos
+
+    def actualizar_desde(self, otro):
+        """Copia los datos propios que trae `otro`; las instancias se fusionan aparte."""
+        _copiar_presentes(self, otro, ('nombre', 'usuario', 'clave', 'direccion', 'correo_electronico'))
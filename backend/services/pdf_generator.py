@@ -2,37 +2,76 @@ from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
-import os
-from .xml_manager import generar_facturacion_detallada
+import io
+import tempfile
+import time
+import zipfile
+from .xml_manager import generar_resumen_ventas, resumen_ventas_versionado, detalles_factura_cliente
+from .almacen import obtener_almacen
+from .cache_pdf import CachePDF, obtener_cache_pdf
+from .corridas import obtener_corridas, FacturaNoEncontrada
 
-def generar_analisis_ventas_pdf(fecha_inicio_str, fecha_fin_str):
+# Cada reporte se arma en dos pasos: preparar_* reúne los datos (necesita el
+# almacén) y renderizar_* solo dibuja el PDF a partir de datos simples, por
+# lo que puede ejecutarse en otro proceso (ver trabajos.py). Los PDFs
+# terminados se guardan en la caché de cache_pdf.py. Las respuestas
+# directas se dibujan en memoria y solo pasan a disco si superan
+# UMBRAL_PDF_EN_MEMORIA.
+
+# Hoja de estilos y estilo de tabla de factura compartidos: se crean una vez
+# por proceso y se reutilizan en cada PDF, en lugar de rearmarlos por factura.
+_ESTILOS = getSampleStyleSheet()
+_ESTILO_TABLA_FACTURA = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), colors.grey),
+    ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
+    ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTNAME', (-1,-1), (-1,-1), 'Helvetica-Bold'), # Bold para el total
+    ('GRID', (0,0), (-1,-2), 1, colors.black),
+    ('GRID', (-2,-1), (-1,-1), 1, colors.black),
+])
+FACTURAS_POR_GRUPO = 25   # facturas que dibuja cada tarea del lote
+UMBRAL_PDF_EN_MEMORIA = 16 * 1024 * 1024   # bytes antes de pasar el buffer a disco
+
+def crear_buffer_pdf():
+    """Buffer binario en memoria que pasa a un temporal anónimo al crecer."""
+    return tempfile.SpooledTemporaryFile(max_size=UMBRAL_PDF_EN_MEMORIA)
+
+def _renderizar_en_buffer(renderizar, datos):
+    buffer = crear_buffer_pdf()
+    renderizar(buffer, datos)
+    buffer.seek(0)
+    return buffer
+
+def preparar_analisis_ventas(fecha_inicio_str, fecha_fin_str, resumen=None):
     """
-    Genera un reporte en PDF del análisis de ventas por recurso y categoría.
+    Reúne los ingresos por recurso y por categoría, ordenados de mayor a menor.
+    `resumen` es el de generar_resumen_ventas, si ya se tiene.
     """
-    resultados = generar_facturacion_detallada(fecha_inicio_str, fecha_fin_str)
-    
-    # ... (la lógica de agregación de datos se queda igual) ...
-    ingresos_por_recurso = {}
-    ingresos_por_categoria = {}
-    for detalle in resultados['detalles_consumo']:
-        recurso_nombre = detalle['recurso_nombre']
-        costo = detalle['costo_total_consumo']
-        if recurso_nombre not in ingresos_por_recurso: ingresos_por_recurso[recurso_nombre] = 0
-        ingresos_por_recurso[recurso_nombre] += costo
-        categoria_nombre = detalle['categoria_nombre']
-        if categoria_nombre not in ingresos_por_categoria: ingresos_por_categoria[categoria_nombre] = 0
-        ingresos_por_categoria[categoria_nombre] += costo
+    if resumen is None:
+        resumen = generar_resumen_ventas(fecha_inicio_str, fecha_fin_str)
+    ingresos_por_recurso = resumen['por_recurso']
+    ingresos_por_categoria = resumen['por_categoria']
     recursos_ordenados = sorted(ingresos_por_recurso.items(), key=lambda item: item[1], reverse=True)
     categorias_ordenadas = sorted(ingresos_por_categoria.items(), key=lambda item: item[1], reverse=True)
-    
-    # --- Creación del Documento PDF ---
-    pdf_path = os.path.join(os.path.dirname(__file__), '..', 'reporte_ventas.pdf')
+    return {
+        "fecha_inicio": fecha_inicio_str,
+        "fecha_fin": fecha_fin_str,
+        "recursos_ordenados": recursos_ordenados,
+        "categorias_ordenadas": categorias_ordenadas,
+    }
+
+def renderizar_analisis_ventas(pdf_path, datos):
+    """
+    Dibuja el PDF del análisis de ventas con los datos de preparar_analisis_ventas.
+    `pdf_path` puede ser una ruta o un archivo binario abierto.
+    """
     doc = SimpleDocTemplate(pdf_path, pagesize=letter)
     styles = getSampleStyleSheet()
     story = []
 
     story.append(Paragraph("Análisis de Ventas", styles['h1']))
-    story.append(Paragraph(f"Período del {fecha_inicio_str} al {fecha_fin_str}", styles['h2']))
+    story.append(Paragraph(f"Período del {datos['fecha_inicio']} al {datos['fecha_fin']}", styles['h2']))
     story.append(Spacer(1, 24))
 
     # --- CORRECCIÓN CLAVE: Definimos el estilo de la tabla UNA SOLA VEZ ---
@@ -49,9 +88,9 @@ def generar_analisis_ventas_pdf(fecha_inicio_str, fecha_fin_str):
     # Tabla de Ingresos por Recurso
     story.append(Paragraph("Ingresos Generados por Recurso", styles['h3']))
     data_recursos = [["Recurso", "Ingreso Total"]]
-    for nombre, total in recursos_ordenados:
+    for nombre, total in datos['recursos_ordenados']:
         data_recursos.append([nombre, f"Q {total:.2f}"])
-    
+
     table_recursos = Table(data_recursos)
     table_recursos.setStyle(estilo_tabla) # <-- Aplicamos el estilo
     story.append(table_recursos)
@@ -60,7 +99,7 @@ def generar_analisis_ventas_pdf(fecha_inicio_str, fecha_fin_str):
     # Tabla de Ingresos por Categoría
     story.append(Paragraph("Ingresos Generados por Categoría", styles['h3']))
     data_categorias = [["Categoría", "Ingreso Total"]]
-    for nombre, total in categorias_ordenadas:
+    for nombre, total in datos['categorias_ordenadas']:
         data_categorias.append([nombre, f"Q {total:.2f}"])
 
     table_categorias = Table(data_categorias)
@@ -69,41 +108,79 @@ def generar_analisis_ventas_pdf(fecha_inicio_str, fecha_fin_str):
 
     doc.build(story)
     return pdf_path
-    
+
+def consultar_cache_analisis_ventas(fecha_inicio_str, fecha_fin_str):
+    """
+    Devuelve (clave, ruta, datos): si el reporte de este período ya está en
+    la caché para la versión actual de los datos, `ruta` es su PDF y
+    `datos` es None; si no, `ruta` es None y `datos` trae lo necesario para
+    dibujarlo.
+    """
+    clave = CachePDF.clave('reporteVentas', [fecha_inicio_str, fecha_fin_str], obtener_almacen().version_datos())
+    ruta = obtener_cache_pdf().obtener(clave)
+    if ruta is not None:
+        return clave, ruta, None
+    # Sin el bloqueo los datos pueden cambiar mientras se calcula: la clave usa la
+    # versión de la que salió el resumen, no la que se consultó recién
+    version_datos, resumen = resumen_ventas_versionado(fecha_inicio_str, fecha_fin_str)
+    clave = CachePDF.clave('reporteVentas', [fecha_inicio_str, fecha_fin_str], version_datos)
+    return clave, None, preparar_analisis_ventas(fecha_inicio_str, fecha_fin_str, resumen)
+
+def generar_analisis_ventas_pdf(fecha_inicio_str, fecha_fin_str):
+    """
+    Genera un reporte en PDF del análisis de ventas por recurso y categoría.
+    Devuelve (archivo, clave): `archivo` es el PDF abierto para leer, desde
+    la caché o recién dibujado en memoria. En el segundo caso `clave` no es
+    None y el llamador puede guardarlo con CachePDF.guardar_archivo una vez
+    enviado; así la escritura a disco no retrasa la respuesta.
+    """
+    clave, ruta, datos = consultar_cache_analisis_ventas(fecha_inicio_str, fecha_fin_str)
+    if ruta is not None:
+        return open(ruta, 'rb'), None
+    return _renderizar_en_buffer(renderizar_analisis_ventas, datos), clave
+
 # Al final de pdf_generator.py
 
-def generar_detalle_factura_pdf(datos_factura):
+def preparar_detalle_factura(datos_factura):
     """
-    Genera un PDF con el desglose detallado de una factura específica.
+    Agrupa los consumos de una factura por instancia.
     """
     # --- Extraer datos ---
     factura_info = datos_factura['factura_info']
     detalles_consumo = datos_factura['detalles_consumo']
-    
+
     # --- Agrupar consumos por instancia ---
     costos_por_instancia = {}
     for detalle in detalles_consumo:
         instancia_id = detalle['instancia_id']
         instancia_nombre = detalle['instancia_nombre']
-        
+
         if instancia_id not in costos_por_instancia:
             costos_por_instancia[instancia_id] = {
                 'nombre': instancia_nombre,
                 'recursos': [],
                 'total_instancia': 0
             }
-        
+
         costo_consumo = detalle['costo_total_consumo']
         costos_por_instancia[instancia_id]['recursos'].append({
             'nombre': detalle['recurso_nombre'],
             'costo': costo_consumo
         })
         costos_por_instancia[instancia_id]['total_instancia'] += costo_consumo
+    return {"factura_info": factura_info, "costos_por_instancia": costos_por_instancia}
+
+def renderizar_detalle_factura(pdf_path, datos):
+    """
+    Dibuja el PDF de una factura con los datos de preparar_detalle_factura.
+    `pdf_path` puede ser una ruta o un archivo binario abierto.
+    """
+    factura_info = datos['factura_info']
+    costos_por_instancia = datos['costos_por_instancia']
 
     # --- Creación del Documento PDF ---
-    pdf_path = os.path.join(os.path.dirname(__file__), '..', f"factura_{factura_info['numero_factura']}.pdf")
     doc = SimpleDocTemplate(pdf_path, pagesize=letter)
-    styles = getSampleStyleSheet()
+    styles = _ESTILOS
     story = []
 
     # Cabecera
@@ -116,29 +193,116 @@ def generar_detalle_factura_pdf(datos_factura):
     # Detalle por instancia
     for instancia_id, data in costos_por_instancia.items():
         story.append(Paragraph(f"Detalle para Instancia: {data['nombre']} (ID: {instancia_id})", styles['h3']))
-        
+
         tabla_data = [['Recurso Consumido', 'Aporte al Costo']]
         for recurso in data['recursos']:
             tabla_data.append([recurso['nombre'], f"Q {recurso['costo']:.2f}"])
-        
+
         tabla_data.append(['', '']) # Espacio
         tabla_data.append(['Subtotal Instancia', f"Q {data['total_instancia']:.2f}"])
 
         table = Table(tabla_data, colWidths=[300, 100])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTNAME', (-1,-1), (-1,-1), 'Helvetica-Bold'), # Bold para el total
-            ('GRID', (0,0), (-1,-2), 1, colors.black),
-            ('GRID', (-2,-1), (-1,-1), 1, colors.black),
-        ]))
+        table.setStyle(_ESTILO_TABLA_FACTURA)
         story.append(table)
         story.append(Spacer(1, 12))
 
     # Total Final
     story.append(Paragraph(f"MONTO TOTAL A PAGAR: Q {factura_info['monto_a_pagar']:.2f}", styles['h2']))
-    
+
     doc.build(story)
-    return pdf_path
\ No newline at end of file
+    return pdf_path
+
+def consultar_cache_detalle_factura(datos_factura):
+    """
+    Igual que consultar_cache_analisis_ventas. La factura depende solo de
+    los datos recibidos, así que la clave es el contenido mismo. En lugar
+    de los datos se puede enviar {id_corrida, numero_factura} de una corrida
+    guardada, o `factura_info` con el rango facturado (fecha_inicio,
+    fecha_fin) y los detalles se toman de la facturación. Lanza
+    FacturaNoEncontrada si la corrida o la factura no existen.
+    """
+    if 'id_corrida' in datos_factura:
+        datos_factura = obtener_corridas().factura(datos_factura['id_corrida'], datos_factura.get('numero_factura'))
+        if datos_factura is None:
+            raise FacturaNoEncontrada("No existe esa factura en la corrida indicada.")
+    elif 'detalles_consumo' not in datos_factura:
+        factura_info = datos_factura['factura_info']
+        datos_factura = {
+            "factura_info": factura_info,
+            "detalles_consumo": detalles_factura_cliente(
+                datos_factura['fecha_inicio'], datos_factura['fecha_fin'], factura_info['nit_cliente']),
+        }
+    clave = CachePDF.clave('detalleFactura', datos_factura)
+    ruta = obtener_cache_pdf().obtener(clave)
+    if ruta is not None:
+        return clave, ruta, None
+    return clave, None, preparar_detalle_factura(datos_factura)
+
+def generar_detalle_factura_pdf(datos_factura):
+    """
+    Genera un PDF con el desglose detallado de una factura específica.
+    Devuelve (archivo, clave) igual que generar_analisis_ventas_pdf.
+    """
+    clave, ruta, datos = consultar_cache_detalle_factura(datos_factura)
+    if ruta is not None:
+        return open(ruta, 'rb'), None
+    return _renderizar_en_buffer(renderizar_detalle_factura, datos), clave
+
+def nombre_pdf_factura(datos_factura):
+    """Nombre de descarga del PDF de una factura pedida por datos o por corrida."""
+    if 'id_corrida' in datos_factura:
+        return f"factura_{datos_factura.get('numero_factura')}.pdf"
+    return f"factura_{datos_factura['factura_info']['numero_factura']}.pdf"
+
+# --- Lote de facturas de una corrida de facturación ---
+
+def preparar_lote_facturas(datos_facturacion):
+    """
+    Recibe el resultado de generarFactura ({facturas, detalles_consumo}) y
+    devuelve los datos de preparar_detalle_factura para cada factura. Los
+    detalles se reparten por NIT en una sola pasada.
+    """
+    detalles_por_nit = {}
+    for detalle in datos_facturacion['detalles_consumo']:
+        detalles_por_nit.setdefault(detalle['nit_cliente'], []).append(detalle)
+    return [
+        preparar_detalle_factura({
+            "factura_info": factura,
+            "detalles_consumo": detalles_por_nit.get(factura['nit_cliente'], []),
+        })
+        for factura in datos_facturacion['facturas']
+    ]
+
+def renderizar_grupo_facturas(grupo):
+    """
+    Dibuja en memoria un grupo de facturas preparadas y devuelve una lista
+    de (nombre_archivo, bytes del PDF). Se ejecuta en un proceso trabajador.
+    """
+    resultado = []
+    for datos in grupo:
+        buffer = io.BytesIO()
+        renderizar_detalle_factura(buffer, datos)
+        resultado.append((f"factura_{datos['factura_info']['numero_factura']}.pdf", buffer.getvalue()))
+    return resultado
+
+def generar_lote_facturas_zip(datos_facturacion, destino, cola):
+    """
+    Dibuja todas las facturas de una corrida en paralelo con el pool de
+    `cola` y las escribe en un ZIP en `destino` (ruta o archivo binario,
+    por ejemplo el de crear_buffer_pdf).
+    Devuelve {"facturas", "segundos", "facturas_por_segundo"}.
+    """
+    inicio = time.perf_counter()
+    preparadas = preparar_lote_facturas(datos_facturacion)
+    grupos = [preparadas[i:i + FACTURAS_POR_GRUPO] for i in range(0, len(preparadas), FACTURAS_POR_GRUPO)]
+    with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as archivo_zip:
+        # Los PDFs ya vienen comprimidos; se agregan a medida que termina cada grupo
+        for pdfs in cola.ejecutar_en_paralelo(renderizar_grupo_facturas, grupos):
+            for nombre, contenido in pdfs:
+                archivo_zip.writestr(nombre, contenido, compress_type=zipfile.ZIP_STORED)
+    segundos = time.perf_counter() - inicio
+    return {
+        "facturas": len(preparadas),
+        "segundos": round(segundos, 3),
+        "facturas_por_segundo": round(len(preparadas) / segundos, 2) if segundos > 0 else 0.0,
+    }
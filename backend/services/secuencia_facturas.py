@@ -0,0 +1,59 @@
+# --- backend/services/secuencia_facturas.py ---
+#
+# Secuencia durable de números de factura. Cada corrida reserva de una vez
+# el bloque de números que necesita: una sola reserva atómica (bloqueo
+# entre hilos y entre procesos) por corrida, no por factura. El siguiente
+# número libre queda en disco, así los números nunca se repiten aunque se
+# reinicie el servidor o facturen varias corridas a la vez.
+
+import os
+import threading
+import time
+
+from .bloqueo_archivo import bloqueo_exclusivo
+
+RUTA_SECUENCIA = os.path.join(os.path.dirname(__file__), '..', 'secuencia_facturas')
+
+
+class SecuenciaFacturas:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._bloqueo = threading.Lock()
+
+    def _leer(self):
+        try:
+            with open(self.ruta, encoding='utf-8') as archivo:
+                return int(archivo.read().strip())
+        except FileNotFoundError:
+            # Los números anteriores salían de la hora actual; se sigue desde ahí
+            return int(time.time())
+
+    def _escribir(self, siguiente):
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            archivo.write(str(siguiente))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, self.ruta)
+
+    def reservar(self, cantidad):
+        """Reserva `cantidad` números consecutivos y devuelve el primero."""
+        if cantidad < 0:
+            raise ValueError("La cantidad a reservar no puede ser negativa.")
+        with self._bloqueo, bloqueo_exclusivo(self.ruta + '.lock'):
+            primero = self._leer()
+            if cantidad:
+                self._escribir(primero + cantidad)
+            return primero
+
+
+_secuencia = None
+_bloqueo_secuencia = threading.Lock()
+
+
+def obtener_secuencia():
+    global _secuencia
+    with _bloqueo_secuencia:
+        if _secuencia is None:
+            _secuencia = SecuenciaFacturas(RUTA_SECUENCIA)
+        return _secuencia
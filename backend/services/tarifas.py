@@ -0,0 +1,43 @@
+# --- backend/services/tarifas.py ---
+#
+# Tabla de tarifas por configuración: la cantidad y el valorXhora de cada
+# recurso, ya convertidos a número. Se arma una sola vez y el almacén la
+# invalida cuando cambian precios. El costo de un consumo se sigue
+# calculando como tiempo * cantidad * valorXhora, en ese orden, para que
+# los montos salgan idénticos (hasta el último decimal) a la facturación
+# original.
+
+
+class TarifaConfiguracion:
+    """Precios de una configuración, por recurso."""
+
+    def __init__(self, id_configuracion, categoria_nombre):
+        self.id_configuracion = id_configuracion
+        self.categoria_nombre = categoria_nombre
+        # Costo por hora de la configuración completa; solo para totales
+        # aproximados (resumen de uso), no para facturar
+        self.total_hora = 0.0
+        self.desglose = []  # lista de (Recurso, cantidad, valor por hora)
+
+    def agregar(self, recurso, cantidad):
+        cantidad = int(cantidad)
+        valor_hora = float(recurso.valor_x_hora)
+        self.desglose.append((recurso, cantidad, valor_hora))
+        self.total_hora += cantidad * valor_hora
+
+
+def construir_tabla_tarifas(recursos, configuraciones):
+    """
+    Devuelve {id_configuracion: TarifaConfiguracion}. Los recursos de una
+    configuración que no existen en la lista de recursos se ignoran.
+    """
+    tabla = {}
+    for id_conf, configuracion in configuraciones.items():
+        categoria_nombre = configuracion.categoria.nombre if configuracion.categoria else "N/A"
+        tarifa = TarifaConfiguracion(id_conf, categoria_nombre)
+        for id_recurso, cantidad in configuracion.recursos:
+            recurso = recursos.get(id_recurso)
+            if recurso is not None:
+                tarifa.agregar(recurso, cantidad)
+        tabla[id_conf] = tarifa
+    return tabla
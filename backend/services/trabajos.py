@@ -0,0 +1,199 @@
+# --- backend/services/trabajos.py ---
+#
+# Cola de trabajos en segundo plano para generar PDFs. Los datos se
+# preparan en el proceso de Flask (leen el almacén en memoria) y el dibujo
+# con ReportLab se envía a un pool de procesos, así un reporte grande no
+# bloquea al servidor y se aprovechan todos los núcleos. Cada trabajo se
+# identifica con un id único y su PDF queda en DIR_TRABAJOS.
+#
+# El estado de cada trabajo se guarda en disco, igual que las corridas, así
+# cualquier worker del servidor responde por él aunque lo haya encolado
+# otro:
+#
+#   trabajos/<id>.json   tipo, estado, ruta del PDF, nombre del archivo y error
+#   trabajos/<id>.pdf    el PDF, si no quedó en la caché
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+DIR_TRABAJOS = os.path.join(os.path.dirname(__file__), '..', 'trabajos')
+TIEMPO_VIDA_TRABAJO = 60 * 60   # segundos que se conserva un trabajo desde su último cambio
+
+_PATRON_ID = re.compile(r'[0-9a-f]{32}')
+
+PENDIENTE = 'pendiente'
+TERMINADO = 'terminado'
+ERROR = 'error'
+
+
+class ColaTrabajos:
+    def __init__(self, directorio, trabajadores=None):
+        self.directorio = directorio
+        self.trabajadores = trabajadores
+        self._pool = None
+
+    def _obtener_pool(self):
+        if self._pool is None:
+            # 'spawn' evita copiar con fork un proceso que ya tiene hilos
+            self._pool = ProcessPoolExecutor(max_workers=self.trabajadores,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def enviar(self, tipo, funcion, datos, nombre_archivo, ruta=None, al_terminar=None):
+        """
+        Encola `funcion(ruta_pdf, datos)` y devuelve el id del trabajo.
+        `funcion` debe ser importable desde el proceso trabajador. Si se da
+        `ruta`, el PDF se escribe ahí en lugar de DIR_TRABAJOS y
+        `al_terminar(ruta)` lo recibe ya escrito y devuelve la ruta desde
+        donde se descargará; ese archivo no le pertenece a la cola.
+        """
+        self._purgar_vencidos()
+        os.makedirs(self.directorio, exist_ok=True)
+        id_trabajo = uuid.uuid4().hex
+        propio = ruta is None
+        if propio:
+            ruta = self._ruta_trabajo(id_trabajo, 'pdf')
+        self._registrar(id_trabajo, tipo, PENDIENTE, ruta, nombre_archivo, propio)
+        try:
+            futuro = self._obtener_pool().submit(funcion, ruta, datos)
+        except BrokenProcessPool:
+            # Si un trabajador murió, el pool queda inservible; se crea uno nuevo
+            self._pool = None
+            futuro = self._obtener_pool().submit(funcion, ruta, datos)
+        futuro.add_done_callback(lambda f: self._al_terminar(id_trabajo, f, al_terminar))
+        return id_trabajo
+
+    def registrar_terminado(self, tipo, ruta, nombre_archivo):
+        """Registra como terminado un PDF que ya existe (por ejemplo, en la caché)."""
+        self._purgar_vencidos()
+        id_trabajo = uuid.uuid4().hex
+        self._registrar(id_trabajo, tipo, TERMINADO, ruta, nombre_archivo, propio=False)
+        return id_trabajo
+
+    def _ruta_trabajo(self, id_trabajo, extension):
+        return os.path.join(self.directorio, f"{id_trabajo}.{extension}")
+
+    def _registrar(self, id_trabajo, tipo, estado, ruta, nombre_archivo, propio):
+        ahora = time.time()
+        self._escribir({
+            "id_trabajo": id_trabajo, "tipo": tipo, "estado": estado,
+            "ruta": ruta, "nombre_archivo": nombre_archivo, "error": None,
+            "propio": propio, "creado": ahora,
+            "terminado": ahora if estado == TERMINADO else None,
+        })
+
+    def _escribir(self, trabajo):
+        """Guarda el estado del trabajo; se escribe aparte y se renombra, nadie lo lee a medias."""
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self._ruta_trabajo(trabajo["id_trabajo"], 'json')
+        temporal = f"{ruta}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(trabajo, archivo, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    def _leer(self, id_trabajo):
+        """El estado guardado del trabajo, o None si no existe (o ya fue purgado)."""
+        if not _PATRON_ID.fullmatch(id_trabajo or ''):
+            return None
+        try:
+            with open(self._ruta_trabajo(id_trabajo, 'json'), encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def ejecutar_en_paralelo(self, funcion, argumentos):
+        """
+        Aplica `funcion` a cada elemento de `argumentos` en el pool y entrega
+        los resultados en el mismo orden, a medida que van terminando.
+        """
+        try:
+            return self._obtener_pool().map(funcion, argumentos)
+        except BrokenProcessPool:
+            self._pool = None
+            return self._obtener_pool().map(funcion, argumentos)
+
+    def _al_terminar(self, id_trabajo, futuro, al_terminar):
+        error = futuro.exception()
+        trabajo = self._leer(id_trabajo)
+        if trabajo is None:
+            # Se purgó mientras corría; si el PDF era de la cola, ya nadie lo va a pedir
+            _borrar(self._ruta_trabajo(id_trabajo, 'pdf'))
+            return
+        ruta_escrita = trabajo["ruta"]
+        if error is None and al_terminar is not None:
+            try:
+                trabajo["ruta"] = al_terminar(ruta_escrita)
+            except Exception as e:
+                error = e
+        if error is not None and (al_terminar is not None or trabajo["propio"]):
+            # El PDF pudo quedar escrito a medias; no se deja para que nadie lo descargue
+            _borrar(ruta_escrita)
+        trabajo["estado"] = ERROR if error else TERMINADO
+        trabajo["error"] = str(error) if error else None
+        trabajo["terminado"] = time.time()
+        self._escribir(trabajo)
+
+    def estado(self, id_trabajo):
+        """Copia pública del estado del trabajo, o None si no existe."""
+        trabajo = self._leer(id_trabajo)
+        if trabajo is None:
+            return None
+        return {k: trabajo[k] for k in ("id_trabajo", "tipo", "estado", "nombre_archivo", "error")}
+
+    def resultado(self, id_trabajo):
+        """(ruta, nombre_archivo) si el trabajo terminó bien; None en otro caso."""
+        trabajo = self._leer(id_trabajo)
+        if trabajo is None or trabajo["estado"] != TERMINADO:
+            return None
+        return trabajo["ruta"], trabajo["nombre_archivo"]
+
+    def _purgar_vencidos(self):
+        """
+        Borra los trabajos sin cambios hace más de TIEMPO_VIDA_TRABAJO, de
+        cualquier worker; un pendiente tan antiguo es de un worker que murió.
+        """
+        if not os.path.isdir(self.directorio):
+            return
+        limite = time.time() - TIEMPO_VIDA_TRABAJO
+        for nombre in os.listdir(self.directorio):
+            id_trabajo, extension = os.path.splitext(nombre)
+            if extension != '.json' or not _PATRON_ID.fullmatch(id_trabajo):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) >= limite:
+                    continue
+                # Los PDFs propios de la cola llevan el id del trabajo; los de la caché no se tocan
+                for vencido in (self._ruta_trabajo(id_trabajo, 'pdf'), ruta):
+                    if os.path.exists(vencido):
+                        os.remove(vencido)
+            except OSError:
+                # Otro worker lo purgó a la vez
+                continue
+
+
+def _borrar(ruta):
+    """Borra `ruta` si existe; otro worker pudo borrarlo antes."""
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+_cola = None
+_bloqueo_cola = threading.Lock()
+
+
+def obtener_cola():
+    global _cola
+    with _bloqueo_cola:
+        if _cola is None:
+            _cola = ColaTrabajos(DIR_TRABAJOS)
+        return _cola
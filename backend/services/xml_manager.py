@@ -1,182 +1,512 @@
 import xml.etree.ElementTree as ET
-import os
-import re
+import base64
+import io
 from datetime import datetime
 
-DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'data.xml')
-
-# --- (Las funciones de inicializar, guardar config y procesar consumos se quedan igual) ---
-def inicializar_xml_si_no_existe():
-    if not os.path.exists(DB_FILE):
-        root = ET.Element('archivoConfiguraciones')
-        ET.SubElement(root, 'listaRecursos')
-        ET.SubElement(root, 'listaCategorias')
-        ET.SubElement(root, 'listaClientes')
-        tree = ET.ElementTree(root)
-        tree.write(DB_FILE, encoding='utf-8', xml_declaration=True)
-
-def procesar_y_guardar_config_xml(xml_string):
-    root = ET.fromstring(xml_string)
-    tree = ET.ElementTree(root)
-    tree.write(DB_FILE, encoding='utf-8', xml_declaration=True)
-    recursos = root.findall('.//listaRecursos/recurso')
-    categorias = root.findall('.//listaCategorias/categoria')
-    clientes = root.findall('.//listaClientes/cliente')
-    total_instancias = root.findall('.//instancia')
-    return {"recursos_cargados": len(recursos), "categorias_cargadas": len(categorias), "clientes_cargados": len(clientes), "total_instancias_registradas": len(total_instancias)}
+from .almacen import obtener_almacen
+from .modelos import Recurso, Categoria, Cliente
+from .fechas import normalizar_fecha
+from . import facturacion_columnar
+from . import facturacion_paralela
+from .memo_facturacion import ResultadoFacturacion
+from .secuencia_facturas import obtener_secuencia
 
-def procesar_consumos_xml(consumos_xml_string):
-    tree_db = ET.parse(DB_FILE)
-    root_db = tree_db.getroot()
-    root_consumos = ET.fromstring(consumos_xml_string)
-    # ... (resto de la función sin cambios)
-    consumos_procesados = 0
+TAMANO_BLOQUE_LECTURA = 64 * 1024   # bytes leídos del cuerpo de la petición por vez
+LOTE_CONSUMOS = 10000               # consumos por cada escritura a la bitácora
+
+# Todas las funciones trabajan sobre el almacén en memoria (ver almacen.py).
+# Los consumos y las cargas de configuración fusionadas solo se agregan a
+# la bitácora; los demás cambios de configuración se escriben de inmediato
+# en data.xml.
+def _elementos_en_flujo(flujo, profundidad):
+    """
+    Lee `flujo` por partes y entrega (padre, elemento) por cada elemento
+    que cierra a la `profundidad` indicada (1 = hijos directos de la raíz).
+    Después de entregarlo, el elemento se suelta del árbol para que la
+    memoria no crezca con el tamaño del archivo.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    abiertos = []
+    while True:
+        bloque = flujo.read(TAMANO_BLOQUE_LECTURA)
+        if not bloque:
+            break
+        parser.feed(bloque)
+        for evento, elemento in parser.read_events():
+            if evento == 'start':
+                abiertos.append(elemento)
+                continue
+            abiertos.pop()
+            if len(abiertos) == profundidad:
+                padre = abiertos[-1]
+                yield padre, elemento
+                padre.remove(elemento)
+    parser.close()
+
+def procesar_y_guardar_config_stream(flujo, fusionar=False):
+    """
+    Carga un archivo de configuración en una sola pasada. Cada recurso,
+    categoría y cliente se convierte a su clase apenas termina de leerse y
+    se valida contra lo leído hasta ese momento; las referencias que
+    apuntan a algo que aparece más adelante se revisan al final. Los
+    problemas de referencias se informan en `advertencias`.
+
+    Con `fusionar=True` no se reemplaza lo que ya existe: se insertan o
+    actualizan solo las entidades del archivo y se conservan los consumos.
+    """
+    recursos, categorias, clientes = {}, {}, {}
+    configuraciones = {}
+    recursos_pendientes = []       # (id_configuracion, id_recurso) aún sin resolver
+    configuraciones_pendientes = []  # (nit, id_instancia, id_configuracion) aún sin resolver
+    cargados = {'recurso': 0, 'categoria': 0, 'cliente': 0}
+    total_instancias = 0
+    for padre, elemento in _elementos_en_flujo(flujo, 2):
+        if padre.tag == 'listaRecursos' and elemento.tag == 'recurso':
+            recurso = Recurso.desde_xml(elemento)
+            recursos[recurso.id] = recurso
+            cargados['recurso'] += 1
+        elif padre.tag == 'listaCategorias' and elemento.tag == 'categoria':
+            categoria = Categoria.desde_xml(elemento)
+            categorias[categoria.id] = categoria
+            cargados['categoria'] += 1
+            for conf in categoria.configuraciones:
+                configuraciones.setdefault(conf.id, conf)
+                recursos_pendientes.extend((conf.id, id_rec) for id_rec, _ in conf.recursos if id_rec not in recursos)
+        elif padre.tag == 'listaClientes' and elemento.tag == 'cliente':
+            cliente = Cliente.desde_xml(elemento)
+            clientes[cliente.nit] = cliente
+            cargados['cliente'] += 1
+            total_instancias += len(cliente.instancias)
+            configuraciones_pendientes.extend(
+                (cliente.nit, instancia.id, instancia.id_configuracion)
+                for instancia in cliente.instancias if instancia.id_configuracion not in configuraciones)
+
+    almacen = obtener_almacen()
+    # Desde aquí ningún otro proceso escribe; lo que se valida es lo que se guarda
+    with almacen.modificacion():
+        if fusionar:
+            # Al fusionar, una referencia también puede apuntar a algo que ya estaba cargado
+            recursos_conocidos = set(recursos) | set(almacen.recursos)
+            configuraciones_conocidas = set(configuraciones) | set(almacen.configuraciones)
+        else:
+            recursos_conocidos, configuraciones_conocidas = recursos, configuraciones
+        advertencias = []
+        for id_conf, id_rec in recursos_pendientes:
+            if id_rec not in recursos_conocidos:
+                advertencias.append(f"La configuración '{id_conf}' usa el recurso '{id_rec}', que no existe.")
+        for nit, id_instancia, id_conf in configuraciones_pendientes:
+            if fusionar and id_conf is None and almacen.buscar_instancia(nit, id_instancia) is not None:
+                # Una instancia que ya existe conserva su configuración si la carga no trae otra
+                continue
+            if id_conf not in configuraciones_conocidas:
+                advertencias.append(f"La instancia '{id_instancia}' del cliente '{nit}' usa la configuración '{id_conf}', que no existe.")
+
+        resumen = {"recursos_cargados": cargados['recurso'], "categorias_cargadas": cargados['categoria'], "clientes_cargados": cargados['cliente'], "total_instancias_registradas": total_instancias, "advertencias": advertencias}
+        if fusionar:
+            # Solo se escribe lo que cambió (ver AlmacenDatos.fusionar_contenido)
+            resumen["fusion"] = almacen.fusionar_contenido(recursos.values(), categorias.values(), clientes.values())
+        else:
+            almacen.reemplazar_contenido(recursos.values(), categorias.values(), clientes.values())
+            almacen.guardar()
+    return resumen
+
+def procesar_y_guardar_config_xml(xml_string, fusionar=False):
+    return procesar_y_guardar_config_stream(io.BytesIO(xml_string.encode('utf-8')), fusionar)
+
+def _registrar_lote(almacen, lote, errores):
+    """
+    Valida un lote de consumos contra el almacén y registra los válidos.
+    Devuelve (registrados, registrados sin una fecha válida).
+    """
+    registros = []
+    sin_fecha = 0
+    # Con el bloqueo de disco y al día: ningún otro proceso cambia los clientes mientras se valida
+    with almacen.tomar_bloqueos():
+        almacen.sincronizar()
+        for nit, id_instancia, tiempo, fecha_hora in lote:
+            if almacen.buscar_instancia(nit, id_instancia) is None:
+                # Solo en el caso de error se distingue si falta el cliente o la instancia
+                if nit not in almacen.clientes:
+                    errores.append(f"Cliente con NIT '{nit}' no encontrado.")
+                else:
+                    errores.append(f"Instancia con ID '{id_instancia}' para cliente '{nit}' no encontrada.")
+                continue
+            registros.append([nit, id_instancia, tiempo, fecha_hora])
+            # Se registra igual (así se conserva en data.xml), pero no se facturará
+            if normalizar_fecha(fecha_hora)[0] is None:
+                sin_fecha += 1
+        # Solo se agrega a la bitácora; el compactador lo llevará a data.xml
+        almacen.registrar_consumos(registros)
+    return len(registros), sin_fecha
+
+def procesar_consumos_stream(flujo):
+    """
+    Procesa un listado de consumos leyéndolo por partes desde `flujo`
+    (cualquier objeto con read). Cada <consumo> se descarta apenas se
+    procesa y se registra en lotes de LOTE_CONSUMOS, así la memoria usada
+    no depende del tamaño del archivo. Si el XML está mal formado se
+    lanza el error, pero los lotes anteriores ya quedaron registrados.
+    """
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+    lote = []
     errores = []
-    for consumo_node in root_consumos.findall('consumo'):
-        nit = consumo_node.get('nitCliente')
-        id_instancia = consumo_node.get('idInstancia')
-        tiempo = consumo_node.find('tiempo').text
-        fecha_hora = consumo_node.find('fechaHora').text
-        cliente_target = root_db.find(f".//cliente[@nit='{nit}']")
-        if cliente_target is None:
-            errores.append(f"Cliente con NIT '{nit}' no encontrado.")
+    consumos_procesados = sin_fecha = 0
+    # Igual que findall('consumo'): solo cuentan los hijos directos de la raíz
+    for _, elemento in _elementos_en_flujo(flujo, 1):
+        if elemento.tag != 'consumo':
             continue
-        instancia_target = cliente_target.find(f".//instancia[@id='{id_instancia}']")
-        if instancia_target is None:
-            errores.append(f"Instancia con ID '{id_instancia}' para cliente '{nit}' no encontrada.")
-            continue
-        lista_consumos_node = instancia_target.find('listaConsumos')
-        if lista_consumos_node is None:
-            lista_consumos_node = ET.SubElement(instancia_target, 'listaConsumos')
-        nuevo_consumo = ET.SubElement(lista_consumos_node, 'consumoRegistrado')
-        ET.SubElement(nuevo_consumo, 'tiempo').text = tiempo
-        ET.SubElement(nuevo_consumo, 'fechaHora').text = fecha_hora
-        consumos_procesados += 1
-    tree_db.write(DB_FILE, encoding='utf-8', xml_declaration=True)
-    return {"consumos_procesados_exitosamente": consumos_procesados, "errores_encontrados": errores}
-
-def convertir_elemento_a_dict(elemento):
-    dict_resultado = {}
-    dict_resultado.update(elemento.attrib)
-    for hijo in elemento:
-        valor_hijo = convertir_elemento_a_dict(hijo)
-        if hijo.tag in dict_resultado:
-            if type(dict_resultado[hijo.tag]) is not list: dict_resultado[hijo.tag] = [dict_resultado[hijo.tag]]
-            dict_resultado[hijo.tag].append(valor_hijo)
-        else:
-            dict_resultado[hijo.tag] = valor_hijo
-    texto = elemento.text.strip() if elemento.text else None
-    if not dict_resultado and texto: return texto
-    if texto and 'valor' not in dict_resultado: dict_resultado['valor'] = texto
-    return dict_resultado
+        lote.append([elemento.get('nitCliente'), elemento.get('idInstancia'),
+                     elemento.find('tiempo').text, elemento.find('fechaHora').text])
+        if len(lote) >= LOTE_CONSUMOS:
+            procesados, sin_fecha_lote = _registrar_lote(almacen, lote, errores)
+            consumos_procesados += procesados
+            sin_fecha += sin_fecha_lote
+            lote = []
+    procesados, sin_fecha_lote = _registrar_lote(almacen, lote, errores)
+    consumos_procesados += procesados
+    sin_fecha += sin_fecha_lote
+    return {"consumos_procesados_exitosamente": consumos_procesados, "errores_encontrados": errores,
+            "consumos_sin_fecha_valida": sin_fecha}
+
+def procesar_consumos_xml(consumos_xml_string):
+    return procesar_consumos_stream(io.BytesIO(consumos_xml_string.encode('utf-8')))
 
 def obtener_datos_completos():
-    if not os.path.exists(DB_FILE): raise FileNotFoundError("El archivo data.xml no existe.")
-    tree = ET.parse(DB_FILE)
-    root = tree.getroot()
-    return {root.tag: convertir_elemento_a_dict(root)}
-
-def extraer_fecha(texto_fecha):
-    patron = r'(\d{2}/\d{2}/\d{4})'
-    coincidencia = re.search(patron, texto_fecha)
-    if coincidencia:
-        fecha_str = coincidencia.group(1)
-        return datetime.strptime(fecha_str, '%d/%m/%Y')
-    return None
-
-def generar_facturacion_detallada(fecha_inicio_str, fecha_fin_str):
+    """
+    Todos los datos, armados desde los objetos del almacén. Cada lista es
+    siempre una lista, aunque tenga un solo elemento o ninguno.
+    """
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+    # Con el bloqueo solo se copian las listas y cuántos consumos tiene cada instancia;
+    # los diccionarios se arman sin él
+    with almacen.bloqueo:
+        recursos = list(almacen.recursos.values())
+        categorias = list(almacen.categorias.values())
+        clientes = list(almacen.clientes.values())
+        limites_consumo = almacen.limites_consumo()
+    datos = {
+        "listaRecursos": {"recurso": [r.a_dict() for r in recursos]},
+        "listaCategorias": {"categoria": [c.a_dict() for c in categorias]},
+        "listaClientes": {"cliente": [c.a_dict(limites_consumo=limites_consumo) for c in clientes]},
+    }
+    return {"archivoConfiguraciones": datos}
+
+LIMITE_PAGINA_CLIENTES = 50
+MAXIMO_PAGINA_CLIENTES = 500
+
+def _codificar_cursor(nit):
+    return base64.urlsafe_b64encode(nit.encode('utf-8')).decode('ascii')
+
+def _decodificar_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ValueError("El cursor no es válido.")
+
+def consultar_datos_paginados(cursor=None, limite=LIMITE_PAGINA_CLIENTES, nits=None, estado=None,
+                    tipo_recurso=None, excluir=frozenset()):
+    """
+    Una página de clientes, con los recursos y categorías, armada desde los
+    objetos del almacén. Los clientes van en el mismo orden de siempre y
+    `cursor` es el valor de `siguiente_cursor` de la página anterior.
+    Filtros: `nits` (lista de NIT), `estado` de instancia (solo se muestran
+    esas instancias y los clientes que tengan alguna) y `tipo_recurso`;
+    estado y tipo no distinguen mayúsculas.
+    `excluir` omite campos en cualquier nivel, por ejemplo listaConsumos.
+    Lanza ValueError si el cursor no es válido.
+    """
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+    limite = max(1, min(limite, MAXIMO_PAGINA_CLIENTES))
+    nit_cursor = _decodificar_cursor(cursor) if cursor else None
+    # Con el bloqueo solo se eligen los objetos de la página y cuántos consumos
+    # tiene cada instancia; los diccionarios se arman sin él
+    with almacen.bloqueo:
+        recursos = [r for r in almacen.recursos.values()
+                    if tipo_recurso is None or (r.tipo or '').casefold() == tipo_recurso.casefold()]
+        categorias = list(almacen.categorias.values())
+
+        pagina = []   # (cliente, instancias a mostrar)
+        siguiente_cursor = None
+        ultimo_nit = None
+        # Con filtro por NIT se va directo a esos clientes; si no, se recorre desde el cursor
+        if nits is not None:
+            candidatos = [almacen.clientes[n] for n in dict.fromkeys(nits) if n in almacen.clientes]
+            if nit_cursor is not None:
+                posiciones = [c.nit for c in candidatos]
+                if nit_cursor not in posiciones:
+                    raise ValueError("El cursor no es válido.")
+                candidatos = candidatos[posiciones.index(nit_cursor) + 1:]
+        else:
+            if nit_cursor is not None and nit_cursor not in almacen.clientes:
+                raise ValueError("El cursor no es válido.")
+            candidatos = almacen.clientes_despues_de(nit_cursor)
+        for cliente in candidatos:
+            instancias = None
+            if estado is not None:
+                instancias = [i for i in cliente.instancias if (i.estado or '').casefold() == estado.casefold()]
+                if not instancias:
+                    continue
+            if len(pagina) == limite:
+                siguiente_cursor = _codificar_cursor(ultimo_nit)
+                break
+            pagina.append((cliente, instancias if instancias is not None else list(cliente.instancias)))
+            ultimo_nit = cliente.nit
+        limites_consumo = almacen.limites_consumo(i for _, instancias in pagina for i in instancias)
+
+    datos = {}
+    if 'listaRecursos' not in excluir:
+        datos['listaRecursos'] = {"recurso": [r.a_dict(excluir) for r in recursos]}
+    if 'listaCategorias' not in excluir:
+        datos['listaCategorias'] = {"categoria": [c.a_dict(excluir) for c in categorias]}
+    datos['listaClientes'] = {"cliente": [cliente.a_dict(excluir, instancias, limites_consumo)
+                                          for cliente, instancias in pagina]}
+    return {"archivoConfiguraciones": datos,
+            "paginacion": {"limite": limite, "siguiente_cursor": siguiente_cursor}}
+
+def _facturar_rango_python(lectura):
+    """
+    Ruta en Python puro (sin NumPy). Devuelve (montos, detalles_consumo),
+    donde `montos` es una lista de (cliente, monto) en orden de clientes.
+    """
+    montos = []
+    detalles_consumo = []
+    tarifas = lectura.tarifas
+    # Solo se recorren los consumos que caen dentro del rango pedido
+    consumos_por_instancia = lectura.consumos_por_instancia()
+    for cliente in lectura.clientes:
+        monto_total_cliente = 0.0
+        for instancia in cliente.instancias:
+            consumos = consumos_por_instancia.get(instancia)
+            if not consumos: continue
+            tarifa = tarifas.get(instancia.id_configuracion)
+            if tarifa is None: continue
+            for consumo in consumos:
+                tiempo_consumido = consumo.horas
+                if tiempo_consumido is None:
+                    raise ValueError(f"El tiempo '{consumo.tiempo}' no es numérico.")
+                for recurso_info, cantidad, valor_hora in tarifa.desglose:
+                    costo_total_consumo = tiempo_consumido * cantidad * valor_hora
+                    monto_total_cliente += costo_total_consumo
+                    detalles_consumo.append({
+                                                "nit_cliente": cliente.nit,
+                                                "instancia_id": instancia.id,
+                                                "instancia_nombre": instancia.nombre,
+                                                "recurso_id": recurso_info.id,
+                                                "recurso_nombre": recurso_info.nombre,
+                                                "categoria_nombre": tarifa.categoria_nombre,
+                                                "costo_total_consumo": costo_total_consumo
+                                            })
+        montos.append((cliente, monto_total_cliente))
+    return montos, detalles_consumo
+
+def _facturar_rango(almacen, inicio_ordinal, fin_ordinal, trabajadores=None):
+    """
+    ResultadoFacturacion del rango, tomado de la memoria del almacén si ya
+    se facturó y nada lo invalidó. El bloqueo del almacén solo se toma para
+    consultar la memoria y copiar lo necesario (ver lectura_rango); el
+    cálculo se hace sin él. Con más de un trabajador se reparte entre procesos.
+    """
+    return _facturar_rango_versionado(almacen, inicio_ordinal, fin_ordinal, trabajadores)[1]
+
+def _facturar_rango_versionado(almacen, inicio_ordinal, fin_ordinal, trabajadores=None):
+    """Igual que _facturar_rango, pero devuelve (version_datos de lo facturado, resultado)."""
+    if trabajadores is None: trabajadores = facturacion_paralela.TRABAJADORES_FACTURACION
+    columnar = trabajadores <= 1 and facturacion_columnar.NUMPY_DISPONIBLE
+    with almacen.bloqueo:
+        resultado = almacen.memo_facturacion.obtener(inicio_ordinal, fin_ordinal, almacen.version_config)
+        if resultado is not None:
+            return almacen.version_datos(), resultado
+        lectura = almacen.lectura_rango(inicio_ordinal, fin_ordinal, columnar)
+    # Las tres rutas devuelven exactamente lo mismo
+    if trabajadores > 1:
+        montos, detalles_consumo = facturacion_paralela.facturar_rango_paralelo(lectura, trabajadores)
+    elif columnar:
+        montos, detalles_consumo = facturacion_columnar.facturar_rango(
+            lectura.columnas, inicio_ordinal, fin_ordinal)
+    else:
+        montos, detalles_consumo = _facturar_rango_python(lectura)
+    resultado = ResultadoFacturacion(montos, detalles_consumo)
+    with almacen.bloqueo:
+        # Si algo cambió mientras se calculaba, el resultado vale para esta llamada pero no se recuerda
+        if almacen.version == lectura.version:
+            almacen.memo_facturacion.guardar(inicio_ordinal, fin_ordinal, lectura.version_config, resultado)
+    return lectura.version_datos, resultado
+
+def generar_facturacion_detallada(fecha_inicio_str, fecha_fin_str, trabajadores=None):
     fecha_inicio_rango = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
     fecha_fin_rango = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
-    datos = obtener_datos_completos()['archivoConfiguraciones']
-    
-    recursos_base_list = datos.get('listaRecursos', {}).get('recurso', [])
-    if not isinstance(recursos_base_list, list): recursos_base_list = [recursos_base_list]
-    recursos_base = {r['id']: r for r in recursos_base_list}
-    
-    clientes = datos.get('listaClientes', {}).get('cliente', [])
-    if not isinstance(clientes, list): clientes = [clientes]
-    
-    categorias = datos.get('listaCategorias', {}).get('categoria', [])
-    if not isinstance(categorias, list): categorias = [categorias]
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
 
     facturas_generadas = []
-    detalles_consumo = []
-    numero_factura_actual = int(datetime.now().timestamp())
 
-    for cliente in clientes:
-        monto_total_cliente = 0.0
-        instancias = cliente.get('listaInstancias', {}).get('instancia', [])
-        if not isinstance(instancias, list): instancias = [instancias]
-        for instancia in instancias:
-            consumos = instancia.get('listaConsumos', {}).get('consumoRegistrado', [])
-            if not isinstance(consumos, list): consumos = [consumos]
-            for consumo in consumos:
-                fecha_consumo = extraer_fecha(consumo['fechaHora'])
-                if fecha_consumo and fecha_inicio_rango <= fecha_consumo <= fecha_fin_rango:
-                    tiempo_consumido = float(consumo['tiempo'])
-                    id_config_instancia = instancia['idConfiguracion']
-                    
-                    config_usada = None
-                    categoria_usada_nombre = "N/A"
-                    for categoria in categorias:
-                        configuraciones = categoria.get('listaConfiguraciones', {}).get('configuracion', [])
-                        if not isinstance(configuraciones, list): configuraciones = [configuraciones]
-                        for conf in configuraciones:
-                            if conf['id'] == id_config_instancia:
-                                config_usada = conf
-                                categoria_usada_nombre = categoria['nombre']
-                                break
-                        if config_usada: break
-                    
-                    if config_usada:
-                        recursos_config = config_usada.get('recursosConfiguracion', {}).get('recurso', [])
-                        if not isinstance(recursos_config, list): recursos_config = [recursos_config]
-                        
-                        for rec_conf in recursos_config:
-                            id_rec = rec_conf['id']
-                            cantidad_rec = int(rec_conf['valor'])
-                            recurso_info = recursos_base[id_rec]
-                            valor_hora_rec = float(recurso_info['valorXhora'])
-                            costo_total_consumo = tiempo_consumido * cantidad_rec * valor_hora_rec
-                            monto_total_cliente += costo_total_consumo
-                            detalles_consumo.append({
-                                                        "nit_cliente": cliente['nit'],
-                                                        "instancia_id": instancia['id'], # <-- Añadir
-                                                        "instancia_nombre": instancia['nombre'], # <-- Añadir
-                                                        "recurso_id": id_rec,
-                                                        "recurso_nombre": recurso_info['nombre'],
-                                                        "categoria_nombre": categoria_usada_nombre,
-                                                        "costo_total_consumo": costo_total_consumo
-                                                    })  
-
-        if monto_total_cliente > 0:
-            facturas_generadas.append({"numero_factura": numero_factura_actual, "nit_cliente": cliente['nit'], "nombre_cliente": cliente['nombre'], "fecha_factura": fecha_fin_rango.strftime('%d/%m/%Y'), "monto_a_pagar": round(monto_total_cliente, 2)})
-            numero_factura_actual += 1
-    return {"facturas": facturas_generadas, "detalles_consumo": detalles_consumo}
+    resultado = _facturar_rango(almacen, fecha_inicio_rango.toordinal(), fecha_fin_rango.toordinal(),
+                                trabajadores)
+    sin_fecha = almacen.consumos_sin_fecha()
 
-def agregar_recurso(recurso_data):
+    # Los números de factura se asignan en cada llamada, aunque el cálculo venga de la memoria.
+    # Se reserva de una vez el bloque de la corrida completa.
+    a_facturar = [(cliente, monto) for cliente, monto in resultado.montos if monto > 0]
+    numero_factura_actual = obtener_secuencia().reservar(len(a_facturar))
+    for cliente, monto_total_cliente in a_facturar:
+        facturas_generadas.append({"numero_factura": numero_factura_actual, "nit_cliente": cliente.nit, "nombre_cliente": cliente.nombre, "fecha_factura": fecha_fin_rango.strftime('%d/%m/%Y'), "monto_a_pagar": round(monto_total_cliente, 2)})
+        numero_factura_actual += 1
+    # Copia de la lista: quien la recibe puede modificarla sin tocar la memoria
+    # Los consumos sin una fecha válida no entran en ningún rango; se informan para no perderlos de vista
+    return {"facturas": facturas_generadas, "detalles_consumo": list(resultado.detalles_consumo),
+            "consumos_sin_fecha_valida": sin_fecha}
+
+def detalles_factura_cliente(fecha_inicio_str, fecha_fin_str, nit_cliente=None):
+    """
+    Detalles de consumo de un cliente en el rango (de todos si `nit_cliente`
+    es None). Normalmente el rango se acaba de facturar y los detalles
+    salen de la memoria sin recalcular.
+    """
+    inicio_ordinal = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').toordinal()
+    fin_ordinal = datetime.strptime(fecha_fin_str, '%Y-%m-%d').toordinal()
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+    resultado = _facturar_rango(almacen, inicio_ordinal, fin_ordinal)
+    if nit_cliente is None:
+        return list(resultado.detalles_consumo)
+    return [d for d in resultado.detalles_consumo if d['nit_cliente'] == nit_cliente]
+
+def generar_resumen_ventas(fecha_inicio_str, fecha_fin_str):
+    """
+    Ingresos del rango agrupados por recurso y por categoría (por nombre),
+    para el reporte de ventas.
+    """
+    return resumen_ventas_versionado(fecha_inicio_str, fecha_fin_str)[1]
+
+def resumen_ventas_versionado(fecha_inicio_str, fecha_fin_str):
+    """
+    (version_datos, resumen): igual que generar_resumen_ventas, junto con
+    la versión de los datos de los que salió (ver AlmacenDatos.version_datos).
+    """
+    inicio_ordinal = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').toordinal()
+    fin_ordinal = datetime.strptime(fecha_fin_str, '%Y-%m-%d').toordinal()
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+    columnas = None
+    with almacen.bloqueo:
+        # Si el rango ya se facturó, el resumen sale de esos detalles
+        resultado = almacen.memo_facturacion.obtener(inicio_ordinal, fin_ordinal, almacen.version_config)
+        if resultado is None and facturacion_columnar.NUMPY_DISPONIBLE:
+            columnas = almacen.columnas_consumo().congelar()
+        version_datos = almacen.version_datos()
+    if columnas is not None:
+        agregados = facturacion_columnar.agregar_rango(columnas, inicio_ordinal, fin_ordinal)
+        return version_datos, {"por_recurso": agregados['por_recurso'], "por_categoria": agregados['por_categoria']}
+    if resultado is None:
+        version_datos, resultado = _facturar_rango_versionado(almacen, inicio_ordinal, fin_ordinal)
+    return version_datos, resultado.resumen_ventas()
+
+AGRUPACIONES_USO = ('cliente', 'instancia', 'recurso', 'categoria', 'dia')
+
+def resumen_uso(fecha_inicio_str, fecha_fin_str, agrupar, nit=None):
     """
-    Agrega un nuevo elemento <recurso> al archivo data.xml.
+    Horas y costo del rango agrupados por cliente, instancia, recurso,
+    categoría o día, leídos de los totales diarios del almacén (no de los
+    consumos). El costo usa las tarifas actuales; como las sumas se hacen
+    en otro orden, puede diferir de la facturación en los últimos decimales.
     """
-    inicializar_xml_si_no_existe()
-    tree = ET.parse(DB_FILE)
-    root = tree.getroot()
-    lista_recursos_node = root.find('listaRecursos')
-    
-    if lista_recursos_node is None:
-        lista_recursos_node = ET.SubElement(root, 'listaRecursos')
+    if agrupar not in AGRUPACIONES_USO:
+        raise ValueError(f"agrupar debe ser uno de: {', '.join(AGRUPACIONES_USO)}")
+    inicio_ordinal = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').toordinal()
+    fin_ordinal = datetime.strptime(fecha_fin_str, '%Y-%m-%d').toordinal()
+    almacen = obtener_almacen()
+    if not almacen.existe(): raise FileNotFoundError("El archivo data.xml no existe.")
+
+    # Con el bloqueo solo se copian las filas del rango y lo necesario para nombrarlas
+    with almacen.bloqueo:
+        agregados = almacen.agregados_uso()
+        if agrupar == 'dia':
+            filas_dia = [(ordinal, dict(fila)) for ordinal, fila in agregados.dias_en_rango(inicio_ordinal, fin_ordinal)]
+        else:
+            horas_por_instancia = agregados.horas_en_rango(inicio_ordinal, fin_ordinal)
+        tarifas = almacen.tabla_tarifas()
+        instancias = dict(almacen.instancias)
+        clientes = dict(almacen.clientes)
+
+    def tarifa_de(clave):
+        instancia = instancias.get(clave)
+        return tarifas.get(instancia.id_configuracion) if instancia is not None else None
+
+    if agrupar == 'dia':
+        filas = []
+        for ordinal, fila in filas_dia:
+            horas_dia = costo_dia = 0.0
+            for clave, horas in fila.items():
+                if nit is not None and clave[0] != nit: continue
+                tarifa = tarifa_de(clave)
+                horas_dia += horas
+                costo_dia += horas * tarifa.total_hora if tarifa else 0.0
+            if horas_dia:
+                filas.append({"fecha": datetime.fromordinal(ordinal).strftime('%Y-%m-%d'),
+                              "horas": horas_dia, "costo": costo_dia})
+        return filas
 
-    nuevo_id = len(lista_recursos_node.findall('recurso')) + 1
-    
-    nuevo_recurso_node = ET.SubElement(lista_recursos_node, 'recurso', id=str(nuevo_id))
+    totales = {}   # clave de grupo -> fila
+    for clave, horas in horas_por_instancia.items():
+        if nit is not None and clave[0] != nit: continue
+        tarifa = tarifa_de(clave)
+        if agrupar == 'recurso':
+            for recurso, cantidad, valor_hora in (tarifa.desglose if tarifa else []):
+                fila = totales.setdefault(recurso.id, {"recurso_id": recurso.id, "recurso_nombre": recurso.nombre,
+                                                       "horas": 0.0, "costo": 0.0})
+                fila["horas"] += horas
+                fila["costo"] += horas * cantidad * valor_hora
+            continue
+        if agrupar == 'cliente':
+            cliente = clientes.get(clave[0])
+            fila = totales.setdefault(clave[0], {"nit_cliente": clave[0], "nombre_cliente": cliente.nombre if cliente else None,
+                                                 "horas": 0.0, "costo": 0.0})
+        elif agrupar == 'instancia':
+            instancia = instancias.get(clave)
+            fila = totales.setdefault(clave, {"nit_cliente": clave[0], "instancia_id": clave[1],
+                                              "instancia_nombre": instancia.nombre if instancia else None,
+                                              "horas": 0.0, "costo": 0.0})
+        else:
+            nombre = tarifa.categoria_nombre if tarifa else None
+            fila = totales.setdefault(nombre, {"categoria_nombre": nombre, "horas": 0.0, "costo": 0.0})
+        fila["horas"] += horas
+        fila["costo"] += horas * tarifa.total_hora if tarifa else 0.0
+    return list(totales.values())
 
-    ET.SubElement(nuevo_recurso_node, 'nombre').text = recurso_data.get('nombre')
-    ET.SubElement(nuevo_recurso_node, 'abreviatura').text = recurso_data.get('abreviatura')
-    ET.SubElement(nuevo_recurso_node, 'metrica').text = recurso_data.get('metrica')
-    ET.SubElement(nuevo_recurso_node, 'tipo').text = recurso_data.get('tipo')
-    ET.SubElement(nuevo_recurso_node, 'valorXhora').text = str(recurso_data.get('valorXhora'))
+def _siguiente_id_recurso(recursos):
+    """El mayor id numérico más uno; los ids cargados pueden no ser contiguos."""
+    return max((int(id_recurso) for id_recurso in recursos if id_recurso and id_recurso.isdecimal()),
+               default=0) + 1
+
+def agregar_recurso(recurso_data):
+    """
+    Agrega un nuevo recurso al almacén y lo persiste en data.xml. Lanza
+    ValueError si el id elegido ya existe; nunca se reemplaza un recurso.
+    """
+    almacen = obtener_almacen()
+    with almacen.modificacion():
+        with almacen.bloqueo:
+            nuevo_id = _siguiente_id_recurso(almacen.recursos)
+            if str(nuevo_id) in almacen.recursos:
+                raise ValueError(f"Ya existe un recurso con id '{nuevo_id}'.")
+            almacen.agregar_recurso(Recurso(
+                str(nuevo_id),
+                nombre=recurso_data.get('nombre'),
+                abreviatura=recurso_data.get('abreviatura'),
+                metrica=recurso_data.get('metrica'),
+                tipo=recurso_data.get('tipo'),
+                valor_x_hora=str(recurso_data.get('valorXhora')),
+            ))
+        almacen.guardar()
 
-    tree.write(DB_FILE, encoding='utf-8', xml_declaration=True)
-    
     recurso_data['id'] = nuevo_id
     return recurso_data
+
+def resetear_datos():
+    """
+    Elimina data.xml y vacía el almacén en memoria.
+    """
+    obtener_almacen().eliminar()
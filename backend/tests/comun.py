@@ -0,0 +1,64 @@
+# --- backend/tests/comun.py ---
+#
+# Ayudas compartidas por las pruebas del backend. Cada prueba trabaja en
+# un directorio temporal propio: nunca toca el data.xml del servidor.
+#
+#   cd backend && python -m unittest discover -t . -s tests
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import generar_datos
+from services.almacen import AlmacenDatos, _entidades_de_elemento
+
+
+def almacen_en(directorio):
+    """Un almacén nuevo (como el de un proceso recién iniciado) sobre `directorio`."""
+    almacen = AlmacenDatos(os.path.join(directorio, 'data.xml'), os.path.join(directorio, 'consumos'))
+    almacen.sincronizar()
+    return almacen
+
+
+def cantidad_consumos(almacen):
+    with almacen.bloqueo:
+        return sum(instancia.cantidad_consumos() for cliente in almacen.clientes.values()
+                   for instancia in cliente.instancias)
+
+
+def consumos_por_instancia(almacen):
+    """{(nit, id_instancia): [(tiempo, fecha_hora)]}, para comparar almacenes."""
+    with almacen.bloqueo:
+        return {(cliente.nit, instancia.id): [(c.tiempo, c.fecha_hora) for c in instancia.consumos]
+                for cliente in almacen.clientes.values() for instancia in cliente.instancias}
+
+
+class PruebaConDirectorio(unittest.TestCase):
+    """Crea un directorio temporal con datos sintéticos (ver generar_datos.py)."""
+
+    CLIENTES = 20
+    INSTANCIAS = 60
+    CONSUMOS = 3000
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix='prueba_backend_')
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        self.ruta_configuracion, self.ruta_consumos = generar_datos.generar(
+            os.path.join(self.directorio, 'entrada'), self.CLIENTES, self.INSTANCIAS, self.CONSUMOS, dias=60)
+
+    def almacen(self):
+        return almacen_en(self.directorio)
+
+    def cargar_configuracion(self, almacen):
+        """Reemplaza la configuración del almacén con la del archivo generado y la guarda."""
+        with almacen.modificacion():
+            almacen.reemplazar_contenido(*_entidades_de_elemento(ET.parse(self.ruta_configuracion).getroot()))
+            almacen.guardar()
+
+    def consumos_generados(self):
+        """[nit, id_instancia, tiempo, fecha_hora] del archivo de consumos generado."""
+        return [[nodo.get('nitCliente'), nodo.get('idInstancia'), nodo.find('tiempo').text,
+                 nodo.find('fechaHora').text]
+                for nodo in ET.parse(self.ruta_consumos).getroot().findall('consumo')]
@@ -0,0 +1,133 @@
+# --- backend/tests/test_almacen.py ---
+#
+# Persistencia del almacén: bitácora, compactación, instantánea y fusión
+# de configuraciones. Cada AlmacenDatos nuevo hace de un proceso recién
+# iniciado sobre los mismos archivos.
+
+import os
+import unittest
+import xml.etree.ElementTree as ET
+
+from services.almacen import _entidades_de_elemento
+from tests.comun import PruebaConDirectorio, cantidad_consumos, consumos_por_instancia
+
+LOTE = 500
+
+
+class PruebaAlmacen(PruebaConDirectorio):
+
+    def setUp(self):
+        super().setUp()
+        self.primero = self.almacen()
+        self.cargar_configuracion(self.primero)
+        self.consumos = self.consumos_generados()
+
+    def registrar(self, almacen, consumos):
+        for inicio in range(0, len(consumos), LOTE):
+            almacen.registrar_consumos(consumos[inicio:inicio + LOTE])
+
+    def test_la_bitacora_se_reaplica_al_reiniciar(self):
+        self.registrar(self.primero, self.consumos)
+        self.assertTrue(self.primero.bitacora.pendientes)
+        # Sin compactar, data.xml no tiene consumos: un proceso nuevo los lee de la bitácora
+        self.assertNotIn(b'consumoRegistrado', open(os.path.join(self.directorio, 'data.xml'), 'rb').read())
+        reiniciado = self.almacen()
+        self.assertEqual(cantidad_consumos(reiniciado), len(self.consumos))
+        self.assertEqual(consumos_por_instancia(reiniciado), consumos_por_instancia(self.primero))
+
+    def test_otro_proceso_adopta_la_compactacion(self):
+        otro = self.almacen()
+        mitad = len(self.consumos) // 2
+        self.registrar(self.primero, self.consumos[:mitad])
+        self.primero.guardar(solo_consumos=True)
+        self.assertEqual(self.primero.bitacora.pendientes, 0)
+
+        cargas = otro._cargas
+        otro.sincronizar()
+        # Solo hubo una compactación: se adopta sin volver a cargar data.xml
+        self.assertEqual(otro._cargas, cargas)
+        self.assertEqual(otro.bitacora.compactado, self.primero.bitacora.compactado)
+        self.assertEqual(consumos_por_instancia(otro), consumos_por_instancia(self.primero))
+
+        # El otro proceso sigue agregando sobre el segmento nuevo y el primero lo lee
+        self.registrar(otro, self.consumos[mitad:])
+        self.primero.sincronizar()
+        self.assertEqual(cantidad_consumos(self.primero), len(self.consumos))
+        self.assertEqual(consumos_por_instancia(self.primero), consumos_por_instancia(otro))
+
+    def test_instantanea_igual_que_xml(self):
+        self.registrar(self.primero, self.consumos)
+        self.primero.compactar_todo()
+
+        desde_instantanea = self.almacen()
+        self.assertIsNotNone(desde_instantanea._instantanea)
+        os.remove(os.path.join(self.directorio, 'data.xml.instantanea'))
+        desde_xml = self.almacen()
+        self.assertIsNone(desde_xml._instantanea)
+
+        # Los consumos diferidos se construyen recién aquí, igual que al usarlos
+        self.assertEqual(consumos_por_instancia(desde_instantanea), consumos_por_instancia(desde_xml))
+        self.assertEqual(ET.tostring(desde_instantanea.a_elemento()), ET.tostring(desde_xml.a_elemento()))
+        self.assertEqual(desde_instantanea.consumos_sin_fecha(), desde_xml.consumos_sin_fecha())
+
+    def test_fusion_se_aplica_en_todos_los_procesos(self):
+        self.registrar(self.primero, self.consumos)
+        otro = self.almacen()
+        nit, cliente = next(iter(self.primero.clientes.items()))
+        id_instancia = cliente.instancias[0].id
+        consumos_antes = cliente.instancias[0].cantidad_consumos()
+        carga = f"""<archivoConfiguraciones><listaRecursos/><listaCategorias/><listaClientes>
+            <cliente nit="{nit}"><nombre>Nombre nuevo</nombre><listaInstancias>
+                <instancia id="{id_instancia}"><nombre>Instancia renombrada</nombre></instancia>
+                <instancia id="nueva"><idConfiguracion>1</idConfiguracion><nombre>Nueva</nombre></instancia>
+            </listaInstancias></cliente>
+            <cliente nit="9999999-9"><nombre>Cliente nuevo</nombre><listaInstancias/></cliente>
+        </listaClientes></archivoConfiguraciones>"""
+        with self.primero.modificacion():
+            resumen = self.primero.fusionar_contenido(*_entidades_de_elemento(ET.fromstring(carga)))
+        self.assertEqual(resumen["nuevos"]["clientes"], 1)
+        self.assertEqual(resumen["nuevos"]["instancias"], 1)
+        self.assertEqual(resumen["actualizados"]["instancias"], 1)
+
+        instancia = self.primero.buscar_instancia(nit, id_instancia)
+        self.assertEqual(instancia.nombre, "Instancia renombrada")
+        # La instancia conserva sus consumos
+        self.assertEqual(instancia.cantidad_consumos(), consumos_antes)
+
+        # La fusión llega por la bitácora a un proceso que ya estaba cargado y a uno nuevo,
+        # antes y después de compactar
+        otro.sincronizar()
+        esperado = ET.tostring(self.primero.a_elemento())
+        self.assertEqual(ET.tostring(otro.a_elemento()), esperado)
+        self.assertEqual(ET.tostring(self.almacen().a_elemento()), esperado)
+        self.primero.compactar_todo()
+        self.assertEqual(ET.tostring(self.almacen().a_elemento()), esperado)
+
+    def test_fusion_conserva_los_campos_que_no_vienen(self):
+        nit, cliente = next(iter(self.primero.clientes.items()))
+        instancia = cliente.instancias[0]
+        antes_cliente = (cliente.usuario, cliente.clave, cliente.direccion, cliente.correo_electronico)
+        antes_instancia = (instancia.id_configuracion, instancia.fecha_inicio, instancia.estado,
+                           instancia.fecha_final)
+        self.assertNotIn(None, antes_cliente + antes_instancia)
+        carga = f"""<archivoConfiguraciones><listaClientes>
+            <cliente nit="{nit}"><nombre>Solo el nombre</nombre><direccion></direccion><listaInstancias>
+                <instancia id="{instancia.id}"><estado>CANCELADA</estado></instancia>
+            </listaInstancias></cliente>
+        </listaClientes></archivoConfiguraciones>"""
+        with self.primero.modificacion():
+            self.primero.fusionar_contenido(*_entidades_de_elemento(ET.fromstring(carga)))
+
+        for almacen in (self.primero, self.almacen()):
+            cliente = almacen.clientes[nit]
+            instancia = almacen.buscar_instancia(nit, instancia.id)
+            self.assertEqual(cliente.nombre, "Solo el nombre")
+            self.assertEqual((cliente.usuario, cliente.clave, cliente.direccion, cliente.correo_electronico),
+                             antes_cliente)
+            self.assertEqual(instancia.estado, "CANCELADA")
+            self.assertEqual((instancia.id_configuracion, instancia.fecha_inicio, instancia.fecha_final),
+                             antes_instancia[:2] + antes_instancia[3:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# --- backend/tests/test_bitacora_multiproceso.py ---
+#
+# Varios procesos registran consumos en la misma bitácora mientras cada
+# uno compacta por su cuenta, como varios workers del servidor. Todo
+# consumo confirmado debe quedar en disco.
+
+import multiprocessing
+import threading
+import time
+import unittest
+
+from tests.comun import PruebaConDirectorio, almacen_en, cantidad_consumos
+
+PROCESOS = 4
+LOTES_POR_PROCESO = 400
+
+
+def _registrar(directorio, numero, confirmados):
+    almacen = almacen_en(directorio)
+    nits = list(almacen.clientes)
+    detener = threading.Event()
+
+    def compactar():
+        # Compacta seguido, para que las compactaciones se crucen con las cargas de los demás
+        while not detener.is_set():
+            almacen.compactar_si_hay_pendientes()
+            time.sleep(0.002)
+
+    hilo = threading.Thread(target=compactar)
+    hilo.start()
+    registrados = 0
+    try:
+        for i in range(LOTES_POR_PROCESO):
+            nit = nits[(numero + i) % len(nits)]
+            almacen.registrar_consumos([[nit, almacen.clientes[nit].instancias[0].id,
+                                         str(numero + 1), '01/01/2023 10:00']])
+            registrados += 1
+    finally:
+        detener.set()
+        hilo.join()
+        confirmados.put(registrados)
+
+
+class PruebaCargaMultiproceso(PruebaConDirectorio):
+    CONSUMOS = 0
+
+    def test_lo_confirmado_queda_en_disco(self):
+        self.cargar_configuracion(self.almacen())
+        contexto = multiprocessing.get_context('spawn')
+        confirmados = contexto.Queue()
+        procesos = [contexto.Process(target=_registrar, args=(self.directorio, numero, confirmados))
+                    for numero in range(PROCESOS)]
+        for proceso in procesos:
+            proceso.start()
+        total_confirmado = sum(confirmados.get(timeout=300) for _ in procesos)
+        for proceso in procesos:
+            proceso.join()
+            self.assertEqual(proceso.exitcode, 0)
+        self.assertEqual(total_confirmado, PROCESOS * LOTES_POR_PROCESO)
+
+        # Un proceso nuevo lee lo mismo antes y después de compactar todo
+        almacen = self.almacen()
+        self.assertEqual(cantidad_consumos(almacen), total_confirmado)
+        almacen.compactar_todo()
+        self.assertEqual(cantidad_consumos(self.almacen()), total_confirmado)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# --- backend/tests/test_corridas.py ---
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from services.corridas import AlmacenCorridas
+
+FACTURAS = [{"numero_factura": 1, "nit_cliente": "1"}]
+DETALLES = [{"nit_cliente": "1", "costo_total_consumo": 1.0}]
+
+
+class PruebaCorridas(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix='prueba_corridas_')
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        self.corridas = AlmacenCorridas(self.directorio, max_corridas=2)
+
+    def crear(self):
+        return self.corridas.crear('2023-01-01', '2023-01-31', FACTURAS, DETALLES)
+
+    def test_purga_las_mas_antiguas(self):
+        ids = [self.crear() for _ in range(2)]
+        for i, id_corrida in enumerate(ids):
+            os.utime(os.path.join(self.directorio, id_corrida), (i, i))
+        ultima = self.crear()
+        self.assertEqual(sorted(os.listdir(self.directorio)), sorted([ids[1], ultima]))
+
+    def test_una_corrida_que_otro_proceso_purga_no_hace_fallar(self):
+        ids = [self.crear() for _ in range(2)]
+        getmtime = os.path.getmtime
+
+        def purgada_por_otro(ruta):
+            # Otro proceso la borra entre listar el directorio y leer su fecha
+            if ruta.endswith(ids[0]):
+                shutil.rmtree(ruta)
+            return getmtime(ruta)
+
+        with mock.patch('services.corridas.os.path.getmtime', side_effect=purgada_por_otro):
+            ultima = self.crear()
+        self.assertEqual(self.corridas.factura(ultima, 1)['detalles_consumo'], DETALLES)
+        self.assertEqual(sorted(os.listdir(self.directorio)), sorted([ids[1], ultima]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# --- backend/tests/test_facturacion.py ---
+#
+# Las rutas de facturación (vectorizada, en Python puro y repartida entre
+# procesos) deben dar exactamente el mismo resultado.
+
+import unittest
+from datetime import date
+from unittest import mock
+
+from services import facturacion_columnar
+from services.xml_manager import _facturar_rango
+from tests.comun import PruebaConDirectorio
+
+
+class PruebaFacturacion(PruebaConDirectorio):
+    CONSUMOS = 5000
+
+    def setUp(self):
+        super().setUp()
+        self.almacen_datos = self.almacen()
+        self.cargar_configuracion(self.almacen_datos)
+        self.almacen_datos.registrar_consumos(self.consumos_generados())
+        # Un rango que deja consumos fuera por ambos lados
+        self.rango = (date(2023, 1, 10).toordinal(), date(2023, 2, 15).toordinal())
+
+    def facturar(self, trabajadores):
+        self.almacen_datos.memo_facturacion.vaciar()
+        resultado = _facturar_rango(self.almacen_datos, *self.rango, trabajadores)
+        return [(cliente.nit, monto) for cliente, monto in resultado.montos], resultado.detalles_consumo
+
+    def test_las_rutas_dan_lo_mismo(self):
+        with mock.patch.object(facturacion_columnar, 'NUMPY_DISPONIBLE', False):
+            montos, detalles = self.facturar(0)
+        self.assertTrue(detalles)
+        self.assertTrue(any(monto > 0 for _, monto in montos))
+        self.assertEqual(self.facturar(2), (montos, detalles))
+        if facturacion_columnar.NUMPY_DISPONIBLE:
+            self.assertEqual(self.facturar(0), (montos, detalles))
+            # Con bloques chicos la selección junta varios bloques de columnas
+            with mock.patch.object(facturacion_columnar, 'FILAS_POR_BLOQUE', 64):
+                self.almacen_datos._columnas = None
+                self.assertEqual(self.facturar(0), (montos, detalles))
+
+
+if __name__ == '__main__':
+    unittest.main()
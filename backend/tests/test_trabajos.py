@@ -0,0 +1,59 @@
+# --- backend/tests/test_trabajos.py ---
+
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from services.trabajos import ColaTrabajos, ERROR
+
+
+def futuro_con_error():
+    futuro = Future()
+    futuro.set_exception(RuntimeError("falló el dibujo"))
+    return futuro
+
+
+class PruebaTrabajos(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix='prueba_trabajos_')
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        self.cola = ColaTrabajos(self.directorio)
+
+    def registrar(self, ruta=None):
+        """Registra un trabajo pendiente sin pasar por el pool, con su PDF escrito a medias."""
+        id_trabajo = 'a' * 32
+        propio = ruta is None
+        if propio:
+            ruta = self.cola._ruta_trabajo(id_trabajo, 'pdf')
+        self.cola._registrar(id_trabajo, 'detalle', 'pendiente', ruta, 'f.pdf', propio)
+        with open(ruta, 'wb') as archivo:
+            archivo.write(b'%PDF-1.4 a medias')
+        return id_trabajo, ruta
+
+    def test_error_borra_el_pdf_propio(self):
+        id_trabajo, ruta = self.registrar()
+        self.cola._al_terminar(id_trabajo, futuro_con_error(), None)
+        self.assertFalse(os.path.exists(ruta))
+        self.assertEqual(self.cola.estado(id_trabajo)["estado"], ERROR)
+
+    def test_error_borra_el_pdf_para_la_cache(self):
+        id_trabajo, ruta = self.registrar(os.path.join(self.directorio, 'cache.pdf.tmp'))
+        al_terminar = mock.Mock()
+        self.cola._al_terminar(id_trabajo, futuro_con_error(), al_terminar)
+        al_terminar.assert_not_called()
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_descarga_de_un_pdf_borrado(self):
+        import app as aplicacion
+        id_trabajo = self.cola.registrar_terminado('detalle', os.path.join(self.directorio, 'no.pdf'), 'f.pdf')
+        with mock.patch.object(aplicacion, 'obtener_cola', return_value=self.cola):
+            respuesta = aplicacion.app.test_client().get(f'/api/trabajos/{id_trabajo}/descarga')
+        self.assertEqual(respuesta.status_code, 410)
+
+
+if __name__ == '__main__':
+    unittest.main()
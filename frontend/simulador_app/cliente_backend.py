@@ -0,0 +1,61 @@
+# --- frontend/simulador_app/cliente_backend.py ---
+#
+# Cliente HTTP compartido para hablar con el backend Flask. Todas las
+# vistas usan la misma sesión de requests, que mantiene un pool de
+# conexiones keep-alive en lugar de abrir una conexión TCP por petición.
+# La URL base, los tiempos de espera y los reintentos salen de settings
+# (BACKEND_API_*). Las respuestas comprimidas con gzip se descomprimen
+# solas: requests envía Accept-Encoding: gzip y las decodifica.
+
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_sesion = None
+_bloqueo_sesion = threading.Lock()
+
+
+def _crear_sesion():
+    reintentos = Retry(
+        total=settings.BACKEND_API_REINTENTOS,
+        # Un error al conectar siempre se reintenta: la petición no llegó al backend.
+        # Los errores de lectura y los 502/503/504 solo en GET, que no modifica datos.
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        status_forcelist=(502, 503, 504),
+        backoff_factor=0.2,
+        raise_on_status=False,
+    )
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=settings.BACKEND_API_CONEXIONES,
+                            max_retries=reintentos)
+    sesion = requests.Session()
+    sesion.mount('http://', adaptador)
+    sesion.mount('https://', adaptador)
+    return sesion
+
+
+def obtener_sesion():
+    """Sesión compartida por todas las vistas; el pool de urllib3 admite varios hilos."""
+    global _sesion
+    with _bloqueo_sesion:
+        if _sesion is None:
+            _sesion = _crear_sesion()
+        return _sesion
+
+
+def _url(ruta):
+    return f"{settings.BACKEND_API_URL.rstrip('/')}/{ruta.lstrip('/')}"
+
+
+def get(ruta, **kwargs):
+    """GET a una ruta del API (por ejemplo '/consultarDatos')."""
+    kwargs.setdefault('timeout', settings.BACKEND_API_TIMEOUT)
+    return obtener_sesion().get(_url(ruta), **kwargs)
+
+
+def post(ruta, **kwargs):
+    """POST a una ruta del API (por ejemplo '/generarFactura')."""
+    kwargs.setdefault('timeout', settings.BACKEND_API_TIMEOUT)
+    return obtener_sesion().post(_url(ruta), **kwargs)
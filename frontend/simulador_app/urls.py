@@ -9,6 +9,7 @@ urlpatterns = [
     path('consultar-datos/', views.pagina_consulta, name='consulta_datos'),
     path('generar-reporte-ventas/', views.generar_reporte_ventas, name='generar_reporte_ventas'),
     path('detalle-factura/', views.detalle_factura, name='detalle_factura'),
+    path('facturas-lote/', views.facturas_lote, name='facturas_lote'),
     path('ayuda/estudiante/', views.pagina_info_estudiante, name='info_estudiante'),
 
 ]
\ No newline at end of file
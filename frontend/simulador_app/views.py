@@ -1,18 +1,66 @@
 # --- frontend/simulador_app/views.py ---
 
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 import requests
 import json
+import time
+from urllib.parse import urlencode
 
-# --- URLs de los Endpoints del Backend ---
-API_URL_CONFIG = 'http://127.0.0.1:5000/api/cargarConfiguracion'
-API_URL_CONSUMO = 'http://127.0.0.1:5000/api/registrarConsumo'
-API_URL_CONSULTA = 'http://127.0.0.1:5000/api/consultarDatos'
-API_URL_FACTURA = 'http://127.0.0.1:5000/api/generarFactura'
-API_URL_RESETEAR = 'http://127.0.0.1:5000/api/resetear'
-API_URL_DETALLE_FACTURA = 'http://127.0.0.1:5000/api/detalleFactura'
-API_URL_REPORTE_VENTAS = 'http://127.0.0.1:5000/api/reporteVentas'
+from . import cliente_backend as backend
+
+# --- Rutas de los Endpoints del Backend (la URL base está en settings) ---
+RUTA_CONFIG = '/cargarConfiguracion'
+RUTA_CONSUMO = '/registrarConsumo'
+RUTA_CONSULTA = '/consultarDatos'
+RUTA_FACTURA = '/generarFactura'
+RUTA_RESETEAR = '/resetear'
+RUTA_TRABAJOS = '/trabajos'
+RUTA_FACTURAS_LOTE = '/facturasLote'
+
+# --- Sondeo de trabajos de PDF en el backend ---
+INTERVALO_SONDEO = 0.5     # segundos entre consultas de estado
+LIMITE_ESPERA_PDF = 120    # segundos máximos esperando un PDF
+TAMANO_BLOQUE_DESCARGA = 64 * 1024
+CLIENTES_POR_PAGINA = 50
+
+
+def _obtener_pdf_por_trabajo(tipo, payload):
+    """
+    Encola la generación del PDF en el backend, consulta el estado del
+    trabajo hasta que deja de estar pendiente y devuelve la respuesta de
+    la descarga. El backend queda libre mientras se dibuja el PDF.
+    """
+    response = backend.post(f"{RUTA_TRABAJOS}/{tipo}", json=payload)
+    if response.status_code != 202:
+        return response
+    id_trabajo = response.json()['id_trabajo']
+    limite = time.monotonic() + LIMITE_ESPERA_PDF
+    while time.monotonic() < limite:
+        estado = backend.get(f"{RUTA_TRABAJOS}/{id_trabajo}").json()
+        if estado.get('estado') != 'pendiente':
+            break
+        time.sleep(INTERVALO_SONDEO)
+    return backend.get(f"{RUTA_TRABAJOS}/{id_trabajo}/descarga", stream=True)
+
+
+def _respuesta_descarga(response, content_type, nombre_archivo):
+    """
+    Pasa al navegador el cuerpo de una respuesta del backend pedida con
+    stream=True, por bloques y sin cargarlo completo en memoria.
+    """
+    def bloques():
+        try:
+            yield from response.iter_content(TAMANO_BLOQUE_DESCARGA)
+        finally:
+            response.close()
+
+    respuesta = StreamingHttpResponse(bloques(), content_type=content_type)
+    respuesta['Content-Disposition'] = content_disposition_header(True, nombre_archivo)
+    if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+        respuesta['Content-Length'] = response.headers['Content-Length']
+    return respuesta
 
 
 # --- Vista Principal (Página de Inicio) ---
@@ -23,30 +71,34 @@ def pagina_inicio(request):
     context = {}
     if request.method == 'POST':
         form_type = request.POST.get('form_type')
-        api_url = ''
+        ruta = ''
         headers = {}
         payload = None
 
         # --- Lógica para cada tipo de formulario ---
         if form_type == 'configuracion' and 'archivo_config' in request.FILES:
-            api_url = API_URL_CONFIG
+            ruta = RUTA_CONFIG
+            if request.POST.get('fusionar'):
+                # Agrega o actualiza sobre lo existente y conserva los consumos ya registrados
+                ruta = f"{RUTA_CONFIG}?modo=fusionar"
             payload = request.FILES['archivo_config'].read()
             headers = {'Content-Type': 'application/xml; charset=utf-8'}
         
         elif form_type == 'consumo' and 'archivo_consumo' in request.FILES:
-            api_url = API_URL_CONSUMO
+            ruta = RUTA_CONSUMO
             payload = request.FILES['archivo_consumo'].read()
             headers = {'Content-Type': 'application/xml; charset=utf-8'}
 
         elif form_type == 'facturacion':
-            api_url = API_URL_FACTURA
+            ruta = RUTA_FACTURA
             fecha_inicio = request.POST.get('fecha_inicio')
             fecha_fin = request.POST.get('fecha_fin')
-            payload = json.dumps({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin})
+            # Los detalles quedan en la corrida del backend; no hace falta recibirlos
+            payload = json.dumps({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "incluir_detalles": False})
             headers = {'Content-Type': 'application/json'}
 
         elif form_type == 'resetear':
-            api_url = API_URL_RESETEAR
+            ruta = RUTA_RESETEAR
             payload = None
             headers = {}
         
@@ -57,7 +109,7 @@ def pagina_inicio(request):
 
         # --- Lógica común de envío de petición y manejo de respuesta ---
         try:
-            response = requests.post(api_url, data=payload, headers=headers)
+            response = backend.post(ruta, data=payload, headers=headers)
             data_respuesta = response.json()
 
             if response.status_code in [200, 201]:
@@ -68,11 +120,10 @@ def pagina_inicio(request):
                 if 'resumen_de_carga' in data_respuesta: context['resumen'] = json.dumps(data_respuesta['resumen_de_carga'], indent=4)
                 if 'resumen_del_proceso' in data_respuesta: context['resumen'] = json.dumps(data_respuesta['resumen_del_proceso'], indent=4)
                 
-                # Si se generaron facturas, las mostramos y las guardamos en la sesión
+                # Si se generaron facturas, las mostramos; la sesión solo guarda el id de la corrida
                 if 'facturas' in data_respuesta:
                     context['facturas'] = data_respuesta['facturas']
-                    request.session['facturas_generadas'] = data_respuesta.get('facturas', [])
-                    request.session['detalles_facturacion'] = data_respuesta.get('detalles_consumo', [])
+                    request.session['id_corrida'] = data_respuesta.get('id_corrida')
             else:
                 context['tipo_mensaje'] = 'error'
                 context['mensaje'] = f"Error del backend (Código: {response.status_code})"
@@ -88,29 +139,25 @@ def pagina_inicio(request):
 # --- Vista para Consultar Datos ---
 def pagina_consulta(request):
     """
-    Obtiene todos los datos del backend y los prepara para ser mostrados en la plantilla.
+    Obtiene una página de datos del backend, con los filtros del formulario,
+    y la muestra en la plantilla. Los consumos no se piden porque la página
+    no los muestra.
     """
     context = {}
+    filtros = {k: request.GET[k] for k in ('nit', 'estado', 'tipoRecurso') if request.GET.get(k)}
+    params = {"limite": CLIENTES_POR_PAGINA, "excluir": "listaConsumos,listaCategorias", **filtros}
+    if request.GET.get('cursor'):
+        params['cursor'] = request.GET['cursor']
+    context['filtros'] = filtros
     try:
-        response = requests.get(API_URL_CONSULTA)
+        response = backend.get(RUTA_CONSULTA, params=params)
         if response.status_code == 200:
             datos_json = response.json()
-            config = datos_json.get('archivoConfiguraciones', {})
-            
-            # Lógica para asegurar que los elementos a iterar siempre sean listas
-            if 'listaClientes' in config and 'cliente' in config['listaClientes']:
-                clientes_data = config['listaClientes']['cliente']
-                if not isinstance(clientes_data, list): config['listaClientes']['cliente'] = [clientes_data]
-                for cliente in config['listaClientes']['cliente']:
-                    if 'listaInstancias' in cliente and 'instancia' in cliente['listaInstancias']:
-                        instancias_data = cliente['listaInstancias']['instancia']
-                        if not isinstance(instancias_data, list): cliente['listaInstancias']['instancia'] = [instancias_data]
-            
-            if 'listaRecursos' in config and 'recurso' in config['listaRecursos']:
-                 recursos_data = config['listaRecursos']['recurso']
-                 if not isinstance(recursos_data, list): config['listaRecursos']['recurso'] = [recursos_data]
-
+            # El backend ya devuelve siempre listas; no hace falta normalizar
             context['datos'] = datos_json
+            siguiente_cursor = datos_json.get('paginacion', {}).get('siguiente_cursor')
+            if siguiente_cursor:
+                context['siguiente_pagina'] = urlencode({**filtros, "cursor": siguiente_cursor})
         else:
             context['error'] = f"Error del backend (Código: {response.status_code}): {response.json().get('error')}"
     except requests.exceptions.RequestException as e:
@@ -130,11 +177,9 @@ def generar_reporte_ventas(request):
         payload = {"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin}
         
         try:
-            response = requests.post(API_URL_REPORTE_VENTAS, json=payload)
+            response = _obtener_pdf_por_trabajo('reporteVentas', payload)
             if response.status_code == 200:
-                response_pdf = HttpResponse(response.content, content_type='application/pdf')
-                response_pdf['Content-Disposition'] = 'attachment; filename="reporte_ventas.pdf"'
-                return response_pdf
+                return _respuesta_descarga(response, 'application/pdf', 'reporte_ventas.pdf')
             else:
                 return HttpResponse(f"Error del backend: {response.text}", status=500)
         except requests.exceptions.RequestException as e:
@@ -145,30 +190,22 @@ def generar_reporte_ventas(request):
 # --- Vista para Generar Detalle de Factura en PDF ---
 def detalle_factura(request):
     """
-    Recupera los datos de la sesión y solicita un PDF con el detalle de una factura específica.
+    Solicita el PDF con el detalle de una factura de la corrida guardada en la sesión.
     """
     if request.method == 'POST':
         numero_factura = request.POST.get('numero_factura')
-        
-        facturas_generadas = request.session.get('facturas_generadas', [])
-        todos_los_detalles = request.session.get('detalles_facturacion', [])
-        
-        factura_info = next((f for f in facturas_generadas if str(f['numero_factura']) == numero_factura), None)
-        
-        if not factura_info:
+        id_corrida = request.session.get('id_corrida')
+
+        if not id_corrida or not numero_factura:
             return HttpResponse("Error: No se encontró la información de la factura en la sesión.", status=404)
 
-        nit_cliente_factura = factura_info['nit_cliente']
-        detalles_filtrados = [d for d in todos_los_detalles if d['nit_cliente'] == nit_cliente_factura]
-        
-        payload = { "factura_info": factura_info, "detalles_consumo": detalles_filtrados }
+        # El backend busca la factura y sus detalles en la corrida guardada
+        payload = {"id_corrida": id_corrida, "numero_factura": numero_factura}
 
         try:
-            response = requests.post(API_URL_DETALLE_FACTURA, json=payload)
+            response = _obtener_pdf_por_trabajo('detalleFactura', payload)
             if response.status_code == 200:
-                response_pdf = HttpResponse(response.content, content_type='application/pdf')
-                response_pdf['Content-Disposition'] = f'attachment; filename="factura_{numero_factura}.pdf"'
-                return response_pdf
+                return _respuesta_descarga(response, 'application/pdf', f"factura_{numero_factura}.pdf")
             else:
                 return HttpResponse(f"Error del backend: {response.text}", status=500)
         except requests.exceptions.RequestException as e:
@@ -176,5 +213,28 @@ def detalle_factura(request):
             
     return HttpResponse("Método no permitido", status=405)
 
+# --- Vista para Descargar Todas las Facturas en un ZIP ---
+def facturas_lote(request):
+    """
+    Pide al backend el ZIP con el PDF de cada factura de la corrida cuyo id
+    está en la sesión.
+    """
+    if request.method == 'POST':
+        id_corrida = request.session.get('id_corrida')
+        if not id_corrida:
+            return HttpResponse("Error: No hay facturas generadas en la sesión.", status=404)
+
+        payload = {"id_corrida": id_corrida}
+        try:
+            response = backend.post(RUTA_FACTURAS_LOTE, json=payload, stream=True)
+            if response.status_code == 200:
+                return _respuesta_descarga(response, 'application/zip', 'facturas.zip')
+            else:
+                return HttpResponse(f"Error del backend: {response.text}", status=500)
+        except requests.exceptions.RequestException as e:
+            return HttpResponse(f"Error de conexión: {e}", status=500)
+
+    return HttpResponse("Método no permitido", status=405)
+
 def pagina_info_estudiante(request):
     return render(request, 'simulador_app/ayuda_estudiante.html')
\ No newline at end of file
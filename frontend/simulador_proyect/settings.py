@@ -121,3 +121,11 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Backend (Flask) consumido por las vistas; ver simulador_app/cliente_backend.py
+
+BACKEND_API_URL = 'http://127.0.0.1:5000/api'
+BACKEND_API_TIMEOUT = (3.05, 120)   # segundos para conectar y para esperar cada lectura
+BACKEND_API_REINTENTOS = 2
+BACKEND_API_CONEXIONES = 10         # conexiones keep-alive que se conservan en el pool